@@ -1,44 +1,76 @@
 import os
-import threading
-import requests
-import time
-
-from flask import Flask, jsonify
-from services.weather import weather_blueprint
-from services.train import train_blueprint
-from services.restaurant import restaurant_blueprint
-from services.hotel import hotel_blueprint
-from services.flight import flight_blueprint
-from services.attraction import places_blueprint
-from services.car import car_blueprint
+import sys
+
+from dotenv import load_dotenv
+
+# 各服务模块在导入时读取配置，所以 .env 要在导入它们之前加载（只加载这一次）
+load_dotenv()
+
+from flask import Flask, jsonify, request
+from services import batch, blueprints, hooks, lifecycle, logs, metrics, ratelimit
+
+logs.setup_logging()
+
 app = Flask(__name__)
+hooks.install(app)
+
+# 注册不同的蓝图（清单见 services/blueprints.py；LAZY_BLUEPRINTS=1 时第一次请求才导入）
+blueprints.install(app)
 
-# 注册不同的蓝图
-app.register_blueprint(weather_blueprint, url_prefix='/weather')
-app.register_blueprint(train_blueprint, url_prefix='/train')
-app.register_blueprint(restaurant_blueprint, url_prefix='/restaurants')
-app.register_blueprint(hotel_blueprint, url_prefix='/hotel')
-app.register_blueprint(flight_blueprint, url_prefix='/flight')
-app.register_blueprint(places_blueprint, url_prefix='/attraction')
-app.register_blueprint(car_blueprint, url_prefix='/car')
-
-PING_URL = "https://api-for-travalapp.onrender.com" 
-
-def auto_ping():
-    while True:
-        try:
-            response = requests.get(PING_URL)
-            print(f"Auto-ping réussi : {response.status_code}")
-        except Exception as e:
-            print(f"Erreur d'auto-ping : {e}")
-        time.sleep(30)  # Ping toutes les 30 secondes
-
-threading.Thread(target=auto_ping, daemon=True).start()
-# 默认根目录内容   
+# 启动时恢复缓存快照并加载机场表、城市表；gunicorn.conf.py 开启 preload_app，
+# 这一步在 master fork 之前执行一次，所有 worker 共享。按需加载蓝图时不预加载数据表
+lifecycle.warm_start(preload_tables=not blueprints.LAZY_BLUEPRINTS)
+
+# 默认根目录内容
 @app.route('/')
 def home():
     return jsonify({"message": "Welcome to the Travel App API! Use specific endpoints such as /weather to get information."})
 
+# 就绪检查：缓存快照和本地数据表加载完成后返回 200
+@app.route('/ready')
+def ready():
+    if not lifecycle.is_ready():
+        return jsonify({"ready": False}), 503
+    return jsonify({"ready": True, **lifecycle.stats(), "blueprints": blueprints.load_report()})
+
+# 缓存命中率等运行统计；按需加载蓝图时只包含已经导入的模块
+STATS = (
+    ('geocoding', 'services.geocoding', 'stats'),
+    ('places', 'services.foursquare', 'cache_stats'),
+    ('photos', 'services.foursquare', 'photo_cache_stats'),
+    ('place_store', 'services.place_store', 'stats'),
+    ('car', 'services.car', 'cache_stats'),
+    ('train', 'services.train', 'cache_stats'),
+    ('weather', 'services.weather', 'cache_stats'),
+    ('upstream', 'services.upstream', 'stats'),
+    ('coalescing', 'services.upstream', 'coalesce_stats'),
+)
+
+@app.route('/stats')
+def stats():
+    result = {
+        name: getattr(sys.modules[module], fn)()
+        for name, module, fn in STATS if module in sys.modules
+    }
+    result["rate_limits"] = ratelimit.stats()
+    result["lifecycle"] = lifecycle.stats()
+    return jsonify(result)
+
+# Prometheus 指标，汇总所有 gunicorn worker
+@app.route('/metrics')
+def prometheus_metrics():
+    return app.response_class(metrics.render(), content_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
+# 一次 HTTP 请求里执行多个子请求，减少移动端的往返次数
+@app.route('/batch', methods=['POST'])
+def run_batch():
+    items = request.get_json(silent=True)
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Please provide a JSON array of sub-requests"}), 400
+    if len(items) > batch.BATCH_MAX_REQUESTS:
+        return jsonify({"error": f"At most {batch.BATCH_MAX_REQUESTS} sub-requests per batch"}), 400
+    return jsonify(batch.run_batch(app, items, batch.forwarded_headers(request.headers)))
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))  # 使用 PORT 环境变量
     app.run(host='0.0.0.0', debug=True, port=port)
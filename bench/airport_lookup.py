@@ -0,0 +1,88 @@
+"""
+机场查询基准测试：旧的“下载 + 逐行扫描”路径 vs 内存列式索引
+
+用法：
+    python -m bench.airport_lookup [--data PATH] [--repeat N] [CITY ...]
+
+旧路径从本地 HTTP 服务下载快照（不经过公网），因此测到的是它的下限。
+"""
+import argparse
+import functools
+import os
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from services import airports
+
+
+def legacy_get_airport_info(url, city):
+    """旧实现：每次查询都下载整个 airports.dat 并线性扫描"""
+    try:
+        response = requests.get(url)
+        if response.status_code == 200:
+            for airport in response.text.split("\n"):
+                fields = airport.split(",")
+                if len(fields) > 6:
+                    airport_name = fields[1].replace('"', '')
+                    city_name = fields[2].replace('"', '')
+                    lat, lon = fields[6], fields[7]
+                    if city.lower() == city_name.lower():
+                        return airport_name, float(lat), float(lon)
+        return "No Airport Found", None, None
+    except Exception:
+        return "No Airport Found", None, None
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve_directory(directory):
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def timed(fn, cities, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for city in cities:
+            fn(city)
+    return (time.perf_counter() - start) / (repeat * len(cities))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default=airports.AIRPORTS_DATA_PATH)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('cities', nargs='*', default=['Paris', 'Nice', 'New York', 'London'])
+    args = parser.parse_args()
+
+    if not os.path.exists(args.data):
+        parser.error(f"{args.data} not found, run `python -m services.airports refresh` first")
+
+    server = serve_directory(os.path.dirname(os.path.abspath(args.data)))
+    url = f"http://127.0.0.1:{server.server_port}/{os.path.basename(args.data)}"
+
+    start = time.perf_counter()
+    table = airports.load_table(args.data)
+    load_time = time.perf_counter() - start
+    airports.set_table(table)
+
+    legacy = timed(functools.partial(legacy_get_airport_info, url), args.cities, args.repeat)
+    indexed = timed(airports.get_airport_info, args.cities, args.repeat * 1000)
+    server.shutdown()
+
+    print(f"airports loaded:       {len(table)} rows in {load_time * 1000:.1f} ms")
+    print(f"download-and-scan:     {legacy * 1000:10.3f} ms/lookup")
+    print(f"in-memory index:       {indexed * 1e6:10.3f} us/lookup")
+    print(f"speedup:               {legacy / indexed:10.0f}x")
+
+
+if __name__ == "__main__":
+    main()
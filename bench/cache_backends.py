@@ -0,0 +1,167 @@
+"""
+缓存后端检查与基准：memory、sqlite、redis 三种 CACHE_BACKEND 的行为和读取速度
+
+用法：
+    python -m bench.cache_backends [--backends memory,sqlite,redis] [--redis-url redis://...]
+                                   [--rounds 20000]
+
+对每个后端检查读写、None 值、过期、删除、清空、条目数上限，
+共享后端（sqlite、redis）还检查另一个进程写入的条目能否读到、Redis 不可用时是否按未命中处理。
+没有指定 --redis-url 时使用本地替身（bench/fake_redis.py）。
+之后测量缓存命中的读取耗时，以及同一个值用 JSON 和缓存的二进制格式解析的耗时。
+任何检查失败时退出码为 1。
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from bench import fake_redis
+from services import cache_backends
+from services.cache import MISSING, TTLCache
+from services.cache_backends import RedisCache, RespClient, SQLiteCache
+
+# 与地点列表缓存条目差不多大小的值：20 个地点
+SAMPLE = [
+    {"fsq_id": f"4b{i:022d}", "name": f"Hotel {i}", "categories": [{"id": 19014, "name": "Hotel"}],
+     "location": {"address": f"{i} Rue de Rivoli", "locality": "Paris", "postcode": "75001", "country": "FR"},
+     "geocodes": {"main": {"latitude": 48.86 + i / 1000, "longitude": 2.35 - i / 1000}},
+     "distance": 120 * i, "tel": "+33 1 23 45 67 89", "website": None}
+    for i in range(20)
+]
+
+
+def _write_from_child(factory, key, value):
+    factory().set(key, value)
+
+
+def check(name, factory, shared):
+    """返回失败的检查项列表"""
+    failures = []
+
+    def expect(label, condition):
+        if not condition:
+            failures.append(label)
+
+    cache = factory()
+    cache.clear()
+    key = ('hotel', ('ll', '48.86,2.35'), ('radius', 1000))
+    cache.set(key, SAMPLE)
+    expect("round trip", cache.get(key) == SAMPLE)
+    expect("missing key", cache.get('nothing here') is MISSING)
+    cache.set('none', None)
+    expect("None value", cache.get('none', 'default') is None)
+    cache.set('short', 1, ttl=0.2)
+    time.sleep(0.3)
+    expect("expiry", cache.get('short') is MISSING)
+    cache.delete(key)
+    expect("delete", cache.get(key) is MISSING)
+    cache.set('a', 1)
+    cache.clear()
+    expect("clear", cache.get('a') is MISSING)
+
+    if shared:
+        # 另一个进程（相当于另一个 gunicorn worker）写入的条目
+        child = multiprocessing.get_context('fork').Process(target=_write_from_child, args=(factory, 'child', [1, 2]))
+        child.start()
+        child.join()
+        expect("visible across processes", factory().get('child') == [1, 2])
+
+    if name != 'redis':  # Redis 的条目数由服务器的 maxmemory 控制
+        bounded = factory(maxsize=100)
+        bounded.clear()
+        for i in range(1000):
+            bounded.set(f"k{i}", i)
+        slack = getattr(bounded, 'EVICT_CHECK_EVERY', 0)
+        expect("size bound", len(bounded) <= 100 + slack)
+        expect("keeps recent entries", bounded.get('k999') == 999)
+        bounded.clear()
+    return failures
+
+
+def check_redis_down():
+    """Redis 不可用时读写都不抛异常，并且不会每次都等连接超时"""
+    failures = []
+    client = RespClient('redis://127.0.0.1:1/0', timeout=0.2, retry_interval=5)
+    cache = RedisCache('down', 100, 60, client=client)
+    start = time.perf_counter()
+    for _ in range(50):
+        cache.set('k', 1)
+        if cache.get('k') is not MISSING:
+            failures.append("miss when Redis is down")
+            break
+    if time.perf_counter() - start > 1:
+        failures.append("backs off when Redis is down")
+    return failures
+
+
+def time_gets(cache, rounds):
+    cache.set('sample', SAMPLE)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        cache.get('sample')
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def time_decode(rounds):
+    as_json, as_binary = json.dumps(SAMPLE), cache_backends.dumps(SAMPLE)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        json.loads(as_json)
+    json_us = (time.perf_counter() - start) / rounds * 1e6
+    start = time.perf_counter()
+    for _ in range(rounds):
+        cache_backends.loads(as_binary)
+    binary_us = (time.perf_counter() - start) / rounds * 1e6
+    return len(as_json), json_us, len(as_binary), binary_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', default='memory,sqlite,redis')
+    parser.add_argument('--redis-url', help="real Redis to test against (default: local stand-in)")
+    parser.add_argument('--rounds', type=int, default=20000)
+    args = parser.parse_args()
+
+    backends = [b.strip() for b in args.backends.split(',') if b.strip()]
+    unknown = [b for b in backends if b not in cache_backends.CACHE_BACKENDS]
+    if unknown:
+        parser.error(f"unknown backends: {', '.join(unknown)}")
+
+    server, redis_url = None, args.redis_url
+    if 'redis' in backends and not redis_url:
+        server = fake_redis.start()
+        redis_url = f"redis://127.0.0.1:{server.server_address[1]}/0"
+
+    failed = False
+    with tempfile.TemporaryDirectory(prefix='travel-cache-') as workdir:
+        path = os.path.join(workdir, 'shared_cache.sqlite3')
+        factories = {
+            'memory': lambda maxsize=1000: TTLCache(maxsize=maxsize, ttl=60, name='bench'),
+            'sqlite': lambda maxsize=1000: SQLiteCache('bench', maxsize, 60, path=path),
+            'redis': lambda maxsize=1000: RedisCache('bench', maxsize, 60, client=cache_backends.redis_client(redis_url),
+                                                     prefix='travel-bench:'),
+        }
+        for name in backends:
+            failures = check(name, factories[name], shared=name != 'memory')
+            if name == 'redis':
+                failures += check_redis_down()
+            get_us = time_gets(factories[name](), args.rounds if name == 'memory' else max(1, args.rounds // 10))
+            print(f"{name:8s} {'ok' if not failures else 'FAILED: ' + ', '.join(failures):40s} "
+                  f"hit {get_us:8.1f} us")
+            failed = failed or bool(failures)
+            factories[name]().clear()
+
+    json_bytes, json_us, binary_bytes, binary_us = time_decode(args.rounds // 10 or 1)
+    print(f"decode 20 places: JSON {json_bytes} bytes {json_us:.1f} us, binary {binary_bytes} bytes {binary_us:.1f} us")
+    if server is not None:
+        server.shutdown()
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+本地 Redis 替身：实现缓存用到的 RESP 命令，用于在没有 Redis 的机器上测试 CACHE_BACKEND=redis
+
+用法：
+    python -m bench.fake_redis [--port 6390] [--password PASS]
+
+支持 PING、AUTH、SELECT、GET、SET（EX / PX / NX）、DEL、EXISTS、PTTL、DBSIZE、SCAN、FLUSHDB。
+数据只在内存里，过期的键在读取时删除；不做 maxmemory 淘汰。
+"""
+import argparse
+import fnmatch
+import socketserver
+import threading
+import time
+
+from services.cache_backends import RedisError, RespClient
+
+
+def _bulk(value):
+    if value is None:
+        return b'$-1\r\n'
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+def _reply(value):
+    if isinstance(value, RedisError):
+        return b'-%s\r\n' % str(value).encode()
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, list):
+        return b'*%d\r\n' % len(value) + b''.join(_reply(item) for item in value)
+    if isinstance(value, str):
+        return b'+%s\r\n' % value.encode()
+    return _bulk(value)
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        self.authenticated = self.server.password is None
+        while True:
+            try:
+                args = RespClient._read(self.rfile)
+            except (ConnectionError, ValueError, OSError):
+                return
+            if not isinstance(args, list) or not args:
+                self.wfile.write(_reply(RedisError("ERR Protocol error")))
+                continue
+            command = args[0].decode().upper()
+            try:
+                result = self.run(command, args[1:])
+            except (ValueError, IndexError):
+                result = RedisError(f"ERR syntax error in '{command.lower()}'")
+            self.wfile.write(_reply(result))
+
+    def run(self, command, args):
+        server = self.server
+        if command == 'AUTH':
+            self.authenticated = args[-1].decode() == server.password
+            return 'OK' if self.authenticated else RedisError("WRONGPASS invalid password")
+        if not self.authenticated:
+            return RedisError("NOAUTH Authentication required.")
+        if command == 'PING':
+            return 'PONG'
+        if command == 'SELECT':
+            int(args[0])
+            return 'OK'
+        with server.lock:
+            server.calls += 1
+            if command == 'GET':
+                return server.lookup(args[0])
+            if command == 'SET':
+                key, value, options = args[0], args[1], [a.decode().upper() for a in args[2:]]
+                expires_at = None
+                if 'PX' in options:
+                    expires_at = time.monotonic() + int(options[options.index('PX') + 1]) / 1000
+                elif 'EX' in options:
+                    expires_at = time.monotonic() + int(options[options.index('EX') + 1])
+                if 'NX' in options and server.lookup(key) is not None:
+                    return None
+                server.data[key] = (expires_at, value)
+                return 'OK'
+            if command == 'DEL':
+                return sum(server.data.pop(key, None) is not None for key in args)
+            if command == 'EXISTS':
+                return sum(server.lookup(key) is not None for key in args)
+            if command == 'PTTL':
+                if server.lookup(args[0]) is None:
+                    return -2
+                expires_at = server.data[args[0]][0]
+                return -1 if expires_at is None else int((expires_at - time.monotonic()) * 1000)
+            if command == 'DBSIZE':
+                return sum(server.lookup(key) is not None for key in list(server.data))
+            if command == 'SCAN':
+                # 一次返回全部匹配的键（游标总是 0），对客户端来说是合法的 SCAN 结果
+                options = [a.decode() for a in args[1:]]
+                pattern = options[options.index('MATCH') + 1] if 'MATCH' in options else '*'
+                keys = [key for key in list(server.data)
+                        if server.lookup(key) is not None and fnmatch.fnmatchcase(key.decode(errors='replace'), pattern)]
+                return [b'0', keys]
+            if command == 'FLUSHDB':
+                server.data.clear()
+                return 'OK'
+        return RedisError(f"ERR unknown command '{command.lower()}'")
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, password=None):
+        super().__init__(address, FakeRedisHandler)
+        self.password = password
+        self.data = {}  # key -> (过期的单调时间或 None, value)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def lookup(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+
+def start(port=0, password=None):
+    """在后台线程启动 Redis 替身，返回 server（server.server_address[1] 为实际端口）"""
+    server = FakeRedisServer(('127.0.0.1', port), password)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=6390)
+    parser.add_argument('--password')
+    args = parser.parse_args()
+
+    server = start(args.port, args.password)
+    print(f"Fake Redis listening on redis://127.0.0.1:{server.server_address[1]}/0")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+本地假上游：模拟各个蓝图解析的外部 API 响应，用于基准测试时不消耗真实配额
+
+用法：
+    python -m bench.fake_upstream [--port 8900] [--latency 50] [--jitter 20] [--error-rate 0]
+
+应用通过 UPSTREAM_BASE_OVERRIDE=http://127.0.0.1:8900 把所有上游请求转发到这里，
+请求路径为 /<原始主机>/<原始路径>。另有两个管理接口：
+    GET  /__stats   各主机收到的请求数
+    POST /__reset   清零计数
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+# 机场数据：airports.dat 格式，包含基准测试用到的城市
+AIRPORTS = [
+    (1382, "Charles de Gaulle International Airport", "Paris", "France", "CDG", "LFPG", 49.0127, 2.55),
+    (1354, "Nice-Cote d'Azur Airport", "Nice", "France", "NCE", "LFMN", 43.6584, 7.2158),
+    (1335, "Lyon Saint-Exupery Airport", "Lyon", "France", "LYS", "LFLL", 45.7256, 5.0811),
+    (1353, "Marseille Provence Airport", "Marseille", "France", "MRS", "LFML", 43.4393, 5.2214),
+    (1273, "Bordeaux-Merignac Airport", "Bordeaux", "France", "BOD", "LFBD", 44.8283, -0.7156),
+    (1264, "Toulouse-Blagnac Airport", "Toulouse", "France", "TLS", "LFBO", 43.6291, 1.3638),
+    (507, "London Heathrow Airport", "London", "United Kingdom", "LHR", "EGLL", 51.4706, -0.4619),
+]
+
+
+def _unit(text, salt=''):
+    """由文本得到 [0, 1) 内的稳定伪随机数，同一个城市每次返回相同坐标"""
+    digest = hashlib.md5((salt + text.casefold()).encode()).hexdigest()
+    return int(digest[:8], 16) / 0x100000000
+
+
+def _coords(city):
+    return 42.0 + _unit(city, 'lat') * 8.0, -2.0 + _unit(city, 'lon') * 10.0
+
+
+def _param(query, name, default=''):
+    return query.get(name, [default])[0]
+
+
+def nominatim(path, query, body):
+    lat, lon = _coords(_param(query, 'q'))
+    return 200, [{"lat": str(lat), "lon": str(lon), "display_name": _param(query, 'q')}]
+
+
+def open_meteo(path, query, body):
+    lat, lon = _coords(_param(query, 'name'))
+    return 200, {"results": [{"name": _param(query, 'name'), "latitude": lat, "longitude": lon}]}
+
+
+def openrouteservice(path, query, body):
+    if path.startswith('/geocode'):
+        lat, lon = _coords(_param(query, 'text'))
+        return 200, {"features": [{"geometry": {"coordinates": [lon, lat]}}]}
+    if path.startswith('/v2/directions'):
+        (lon1, lat1), (lon2, lat2) = body["coordinates"][:2]
+        distance = (abs(lat1 - lat2) + abs(lon1 - lon2)) * 111000 * 1.3
+        return 200, {"routes": [{"summary": {"distance": distance, "duration": distance / 25}}]}
+    if path.startswith('/v2/matrix'):
+        locations = body["locations"]
+        sources = body.get("sources", range(len(locations)))
+        targets = body.get("destinations", range(len(locations)))
+        distances = [
+            [(abs(locations[i][1] - locations[j][1]) + abs(locations[i][0] - locations[j][0])) * 111000 * 1.3
+             for j in targets] for i in sources
+        ]
+        return 200, {"distances": distances, "durations": [[d / 25 for d in row] for row in distances]}
+    return 404, {"error": "not found"}
+
+
+def _place(fsq_id, lat, lon, index):
+    return {
+        "fsq_id": fsq_id,
+        "name": f"Place {fsq_id[:6]}",
+        "location": {"address": f"{index + 1} Rue de Test", "formatted_address": f"{index + 1} Rue de Test, 06000"},
+        "distance": 50 * (index + 1),
+        "categories": [{"id": 19014, "name": "Hotel"}],
+        "geocodes": {"main": {"latitude": lat + index * 0.0005, "longitude": lon + index * 0.0005}},
+        "tel": "+33 4 00 00 00 00",
+        "website": "https://example.com",
+    }
+
+
+def foursquare(path, query, body):
+    if path == '/v3/places/search':
+        lat, lon = (float(x) for x in _param(query, 'll', '0,0').split(','))
+        limit = int(_param(query, 'limit', '10'))
+        key = f"{_param(query, 'll')}|{_param(query, 'categories')}|{_param(query, 'query')}"
+        results = [_place(hashlib.md5(f"{key}|{i}".encode()).hexdigest()[:24], lat, lon, i) for i in range(limit)]
+        fields = _param(query, 'fields')
+        if fields:
+            keep = set(fields.split(','))
+            results = [{k: v for k, v in place.items() if k in keep} for place in results]
+        return 200, {"results": results}
+    if path.endswith('/photos'):
+        fsq_id = path.split('/')[3]
+        return 200, [{"prefix": "https://fastly.4sqi.net/img/general/", "suffix": f"/{fsq_id}_{i}.jpg"} for i in range(3)]
+    if path.startswith('/v3/places/'):
+        fsq_id = path.split('/')[3]
+        return 200, _place(fsq_id, 43.7, 7.26, 0)
+    return 404, {"error": "not found"}
+
+
+def sncf(path, query, body):
+    if path.endswith('/places'):
+        city = _param(query, 'q')
+        return 200, {"places": [{"id": f"stop_area:SNCF:{hashlib.md5(city.encode()).hexdigest()[:8]}",
+                                 "embedded_type": "stop_area", "name": city}]}
+    if path.endswith('/journeys'):
+        start = time.mktime(time.strptime(_param(query, 'datetime'), "%Y%m%dT%H%M%S"))
+        journeys = []
+        for i in range(10):
+            departure = start + i * 1800
+            duration = 3 * 3600 + int(_unit(_param(query, 'from') + _param(query, 'to')) * 3 * 3600)
+            journeys.append({
+                "departure_date_time": time.strftime("%Y%m%dT%H%M%S", time.localtime(departure)),
+                "arrival_date_time": time.strftime("%Y%m%dT%H%M%S", time.localtime(departure + duration)),
+                "duration": duration,
+            })
+        return 200, {"journeys": journeys}
+    return 404, {"error": "not found"}
+
+
+def openweathermap(path, query, body):
+    city = _param(query, 'q')
+    entry = {"main": {"temp": round(5 + _unit(city) * 20, 1)}, "weather": [{"description": "clear sky"}]}
+    if path.endswith('/forecast'):
+        now = int(time.time()) // 10800 * 10800
+        return 200, {"city": {"name": city, "timezone": 3600},
+                     "list": [{**entry, "dt": now + i * 10800} for i in range(40)]}
+    return 200, {**entry, "name": city}
+
+
+def airports_dat(path, query, body):
+    lines = [
+        f'{row[0]},"{row[1]}","{row[2]}","{row[3]}","{row[4]}","{row[5]}",{row[6]},{row[7]},100,1,"E","Europe/Paris","airport","OurAirports"'
+        for row in AIRPORTS
+    ]
+    return 200, "\n".join(lines) + "\n"
+
+
+HOSTS = {
+    'nominatim.openstreetmap.org': nominatim,
+    'geocoding-api.open-meteo.com': open_meteo,
+    'api.openrouteservice.org': openrouteservice,
+    'api.foursquare.com': foursquare,
+    'api.sncf.com': sncf,
+    'api.openweathermap.org': openweathermap,
+    'raw.githubusercontent.com': airports_dat,
+}
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, payload):
+        data = payload.encode() if isinstance(payload, str) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain' if isinstance(payload, str) else 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self):
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        server = self.server
+
+        if url.path == '/__stats':
+            return self._send(200, dict(server.calls))
+        if url.path == '/__reset':
+            server.calls.clear()
+            return self._send(200, {})
+
+        host, _, path = url.path.lstrip('/').partition('/')
+        handler = HOSTS.get(host)
+        if handler is None:
+            return self._send(404, {"error": f"unknown upstream {host}"})
+        with server.lock:
+            server.calls[host] += 1
+
+        delay = max(0.0, random.gauss(server.latency, server.jitter))
+        time.sleep(delay)
+        if random.random() < server.error_rate:
+            return self._send(503, {"error": "injected failure"})
+        status, payload = handler('/' + path, parse_qs(url.query), body)
+        self._send(status, payload)
+
+    do_GET = _handle
+    do_POST = _handle
+
+
+def start(port=0, latency=0.05, jitter=0.02, error_rate=0.0):
+    """在后台线程启动假上游，返回 server（server.server_port 为实际端口）"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakeUpstreamHandler)
+    server.daemon_threads = True
+    server.calls = Counter()
+    server.lock = threading.Lock()
+    server.latency, server.jitter, server.error_rate = latency, jitter, error_rate
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=50, help="mean upstream latency in ms")
+    parser.add_argument('--jitter', type=float, default=20, help="latency standard deviation in ms")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with 503")
+    args = parser.parse_args()
+
+    server = start(args.port, args.latency / 1000, args.jitter / 1000, args.error_rate)
+    print(f"Fake upstream listening on http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
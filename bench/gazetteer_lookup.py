@@ -0,0 +1,74 @@
+"""
+城市表基准测试：加载时间、内存占用、精确查找和前缀补全的耗时
+
+用法：
+    python -m bench.gazetteer_lookup [--data PATH] [--synthetic N] [--repeat N] [PREFIX ...]
+
+没有 GeoNames 快照时可以用 --synthetic 生成 N 个随机城市名，
+数据规模与 cities15000（约 2.6 万个城市）相当时结果可以参考。
+"""
+import argparse
+import os
+import random
+import string
+import time
+import tracemalloc
+
+from services import gazetteer
+
+
+def synthetic_rows(count, seed=0):
+    rng = random.Random(seed)
+    syllables = [a + b for a in string.ascii_lowercase for b in 'aeiou']
+    for _ in range(count):
+        name = ''.join(rng.choice(syllables) for _ in range(rng.randint(2, 5))).capitalize()
+        yield (name, name, rng.choice(['FR', 'US', 'DE', 'IT', 'ES', 'GB']),
+               rng.uniform(-60, 70), rng.uniform(-180, 180), int(rng.paretovariate(1.2) * 15000))
+
+
+def timed(fn, items, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            fn(item)
+    return (time.perf_counter() - start) / (repeat * len(items))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default=gazetteer.GAZETTEER_DATA_PATH)
+    parser.add_argument('--synthetic', type=int, default=0, help="use N generated cities instead of the snapshot")
+    parser.add_argument('--repeat', type=int, default=1000)
+    parser.add_argument('prefixes', nargs='*', default=['p', 'pa', 'par', 'san', 'sao p', 'new yo', 'saint-pet'])
+    args = parser.parse_args()
+
+    if args.synthetic:
+        rows = list(synthetic_rows(args.synthetic))
+        text = ''.join(f"{n}\t{a}\t{c}\t{lat}\t{lon}\t{p}\n" for n, a, c, lat, lon, p in rows)
+    elif os.path.exists(args.data):
+        with open(args.data, encoding='utf-8') as f:
+            text = f.read()
+    else:
+        parser.error(f"{args.data} not found, run `python -m services.gazetteer refresh` or use --synthetic N")
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    table = gazetteer.CityTable.from_text(text)
+    load_time = time.perf_counter() - start
+    memory, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    names = [table.names[row] for row in range(0, len(table), max(1, len(table) // 50))]
+    lookup = timed(table.lookup, names, args.repeat)
+    complete = timed(lambda prefix: table.complete(prefix, 10), args.prefixes, args.repeat)
+
+    print(f"cities loaded:         {len(table)} rows in {load_time * 1000:.1f} ms")
+    print(f"memory (table + trie): {memory / 2 ** 20:.1f} MiB (peak while loading {peak / 2 ** 20:.1f} MiB)")
+    print(f"exact lookup:          {lookup * 1e6:10.2f} us/lookup")
+    print(f"autocomplete (10):     {complete * 1e6:10.2f} us/query")
+    for prefix in args.prefixes[:3]:
+        print(f"  {prefix!r:12} -> {[table.names[row] for row in table.complete(prefix, 5)]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+端点负载测试：在 gunicorn 下运行真实的 app，上游全部换成本地假上游
+
+用法：
+    python -m bench.load [--workers 2] [--threads 8] [--concurrency 1,8,32] [--duration 10]
+                         [--endpoints hotel,train,...] [--latency 50] [--jitter 20] [--error-rate 0]
+                         [--out bench_results/run.json] [--compare baseline.json] [--tolerance 0.2]
+
+每个（端点, 并发数）报告吞吐量、p50/p95/p99 延迟、错误数和每个请求的上游调用数，
+结果写成 JSON。指定 --compare 时与之前的结果对比，吞吐量下降或 p95 上升超过
+tolerance 视为回归，退出码为 1。
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import requests
+
+CITIES = ['Paris', 'Nice', 'Lyon', 'Marseille', 'Bordeaux', 'Toulouse', 'London']
+ROUTES = [('Paris', 'Nice'), ('Lyon', 'Marseille'), ('Bordeaux', 'Toulouse'), ('Paris', 'London')]
+
+
+def endpoint_paths(travel_date):
+    """每个端点轮流请求的路径"""
+    return {
+        'hotel': [f"/hotel/?city={c}&limit=5" for c in CITIES],
+        'restaurants': [f"/restaurants/?city={c}&limit=5" for c in CITIES],
+        'attraction': [f"/attraction/?city={c}&limit=5" for c in CITIES],
+        'train': [f"/train/?origin={a}&destination={b}&date={travel_date}" for a, b in ROUTES],
+        'car': [f"/car/get_route?origin={a}&destination={b}&date={travel_date}" for a, b in ROUTES],
+        'flight': [f"/flight/search?departure_city={a}&arrival_city={b}&date={travel_date}" for a, b in ROUTES],
+        'weather': [f"/weather/?city={c}" for c in CITIES],
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def start_fake_upstream(port, args):
+    process = subprocess.Popen([
+        sys.executable, '-m', 'bench.fake_upstream', '--port', str(port),
+        '--latency', str(args.latency), '--jitter', str(args.jitter), '--error-rate', str(args.error_rate),
+    ], stdout=subprocess.DEVNULL)
+    wait_until_up(f"http://127.0.0.1:{port}/__stats")
+    return process
+
+
+def start_gunicorn(port, upstream_port, workdir, args):
+    env = {
+        **os.environ,
+        'UPSTREAM_BASE_OVERRIDE': f"http://127.0.0.1:{upstream_port}",
+        'FOURSQUARE_API_KEY': 'bench', 'SNCF_API_KEY': 'bench',
+        'ORS_API_KEY': 'bench', 'OPENWEATHERMAP_API_KEY': 'bench',
+        # 缓存、快照和限流状态都放在临时目录，每次运行互不影响
+        'CACHE_DIR': workdir,
+        'RATE_LIMIT_DIR': os.path.join(workdir, 'ratelimit'),
+        'AIRPORTS_DATA_PATH': os.path.join(workdir, 'airports.dat'),
+        'GAZETTEER_DATA_PATH': args.gazetteer or os.path.join(workdir, 'cities.tsv'),
+    }
+    if not args.keep_rate_limits:
+        env['RATE_LIMITS'] = ''  # 测的是网关本身，不受真实配额限制
+    process = subprocess.Popen([
+        sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f"127.0.0.1:{port}",
+        '--workers', str(args.workers), '--threads', str(args.threads), '--log-level', 'warning',
+    ], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL if not args.verbose else None)
+    wait_until_up(f"http://127.0.0.1:{port}/")
+    return process
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return round(sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))], 2)
+
+
+def run_load(base, paths, concurrency, duration):
+    """concurrency 个线程在 duration 秒内循环请求 paths，返回 (延迟毫秒列表, 错误数)"""
+    cycle = itertools.cycle(paths)
+    cycle_lock = threading.Lock()
+    latencies, errors = [], [0]
+    results_lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        session = requests.Session()
+        local, local_errors = [], 0
+        while time.monotonic() < deadline:
+            with cycle_lock:
+                path = next(cycle)
+            start = time.perf_counter()
+            try:
+                ok = session.get(base + path, timeout=30).status_code < 400
+            except requests.exceptions.RequestException:
+                ok = False
+            local.append((time.perf_counter() - start) * 1000)
+            local_errors += not ok
+        with results_lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def upstream_calls(upstream_base, reset=False):
+    return requests.post(f"{upstream_base}/__reset").json() if reset else requests.get(f"{upstream_base}/__stats").json()
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, tolerance):
+    """与基线对比，返回回归列表"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(r['endpoint'], r['concurrency']): r for r in json.load(f)['results']}
+    regressions = []
+    print(f"\n{'endpoint':12} {'conc':>4} {'rps':>16} {'p95 ms':>18}")
+    for result in results:
+        base = baseline.get((result['endpoint'], result['concurrency']))
+        if base is None:
+            continue
+        rps_change = result['rps'] / base['rps'] - 1 if base['rps'] else 0.0
+        p95_change = result['p95_ms'] / base['p95_ms'] - 1 if base['p95_ms'] and result['p95_ms'] else 0.0
+        flag = ''
+        if rps_change < -tolerance or p95_change > tolerance:
+            regressions.append(result)
+            flag = '  REGRESSION'
+        print(f"{result['endpoint']:12} {result['concurrency']:>4} "
+              f"{base['rps']:7.1f}->{result['rps']:7.1f} {base['p95_ms']:8.1f}->{result['p95_ms']:8.1f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--concurrency', default='1,8,32')
+    parser.add_argument('--duration', type=float, default=10, help="seconds per endpoint and concurrency level")
+    parser.add_argument('--warmup', type=float, default=1, help="seconds of unmeasured load before each endpoint")
+    parser.add_argument('--endpoints', default='hotel,restaurants,attraction,train,car,flight,weather')
+    parser.add_argument('--latency', type=float, default=50, help="mean fake upstream latency in ms")
+    parser.add_argument('--jitter', type=float, default=20, help="fake upstream latency standard deviation in ms")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of upstream calls failing with 503")
+    parser.add_argument('--gazetteer', help="city snapshot to use (default: none, geocoding goes upstream)")
+    parser.add_argument('--keep-rate-limits', action='store_true', help="keep the configured RATE_LIMITS")
+    parser.add_argument('--out', default=None, help="JSON results path (default bench_results/load-<time>.json)")
+    parser.add_argument('--compare', help="baseline JSON to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--verbose', action='store_true', help="show gunicorn logs")
+    args = parser.parse_args()
+
+    endpoints = [e.strip() for e in args.endpoints.split(',') if e.strip()]
+    levels = [int(c) for c in args.concurrency.split(',')]
+    paths = endpoint_paths((date.today() + timedelta(days=7)).isoformat())
+    unknown = [e for e in endpoints if e not in paths]
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(unknown)}")
+
+    upstream_port, app_port = free_port(), free_port()
+    upstream_base, base = f"http://127.0.0.1:{upstream_port}", f"http://127.0.0.1:{app_port}"
+    with tempfile.TemporaryDirectory(prefix='travel-bench-') as workdir:
+        fake = start_fake_upstream(upstream_port, args)
+        server = None
+        try:
+            server = start_gunicorn(app_port, upstream_port, workdir, args)
+            results = []
+            for endpoint in endpoints:
+                if args.warmup:
+                    run_load(base, paths[endpoint], max(levels), args.warmup)
+                for concurrency in levels:
+                    upstream_calls(upstream_base, reset=True)
+                    start = time.perf_counter()
+                    latencies, errors = run_load(base, paths[endpoint], concurrency, args.duration)
+                    elapsed = time.perf_counter() - start
+                    calls = upstream_calls(upstream_base)
+                    latencies.sort()
+                    total = len(latencies)
+                    result = {
+                        "endpoint": endpoint,
+                        "concurrency": concurrency,
+                        "requests": total,
+                        "errors": errors,
+                        "rps": round(total / elapsed, 2),
+                        "p50_ms": percentile(latencies, 0.50),
+                        "p95_ms": percentile(latencies, 0.95),
+                        "p99_ms": percentile(latencies, 0.99),
+                        "upstream_calls_per_request": round(sum(calls.values()) / total, 3) if total else None,
+                        "upstream_calls": calls,
+                    }
+                    results.append(result)
+                    print(f"{endpoint:12} c={concurrency:<3} {result['rps']:8.1f} req/s  "
+                          f"p50 {result['p50_ms']:7.1f}  p95 {result['p95_ms']:7.1f}  p99 {result['p99_ms']:7.1f} ms  "
+                          f"errors {errors:<4} upstream/req {result['upstream_calls_per_request']}")
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+            fake.terminate()
+            fake.wait()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec='seconds'),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "config": {k: v for k, v in vars(args).items() if k not in ('out', 'compare', 'verbose')},
+        },
+        "results": results,
+    }
+    out = args.out or os.path.join('bench_results', f"load-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {out}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+启动时间基准：在子进程里 `python -X importtime -c "import app"`，统计导入 app 的耗时
+
+用法：
+    python -m bench.startup [--mode eager|lazy|both] [--runs 5] [--top 15]
+                            [--budget-ms MS] [--json out.json]
+
+eager 为默认的启动时导入所有蓝图，lazy 为 LAZY_BLUEPRINTS=1（第一次请求时才导入）。
+每种模式运行 --runs 次，报告导入 app 的总耗时（取中位数）和累计耗时最多的模块。
+任何一种模式的中位数超过预算（默认 IMPORT_BUDGET_MS，--budget-ms 0 不检查）都视为回归，
+退出码为 1，可以放进 CI。
+每次运行都用空的临时目录存放缓存、机场表和城市表（没有缓存快照，也不预加载数据表）
+和假的 API Key，不会访问外部 API。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 导入 app 的时间预算（毫秒，中位数）。目前默认模式约 260 ms、按需加载约 140 ms，留出慢机器的余量；
+# 新增的导入让它超出时，先看报告里哪个模块变慢，而不是直接调高预算
+IMPORT_BUDGET_MS = 800
+
+# 导入 app 的代码：总耗时包含 load_dotenv、注册蓝图和 warm_start
+SNIPPET = "import time; start = time.perf_counter(); import app; print((time.perf_counter() - start) * 1000)"
+
+
+def parse_importtime(stderr):
+    """解析 -X importtime 的输出，返回 {模块: (自身微秒, 累计微秒)}；同名模块只保留第一次"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+            modules.setdefault(name.strip(), (int(self_us), int(cumulative_us)))
+        except ValueError:
+            continue
+    return modules
+
+
+def run_once(mode, workdir):
+    env = {
+        **os.environ,
+        'LAZY_BLUEPRINTS': '1' if mode == 'lazy' else '0',
+        'FOURSQUARE_API_KEY': 'bench', 'SNCF_API_KEY': 'bench',
+        'ORS_API_KEY': 'bench', 'OPENWEATHERMAP_API_KEY': 'bench',
+        'CACHE_DIR': workdir,
+        # 数据表指向空目录：否则会读仓库里的 data/，缺文件时还可能在计时的导入中下载
+        'AIRPORTS_DATA_PATH': os.path.join(workdir, 'airports.dat'),
+        'GAZETTEER_DATA_PATH': os.path.join(workdir, 'cities.tsv'),
+        'LOG_LEVEL': 'ERROR',
+    }
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', SNIPPET],
+                            cwd=ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import app failed in {mode} mode:\n{result.stderr[-2000:]}")
+    return float(result.stdout.strip().splitlines()[-1]), parse_importtime(result.stderr)
+
+
+def measure(mode, runs, top):
+    totals, cumulative, self_times = [], {}, {}
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory(prefix='travel-startup-') as workdir:
+            total_ms, modules = run_once(mode, workdir)
+        totals.append(total_ms)
+        for name, (self_us, cumulative_us) in modules.items():
+            cumulative.setdefault(name, []).append(cumulative_us / 1000)
+            self_times.setdefault(name, []).append(self_us / 1000)
+    breakdown = sorted(
+        ({"module": name, "cumulative_ms": round(statistics.median(values), 1),
+          "self_ms": round(statistics.median(self_times[name]), 1)}
+         for name, values in cumulative.items() if name != 'app'),
+        key=lambda row: row["cumulative_ms"], reverse=True
+    )
+    # 只列项目自己的模块和顶层包（flask、requests 等），子模块已经算在它们的累计耗时里
+    breakdown = [row for row in breakdown if '.' not in row["module"] or row["module"].startswith('services.')]
+    return {
+        "mode": mode,
+        "runs": runs,
+        "import_app_ms": round(statistics.median(totals), 1),
+        "import_app_ms_min": round(min(totals), 1),
+        "importtime_app_ms": round(statistics.median(cumulative.get('app', [0])), 1),
+        "top_modules": breakdown[:top],
+    }
+
+
+def print_report(result):
+    print(f"{result['mode']}: import app {result['import_app_ms']:.1f} ms median "
+          f"(min {result['import_app_ms_min']:.1f} ms, {result['runs']} runs)")
+    for row in result["top_modules"]:
+        print(f"  {row['cumulative_ms']:8.1f} ms cumulative {row['self_ms']:8.1f} ms self  {row['module']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=('eager', 'lazy', 'both'), default='both')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help="modules to show per mode")
+    parser.add_argument('--budget-ms', type=float, default=IMPORT_BUDGET_MS,
+                        help=f"fail when the median import time exceeds this (default {IMPORT_BUDGET_MS}, 0 to disable)")
+    parser.add_argument('--json', help="write the results to this path")
+    args = parser.parse_args()
+
+    modes = ('eager', 'lazy') if args.mode == 'both' else (args.mode,)
+    results = [measure(mode, args.runs, args.top) for mode in modes]
+    for result in results:
+        print_report(result)
+
+    if args.json:
+        os.makedirs(os.path.dirname(args.json) or '.', exist_ok=True)
+        with open(args.json, 'w') as f:
+            json.dump({"python": sys.version.split()[0], "results": results}, f, indent=2)
+
+    if args.budget_ms:
+        over = [r for r in results if r["import_app_ms"] > args.budget_ms]
+        for result in over:
+            print(f"REGRESSION: {result['mode']} import app {result['import_app_ms']:.1f} ms "
+                  f"> budget {args.budget_ms:.1f} ms")
+        if over:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
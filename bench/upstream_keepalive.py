@@ -0,0 +1,126 @@
+"""
+连接复用基准测试：酒店与餐厅列表的上游扇出路径
+
+用法：
+    python -m bench.upstream_keepalive [--limit N] [--rounds N] [--handshake-ms MS]
+
+本地起一个模拟 Nominatim / Foursquare 的 HTTP/1.1 服务，每个新连接额外
+等待 --handshake-ms 毫秒来模拟 TCP+TLS 握手的往返开销。分别以
+“每次请求新建连接”（等同于裸 requests.get）和共享连接池两种方式
+调用 /hotel/ 与 /restaurants/，比较耗时和新建连接数。
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+
+os.environ.setdefault('FOURSQUARE_API_KEY', 'bench')
+
+from flask import Flask  # noqa: E402
+
+from services import foursquare, geocoding, hotel, restaurant, upstream  # noqa: E402
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    handshake_delay = 0.0
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        # 每个新 TCP 连接只调用一次
+        with StubHandler.lock:
+            StubHandler.connections += 1
+        time.sleep(self.handshake_delay)
+        super().setup()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/search':
+            body = [{"lat": "43.7", "lon": "7.26"}]
+        elif path == '/v3/places/search':
+            body = {"results": [
+                {"fsq_id": f"place{i}", "name": f"Place {i}", "distance": i * 10,
+                 "location": {"address": "1 rue", "formatted_address": "1 rue, Nice"},
+                 "categories": [{"name": "Hotel"}]}
+                for i in range(int(re.search(r'limit=(\d+)', self.path).group(1)))
+            ]}
+        elif path.endswith('/photos'):
+            body = [{"prefix": "https://img/", "suffix": "/a.jpg"}]
+        else:
+            body = {"name": "Place", "categories": [], "location": {"formatted_address": "1 rue"}}
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class OneShotSession(requests.Session):
+    """模拟裸 requests.get：每次请求用完即关闭连接"""
+
+    def request(self, *args, **kwargs):
+        with self:
+            return super().request(*args, **kwargs)
+
+
+def point_services_at(base):
+    geocoding.GEOCODER_PROVIDERS[:] = ['nominatim']
+    geocoding.NOMINATIM_URL = f"{base}/search"
+    foursquare.SEARCH_URL = f"{base}/v3/places/search"
+    foursquare.DETAIL_URL = f"{base}/v3/places"
+    foursquare.PHOTO_URL = f"{base}/v3/places/{{fsq_id}}/photos"
+
+
+def run(client, paths, rounds):
+    before = StubHandler.connections
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for path in paths:
+            assert client.get(path).status_code == 200
+    elapsed = (time.perf_counter() - start) / (rounds * len(paths))
+    return elapsed, (StubHandler.connections - before) / (rounds * len(paths))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--handshake-ms', type=float, default=20)
+    args = parser.parse_args()
+
+    StubHandler.handshake_delay = args.handshake_ms / 1000
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    point_services_at(f"http://127.0.0.1:{server.server_port}")
+
+    app = Flask(__name__)
+    app.register_blueprint(hotel.hotel_blueprint, url_prefix='/hotel')
+    app.register_blueprint(restaurant.restaurant_blueprint, url_prefix='/restaurants')
+    client = app.test_client()
+
+    for name in ('hotel', 'restaurants'):
+        paths = [f"/{name}/?city=Nice&limit={args.limit}"]
+        with mock.patch.object(upstream, 'session_for', lambda url: OneShotSession()):
+            per_call, per_call_conns = run(client, paths, args.rounds)
+        pooled, pooled_conns = run(client, paths, args.rounds)
+        print(f"/{name}/ limit={args.limit}")
+        print(f"  new connection per call: {per_call * 1000:8.1f} ms/request, {per_call_conns:5.1f} connections/request")
+        print(f"  pooled keep-alive:       {pooled * 1000:8.1f} ms/request, {pooled_conns:5.1f} connections/request")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
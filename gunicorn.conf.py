@@ -0,0 +1,17 @@
+# gunicorn 默认读取当前目录下的这个文件（Procfile 不需要改动）
+import gc
+
+# 在 master 中导入 app（恢复缓存快照、加载机场表和城市表）之后再 fork，worker 写时复制共享这些数据
+preload_app = True
+
+
+def on_starting(server):
+    # 上一次运行留下的 worker 指标文件不再计入 /metrics
+    from services import metrics
+    metrics.remove_files()
+
+
+def pre_fork(server, worker):
+    # 把 master 里已加载的对象移出垃圾回收的跟踪范围，
+    # 避免 worker 中的 GC 遍历它们时触发写时复制，把共享的内存页复制一份
+    gc.freeze()
@@ -0,0 +1,83 @@
+import hmac
+import os
+from flask import Blueprint, request, jsonify, send_file
+from services import profiler
+
+admin_blueprint = Blueprint('admin', __name__)
+
+# 管理接口的访问令牌：请求头 X-Admin-Token 或 Authorization: Bearer <token>。
+# 没有设置时所有管理接口都返回 404
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+PROFILE_FILE_KINDS = {'pstats': 'application/octet-stream', 'collapsed': 'text/plain'}
+
+
+@admin_blueprint.before_request
+def require_token():
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Not found"}), 404
+    token = request.headers.get('X-Admin-Token')
+    authorization = request.headers.get('Authorization', '')
+    if token is None and authorization.startswith('Bearer '):
+        token = authorization[len('Bearer '):]
+    if not token or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return jsonify({"error": "Invalid admin token"}), 401
+
+
+@admin_blueprint.route('/profiling', methods=['GET'])
+def profiling_status():
+    """当前采集开关和已采集的请求（最新的在前）"""
+    return jsonify({"settings": profiler.settings(), "captures": profiler.list_captures()})
+
+
+@admin_blueprint.route('/profiling', methods=['POST'])
+def update_profiling():
+    """
+    修改采集开关，所有 worker 在一秒内生效，不需要重启
+    JSON 参数（都可以省略）：
+    - sample_rate: 0 到 1，对这个比例的请求运行 cProfile（0 关闭）
+    - slow_ms: 耗时超过这么多毫秒的请求保存栈采样（0 关闭）
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({"error": "Please provide a JSON object"}), 400
+    values = {}
+    for key in ('sample_rate', 'slow_ms'):
+        value = body.get(key)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            return jsonify({"error": f"{key} must be a non-negative number"}), 400
+        values[key] = value
+    if values.get('sample_rate', 0) > 1:
+        return jsonify({"error": "sample_rate must be between 0 and 1"}), 400
+    return jsonify({"settings": profiler.update_settings(**values)})
+
+
+@admin_blueprint.route('/profiling', methods=['DELETE'])
+def clear_profiles():
+    profiler.clear()
+    return jsonify({"deleted": True})
+
+
+@admin_blueprint.route('/profiling/<capture_id>', methods=['GET'])
+def get_profile(capture_id):
+    meta = profiler.get(capture_id)
+    if meta is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return jsonify(meta)
+
+
+@admin_blueprint.route('/profiling/<capture_id>/<kind>', methods=['GET'])
+def download_profile(capture_id, kind):
+    """
+    下载采集的数据：
+    - pstats: python -m pstats <文件> 或 snakeviz 查看
+    - collapsed: 火焰图格式，flamegraph.pl 或 speedscope 查看
+    """
+    path = profiler.file_path(capture_id, kind)
+    if path is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return send_file(path, mimetype=PROFILE_FILE_KINDS[kind], as_attachment=True,
+                     download_name=f"{capture_id}.{kind}")
+#curl -H "X-Admin-Token: $ADMIN_TOKEN" -d '{"slow_ms": 500}' -H 'Content-Type: application/json' http://127.0.0.1:5000/admin/profiling
@@ -0,0 +1,219 @@
+import logging
+import os
+import csv
+import io
+import sys
+import threading
+from array import array
+
+import numpy as np
+import requests
+
+from services import geo
+from services.geocoding import geocode, normalize_city as normalize_key
+from services import upstream
+
+logger = logging.getLogger(__name__)
+
+# 开源机场数据库（OpenFlights 托管的 airports.dat 数据）
+OPENFLIGHTS_AIRPORTS_URL = "https://raw.githubusercontent.com/jpatokal/openflights/master/data/airports.dat"
+
+# 本地快照路径，可通过环境变量覆盖
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+AIRPORTS_DATA_PATH = os.getenv('AIRPORTS_DATA_PATH', os.path.join(DATA_DIR, 'airports.dat'))
+
+NO_AIRPORT = "No Airport Found"
+
+# 城市没有同名机场时，只接受这个距离（公里）以内的最近机场
+AIRPORT_MAX_DISTANCE_KM = float(os.getenv('AIRPORT_MAX_DISTANCE_KM', 150))
+
+
+class AirportTable:
+    """
+    按列存储的机场表：名称、城市、国家、IATA、经纬度各占一列，
+    另有城市名和 IATA 代码的哈希索引，查询为 O(1)。
+    """
+    __slots__ = ('names', 'cities', 'countries', 'iata', 'lat', 'lon', '_by_city', '_by_iata', '_arrays')
+
+    def __init__(self):
+        self.names = []
+        self.cities = []
+        self.countries = []
+        self.iata = []
+        self.lat = array('d')
+        self.lon = array('d')
+        self._by_city = {}
+        self._by_iata = {}
+        self._arrays = None
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_text(cls, text):
+        """解析 airports.dat（CSV 格式，字段可能带引号和逗号）"""
+        table = cls()
+        for fields in csv.reader(io.StringIO(text)):
+            if len(fields) < 8:
+                continue
+            try:
+                lat, lon = float(fields[6]), float(fields[7])
+            except ValueError:
+                continue
+            table._append(fields[1], fields[2], fields[3], fields[4], lat, lon)
+        return table
+
+    def _append(self, name, city, country, iata, lat, lon):
+        row = len(self.names)
+        iata = "" if iata == "\\N" else iata
+        self.names.append(name)
+        self.cities.append(city)
+        self.countries.append(country)
+        self.iata.append(iata)
+        self.lat.append(lat)
+        self.lon.append(lon)
+        # 与旧实现一致：同名城市取文件中第一个机场
+        self._by_city.setdefault(normalize_key(city), row)
+        if iata:
+            self._by_iata.setdefault(normalize_key(iata), row)
+
+    def row_for_city(self, city):
+        return self._by_city.get(normalize_key(city))
+
+    def row_for_iata(self, code):
+        return self._by_iata.get(normalize_key(code))
+
+    def info(self, row):
+        return self.names[row], self.lat[row], self.lon[row]
+
+    def arrays(self):
+        """
+        经纬度列的 NumPy 视图（不复制数据），以及“有 IATA 代码”的掩码，
+        用于一次性对整张表做向量化计算
+        """
+        if self._arrays is None:
+            self._arrays = (
+                np.frombuffer(self.lat, dtype=np.float64),
+                np.frombuffer(self.lon, dtype=np.float64),
+                np.fromiter((bool(code) for code in self.iata), dtype=bool, count=len(self.iata)),
+            )
+        return self._arrays
+
+
+_table = None
+_table_lock = threading.Lock()
+
+
+def download_snapshot(path=AIRPORTS_DATA_PATH, url=OPENFLIGHTS_AIRPORTS_URL, timeout=30):
+    """
+    下载 airports.dat 并原子地写入本地快照，返回文件内容
+    """
+    response = upstream.get(url, timeout=timeout)
+    response.raise_for_status()
+    text = response.text
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    return text
+
+
+def load_table(path=AIRPORTS_DATA_PATH):
+    """
+    读取本地快照构建机场表；本地没有快照时下载一次并缓存到磁盘
+    """
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+    else:
+        text = download_snapshot(path)
+    return AirportTable.from_text(text)
+
+
+def get_table():
+    """每个进程只加载一次机场表"""
+    global _table
+    if _table is None:
+        with _table_lock:
+            if _table is None:
+                _table = load_table()
+    return _table
+
+
+def set_table(table):
+    """替换当前进程的机场表（刷新快照后使用）"""
+    global _table
+    with _table_lock:
+        _table = table
+
+
+def nearest_airports(lat, lon, k=1, max_distance_km=None):
+    """
+    离给定坐标最近的 k 个有 IATA 代码的机场，
+    返回 [(机场名称, 纬度, 经度, IATA, 距离公里), ...]，按距离排序
+    """
+    table = get_table()
+    lats, lons, has_iata = table.arrays()
+    rows, distances = geo.k_nearest(lat, lon, lats, lons, k, mask=has_iata)
+    return [
+        (table.names[row], table.lat[row], table.lon[row], table.iata[row], round(float(distance), 1))
+        for row, distance in zip(rows, distances)
+        if max_distance_km is None or distance <= max_distance_km
+    ]
+
+
+def get_airport_info(city):
+    """
+    通过城市名称查询机场名称和经纬度：
+    先精确匹配城市名或 IATA 代码，找不到时按城市坐标取最近的机场
+    """
+    try:
+        table = get_table()
+    except (OSError, requests.exceptions.RequestException) as e:
+        logger.warning("Airport data unavailable: %s", e)
+        return NO_AIRPORT, None, None
+    row = table.row_for_city(city)
+    if row is None and len(city.strip()) == 3:
+        row = table.row_for_iata(city)
+    if row is not None:
+        return table.info(row)
+
+    # 郊区、小城镇或 "NYC" 这类写法：找城市附近的机场
+    lat, lon = geocode(city)
+    if lat is None:
+        return NO_AIRPORT, None, None
+    nearest = nearest_airports(lat, lon, 1, AIRPORT_MAX_DISTANCE_KM)
+    if not nearest:
+        return NO_AIRPORT, None, None
+    name, airport_lat, airport_lon = nearest[0][:3]
+    return name, airport_lat, airport_lon
+
+
+def get_airport_by_iata(code):
+    """通过 IATA 代码查询机场名称和经纬度"""
+    try:
+        table = get_table()
+    except (OSError, requests.exceptions.RequestException) as e:
+        logger.warning("Airport data unavailable: %s", e)
+        return NO_AIRPORT, None, None
+    row = table.row_for_iata(code)
+    if row is None:
+        return NO_AIRPORT, None, None
+    return table.info(row)
+
+
+def refresh(path=AIRPORTS_DATA_PATH):
+    """重新下载快照并重建当前进程的机场表"""
+    table = AirportTable.from_text(download_snapshot(path))
+    set_table(table)
+    return table
+
+
+if __name__ == "__main__":
+    # python -m services.airports refresh
+    if sys.argv[1:] != ['refresh']:
+        print("Usage: python -m services.airports refresh")
+        sys.exit(2)
+    table = refresh()
+    print(f"Wrote {len(table)} airports to {AIRPORTS_DATA_PATH}")
@@ -1,43 +1,19 @@
+import logging
 from flask import Blueprint, request, jsonify
 import requests
 import hashlib
-import os
-import hashlib
-from dotenv import load_dotenv  # 从 python-dotenv 导入加载函数
+from services.geocoding import convert_city_to_lat_lng
+from services import foursquare
+from services.streaming import wants_stream, ndjson_response
+
+logger = logging.getLogger(__name__)
 
 
 # 创建 Flask 蓝图
 places_blueprint = Blueprint('places', __name__)
 
-# 配置信息
-FOURSQUARE_API_KEY = os.getenv('FOURSQUARE_API_KEY')  # 从环境变量读取 API Key
-if not FOURSQUARE_API_KEY:
-    raise EnvironmentError("FOURSQUARE_API_KEY is not set. Please set it in the environment variables.")
-
-SEARCH_URL = 'https://api.foursquare.com/v3/places/search'
-DETAIL_URL = 'https://api.foursquare.com/v3/places'
-PHOTO_URL = 'https://api.foursquare.com/v3/places/{fsq_id}/photos'
-NOMINATIM_URL = 'https://nominatim.openstreetmap.org/search'
-
-# 城市名转经纬度函数
-def convert_city_to_lat_lng(city_name):
-    params = {
-        'q': city_name,
-        'format': 'json',
-        'addressdetails': 1,
-        'limit': 1
-    }
-    headers = {'User-Agent': 'MyTravelApp/1.0 (myemail@example.com)'}
-    try:
-        response = requests.get(NOMINATIM_URL, params=params, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        if data:
-            return f"{data[0]['lat']},{data[0]['lon']}"
-        return None
-    except requests.exceptions.RequestException as e:
-        print("Nominatim API Error:", e)
-        return None
+# 搜索接口只返回列表需要的字段
+ATTRACTION_FIELDS = ('fsq_id', 'name', 'location', 'distance', 'categories', 'geocodes')
 
 # 生成评分和价格
 def generate_rating_and_price(fsq_id):
@@ -46,25 +22,32 @@ def generate_rating_and_price(fsq_id):
     price = 10 + (hash_value % 41)  # 结果范围是 [10, 50]
     return round(rating, 1), price
 
-# 获取照片信息
-def fetch_photos(fsq_id):
-    headers = {'Authorization': FOURSQUARE_API_KEY}
-    try:
-        response = requests.get(PHOTO_URL.format(fsq_id=fsq_id), headers=headers)
-        response.raise_for_status()
-        photos = response.json()
-        return [
-            f"{photo['prefix']}original{photo['suffix']}" for photo in photos
-        ] if photos else ["No photo available"]
-    except requests.exceptions.RequestException as e:
-        print("Photo API Error:", e)
-        return ["No photo available"]
+def search_attractions(params):
+    """搜索景点，只在字段缺失时才补查详情"""
+    places = foursquare.search_places(params, fields=ATTRACTION_FIELDS)
+    return foursquare.fill_missing_fields(places, ATTRACTION_FIELDS, optional=('location', 'distance', 'categories', 'geocodes'))
+
+def format_attraction(place, photos):
+    fsq_id = place.get("fsq_id")
+    rating, price = generate_rating_and_price(fsq_id)
+
+    return {
+        "fsq_id": fsq_id,
+        "name": place.get("name", "No name available"),
+        "location": place.get("location", {}).get("formatted_address", "No address available"),
+        "distance": place.get("distance", "Unknown"),
+        "rating": rating,
+        "price": f"€{price}",
+        "categories": [cat["name"] for cat in place.get("categories", [])],
+        "photos": photos
+    }
 
 @places_blueprint.route('/', methods=['GET'])
 def get_attractions():
     city_name = request.args.get('city')
     radius = request.args.get('radius', 1000)
     limit = request.args.get('limit', 10)
+    photos = request.args.get('photos', 'all')  # none | first | all
     query = request.args.get('query')  # 景点名称关键字
     categories = request.args.get('categories')
 
@@ -75,46 +58,24 @@ def get_attractions():
     if not location:
         return jsonify({"error": f"Failed to retrieve location for city: {city_name}"}), 500
 
-    headers = {'Authorization': FOURSQUARE_API_KEY}
-    params = {
-        'll': location,
-        'radius': radius,
-        'limit': limit,
-        'categories': '16023,16032,16001,16021,16019',  # 景点相关分类 ID
-    }
-
-    # 如果用户提供了景点名称，则添加到请求参数
-    if query:
-        params['query'] = query
-        
-    if categories:
-        params['categories'] = categories
-
     try:
-        response = requests.get(SEARCH_URL, headers=headers, params=params)
-        response.raise_for_status()
-        data = response.json()
+        params = foursquare.listing_params(
+            location, radius,
+            categories or '16023,16032,16001,16021,16019',  # 景点相关分类 ID
+            limit,
+            query=query  # 如果用户提供了景点名称，则添加到请求参数
+        )
+    except ValueError:
+        return jsonify({"error": "radius and limit must be integers"}), 400
+    if photos not in foursquare.PHOTO_MODES:
+        return jsonify({"error": f"photos must be one of: {', '.join(foursquare.PHOTO_MODES)}"}), 400
 
-        attractions = []
-        for place in data.get("results", []):
-            fsq_id = place.get("fsq_id")
-            rating, price = generate_rating_and_price(fsq_id)
-
-            photos = fetch_photos(fsq_id)
-
-            attraction_details = {
-                "name": place.get("name", "No name available"),
-                "location": place.get("location", {}).get("formatted_address", "No address available"),
-                "distance": place.get("distance", "Unknown"),
-                "rating": rating,
-                "price": f"€{price}",
-                "categories": [cat["name"] for cat in place.get("categories", [])],
-                "photos": photos
-            }
-            attractions.append(attraction_details)
-
-        return jsonify(attractions)
+    try:
+        places = foursquare.cached_search('attraction', params, search_attractions)
+        if wants_stream():
+            return ndjson_response(foursquare.iter_listing(places, format_attraction, photos))
+        return jsonify(foursquare.build_listing(places, format_attraction, photos))
 
     except requests.exceptions.RequestException as e:
-        print("FourSquare API Error:", e)
+        logger.warning("FourSquare API Error: %s", e)
         return jsonify({"error": str(e)}), 500
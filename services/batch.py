@@ -0,0 +1,98 @@
+import json
+import os
+from urllib.parse import urlsplit, parse_qsl
+from services import enrich, logs
+
+# 一个批量请求最多包含的子请求数，以及整个批量请求的时间上限（秒）
+BATCH_MAX_REQUESTS = int(os.getenv('BATCH_MAX_REQUESTS', 20))
+BATCH_DEADLINE = float(os.getenv('BATCH_DEADLINE', 15))
+
+BATCH_METHODS = ('GET', 'POST')
+
+# 不转发给子请求的请求头：逐跳头、描述 /batch 请求体本身的头，以及子请求自己设置的头
+NOT_FORWARDED_HEADERS = frozenset(h.lower() for h in (
+    'Connection', 'Keep-Alive', 'Proxy-Authenticate', 'Proxy-Authorization', 'TE', 'Trailer', 'Trailers',
+    'Transfer-Encoding', 'Upgrade', 'Host', 'Content-Length', 'Content-Type', 'Content-Encoding', 'Expect',
+    logs.REQUEST_ID_HEADER,
+))
+
+
+def parse_item(item):
+    """
+    把一个子请求规整为 (method, path, args, body)，格式不对时抛出 ValueError。
+    子请求格式：{"path": "/weather/", "args": {"city": "Paris"}}，
+    也可以把查询参数直接写在 path 里；POST 子请求用 "body" 传 JSON。
+    """
+    if not isinstance(item, dict) or not isinstance(item.get('path'), str):
+        raise ValueError("Each sub-request needs a path")
+    method = str(item.get('method', 'GET')).upper()
+    if method not in BATCH_METHODS:
+        raise ValueError(f"Unsupported method: {method}")
+    url = urlsplit(item['path'])
+    if not url.path.startswith('/') or url.netloc:
+        raise ValueError(f"Invalid path: {item['path']}")
+    if url.path.rstrip('/') == '/batch':
+        raise ValueError("Nested batch requests are not allowed")
+    args = dict(parse_qsl(url.query))
+    extra = item.get('args') or {}
+    if not isinstance(extra, dict):
+        raise ValueError("args must be an object")
+    args.update({str(k): str(v) for k, v in extra.items()})
+    return method, url.path, args, item.get('body')
+
+
+def forwarded_headers(headers):
+    """父请求中要转发给每个子请求的头（Accept、Accept-Language、Authorization 等），子请求和直接调用行为一致"""
+    return [(name, value) for name, value in headers.items() if name.lower() not in NOT_FORWARDED_HEADERS]
+
+
+def _key(method, path, args, body):
+    return method, path, tuple(sorted(args.items())), json.dumps(body, sort_keys=True)
+
+
+def _dispatch(app, headers, method, path, args, body):
+    """在进程内执行一个子请求，不经过网络"""
+    client = app.test_client()
+    # 子请求沿用 /batch 的请求 ID，日志里可以把它们和父请求对应起来
+    response = client.open(path, method=method, query_string=args, json=body, follow_redirects=True,
+                           headers=[*headers, (logs.REQUEST_ID_HEADER, logs.current_request_id())])
+    data = response.get_json(silent=True)
+    return response.status_code, data if data is not None else response.get_data(as_text=True)
+
+
+def run_batch(app, items, headers=()):
+    """
+    并发执行一组子请求，按原顺序返回 [{"path", "status", "body"}, ...]。
+    相同的子请求只执行一次；超过 BATCH_DEADLINE 的子请求返回 504。
+    headers 是每个子请求都带上的请求头（通常是 forwarded_headers(request.headers)）。
+    """
+    headers = list(headers)
+    parsed = []
+    for item in items:
+        try:
+            parsed.append(parse_item(item))
+        except ValueError as e:
+            parsed.append(e)
+
+    unique = {}
+    for entry in parsed:
+        if not isinstance(entry, ValueError):
+            unique.setdefault(_key(*entry), entry)
+    keys = list(unique)
+    # 子请求本身还会用到补全线程池，所以放在单独的线程池里
+    results = enrich.run_ordered(
+        [lambda entry=entry: _dispatch(app, headers, *entry) for entry in unique.values()],
+        upstream='batch', deadline=BATCH_DEADLINE,
+        default=(504, {"error": "Sub-request timed out"}), pool='batch'
+    )
+    by_key = dict(zip(keys, results))
+
+    response = []
+    for item, entry in zip(items, parsed):
+        path = item.get('path') if isinstance(item, dict) else None
+        if isinstance(entry, ValueError):
+            response.append({"path": path, "status": 400, "body": {"error": str(entry)}})
+        else:
+            status, body = by_key[_key(*entry)]
+            response.append({"path": path, "status": status, "body": body})
+    return response
@@ -0,0 +1,117 @@
+import importlib
+import logging
+import os
+import threading
+import time
+
+from flask import Flask
+from werkzeug.wrappers import Response
+
+from services import hooks, lifecycle
+
+logger = logging.getLogger(__name__)
+
+# 蓝图清单：(URL 前缀, 模块, 蓝图变量名)。只在这里登记，app.py 不直接导入各个服务模块
+MANIFEST = (
+    ('/weather', 'services.weather', 'weather_blueprint'),
+    ('/train', 'services.train', 'train_blueprint'),
+    ('/restaurants', 'services.restaurant', 'restaurant_blueprint'),
+    ('/hotel', 'services.hotel', 'hotel_blueprint'),
+    ('/flight', 'services.flight', 'flight_blueprint'),
+    ('/attraction', 'services.attraction', 'places_blueprint'),
+    ('/car', 'services.car', 'car_blueprint'),
+    ('/compare', 'services.compare', 'compare_blueprint'),
+    ('/photos', 'services.photos', 'photos_blueprint'),
+    ('/cities', 'services.cities', 'cities_blueprint'),
+    ('/admin', 'services.admin', 'admin_blueprint'),
+)
+
+# LAZY_BLUEPRINTS=1 时启动只注册清单，每个前缀的模块（连同它的 HTTP、配置初始化）
+# 在第一次请求这个前缀时才导入，缩短冷启动时间；默认在启动时全部导入
+LAZY_BLUEPRINTS = os.getenv('LAZY_BLUEPRINTS', '0') == '1'
+
+# 每个前缀导入模块、创建蓝图花的时间，/ready 中报告
+_load_report = {}
+_report_lock = threading.Lock()
+
+
+def _import_blueprint(prefix, module_name, attribute):
+    start = time.perf_counter()
+    blueprint = getattr(importlib.import_module(module_name), attribute)
+    with _report_lock:
+        _load_report[prefix] = {"module": module_name, "import_ms": round((time.perf_counter() - start) * 1000, 1)}
+    return blueprint
+
+
+def register_all(app, manifest=MANIFEST):
+    """启动时导入清单中的所有模块，直接注册到主应用上"""
+    for prefix, module_name, attribute in manifest:
+        app.register_blueprint(_import_blueprint(prefix, module_name, attribute), url_prefix=prefix)
+
+
+class LazyBlueprints:
+    """
+    按 URL 前缀分发的 WSGI 中间件：第一次请求某个前缀时导入对应模块，
+    为它创建一个子应用（配置与主应用相同，装上同样的请求处理），之后直接交给子应用。
+    不属于任何前缀的请求交给主应用。
+    Flask 不允许处理过请求之后再注册蓝图，所以每个前缀是一个独立的子应用。
+    """
+
+    def __init__(self, app, manifest=MANIFEST):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+        # 较长的前缀先匹配
+        self.manifest = sorted(manifest, key=lambda entry: len(entry[0]), reverse=True)
+        self._apps = {}
+        self._locks = {prefix: threading.Lock() for prefix, _, _ in manifest}
+
+    def _match(self, path):
+        for entry in self.manifest:
+            prefix = entry[0]
+            if path == prefix or path.startswith(prefix + '/'):
+                return entry
+        return None
+
+    def _sub_app(self, prefix, module_name, attribute):
+        sub_app = self._apps.get(prefix)
+        if sub_app is not None:
+            return sub_app
+        with self._locks[prefix]:
+            sub_app = self._apps.get(prefix)
+            if sub_app is None:
+                blueprint = _import_blueprint(prefix, module_name, attribute)
+                sub_app = Flask(self.app.import_name)
+                sub_app.config.update(self.app.config)
+                hooks.install(sub_app)
+                sub_app.register_blueprint(blueprint, url_prefix=prefix)
+                # 新导入的模块登记了自己的缓存，从快照里恢复
+                lifecycle.restore_snapshot()
+                self._apps[prefix] = sub_app
+        return sub_app
+
+    def __call__(self, environ, start_response):
+        entry = self._match(environ.get('PATH_INFO', ''))
+        if entry is None:
+            return self.wsgi_app(environ, start_response)
+        try:
+            sub_app = self._sub_app(*entry)
+        except Exception as e:
+            # 例如缺少 API Key：只有这个前缀不可用，下一次请求重新尝试导入
+            logger.exception("Could not load blueprint %s from %s: %s", entry[0], entry[1], e)
+            response = Response('{"error": "Service temporarily unavailable"}', status=503, mimetype='application/json')
+            return response(environ, start_response)
+        return sub_app(environ, start_response)
+
+
+def install(app, lazy=LAZY_BLUEPRINTS):
+    """按 LAZY_BLUEPRINTS 选择启动模式，返回 app"""
+    if lazy:
+        app.wsgi_app = LazyBlueprints(app)
+    else:
+        register_all(app)
+    return app
+
+
+def load_report():
+    with _report_lock:
+        return {prefix: dict(entry) for prefix, entry in _load_report.items()}
@@ -0,0 +1,381 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from services.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# 持久化缓存文件所在目录
+CACHE_DIR = os.getenv('CACHE_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data'))
+
+# 缓存未命中时返回的哨兵值（None 本身可能是合法的缓存值）
+MISSING = object()
+
+# 创建时指定 snapshot=True 的缓存，按名称登记，由 services.lifecycle 定期保存并在启动时恢复
+_snapshot_caches = {}
+
+
+def snapshot_caches():
+    return dict(_snapshot_caches)
+
+
+def _register(cache, snapshot):
+    if snapshot:
+        if not cache.name:
+            raise ValueError("Snapshot caches need a name")
+        _snapshot_caches[cache.name] = cache
+
+
+class TTLCache:
+    """
+    线程安全的 LRU 缓存，每个条目带过期时间（TTL）。
+    超出 maxsize 时淘汰最久未使用的条目。
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, name=None, snapshot=False):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        _register(self, snapshot)
+
+    def get(self, key, default=MISSING):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def export(self):
+        """未过期的条目 [(key, 过期的墙钟时间, value)]，从最久未使用到最近使用"""
+        now, wall = time.monotonic(), time.time()
+        with self._lock:
+            return [(key, wall + expires_at - now, value)
+                    for key, (expires_at, value) in self._data.items() if expires_at > now]
+
+    def load(self, entries):
+        """恢复 export 的条目；已有的 key 保留当前值。返回恢复的条目数"""
+        wall, loaded = time.time(), 0
+        for key, expires_at, value in entries:
+            remaining = expires_at - wall
+            if remaining <= 0:
+                continue
+            with self._lock:
+                if key in self._data:
+                    continue
+            self.set(key, value, ttl=remaining)
+            loaded += 1
+        return loaded
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class SWRCache:
+    """
+    按字节数限制大小的缓存，支持 stale-while-revalidate：
+    - 未过期（ttl 内）的条目直接返回
+    - 过期但仍在 stale_ttl 内的条目也立即返回，同时在后台线程刷新
+    - 没有可用条目时同步加载，同一个 key 的并发加载只执行一次
+    shared 是所有 worker 共用的第二级缓存（services.cache_backends），本地没有时先查它，
+    加载的结果同时写进去，这样一个 worker 调用上游之后其他 worker 也能命中
+    """
+
+    def __init__(self, max_bytes, ttl, stale_ttl, sizeof=None, name=None, background=None, snapshot=False,
+                 shared=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.sizeof = sizeof or (lambda value: len(repr(value)))
+        self.name = name
+        # 后台刷新时进入的上下文（例如把上游请求标记为低优先级）
+        self.background = background
+        self.shared = shared
+        self._data = OrderedDict()  # key -> (stored_at, size, value)
+        self._bytes = 0
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self.hits = 0
+        self.stale_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.evictions = 0
+        _register(self, snapshot)
+
+    def get_or_load(self, key, loader):
+        value = self._cached(key, loader)
+        if value is MISSING and self.shared is not None:
+            entry = self.shared.get(key)
+            if entry is not MISSING:
+                # 共享缓存保存的是（存入的墙钟时间, 值），换算回本进程的单调时钟
+                # 直接返回共享的值，不再经过 _cached()，否则同一次读取会再记一次本地命中
+                stored_wall, value = entry
+                stored_at = time.monotonic() - max(0.0, time.time() - stored_wall)
+                self.set(key, value, stored_at=stored_at, share=False)
+                with self._lock:
+                    self.shared_hits += 1
+                    if time.monotonic() - stored_at >= self.ttl:
+                        self._start_refresh(key, loader)
+                return value
+        if value is not MISSING:
+            return value
+        with self._lock:
+            self.misses += 1
+        return self._flight.do(key, lambda: self._load(key, loader))
+
+    def _cached(self, key, loader):
+        """本地可用的条目（过期的同时在后台刷新），没有时返回 MISSING"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+            stored_at, _, value = entry
+            age = now - stored_at
+            if age < self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self._data.move_to_end(key)
+                self.stale_hits += 1
+                self._start_refresh(key, loader)
+                return value
+            self._remove(key)
+            return MISSING
+
+    def _start_refresh(self, key, loader):
+        """在后台线程刷新 key（调用时持有 self._lock），同一个 key 同时只刷新一次"""
+        if key not in self._refreshing:
+            self._refreshing.add(key)
+            threading.Thread(target=self._refresh, args=(key, loader), daemon=True).start()
+
+    def _load(self, key, loader):
+        value = loader()
+        self.set(key, value)
+        return value
+
+    def _refresh(self, key, loader):
+        try:
+            if self.background is not None:
+                with self.background():
+                    self._load(key, loader)
+            else:
+                self._load(key, loader)
+            with self._lock:
+                self.refreshes += 1
+        except Exception as e:
+            # 刷新失败时继续使用旧条目
+            with self._lock:
+                self.refresh_errors += 1
+            logger.warning("Background refresh failed for %s %s: %s", self.name or 'cache', key, e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def set(self, key, value, stored_at=None, share=True):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        now = time.monotonic()
+        stored_at = now if stored_at is None else stored_at
+        if share and self.shared is not None:
+            self.shared.set(key, (time.time() - (now - stored_at), value),
+                            ttl=self.ttl + self.stale_ttl - (now - stored_at))
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (stored_at, size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def export(self):
+        """
+        仍可使用（包括过期但在 stale_ttl 内）的条目 [(key, 不再可用的墙钟时间, value)]，
+        从最久未使用到最近使用
+        """
+        now, wall, lifetime = time.monotonic(), time.time(), self.ttl + self.stale_ttl
+        with self._lock:
+            return [(key, wall + stored_at + lifetime - now, value)
+                    for key, (stored_at, _, value) in self._data.items() if now - stored_at < lifetime]
+
+    def load(self, entries):
+        """恢复 export 的条目，保留原来的存入时间（过期的条目恢复后仍会在后台刷新）"""
+        now, wall, lifetime, loaded = time.monotonic(), time.time(), self.ttl + self.stale_ttl, 0
+        for key, usable_until, value in entries:
+            remaining = usable_until - wall
+            if remaining <= 0:
+                continue
+            with self._lock:
+                if key in self._data:
+                    continue
+            self.set(key, value, stored_at=now - (lifetime - remaining), share=False)
+            loaded += 1
+        return loaded
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "evictions": self.evictions,
+            **({"shared": self.shared.stats()} if self.shared is not None else {}),
+        }
+
+
+class PersistentCache:
+    """
+    基于 SQLite 文件的键值缓存，进程重启后仍然有效，适合很少变化的数据
+    （例如城市对应的 SNCF 站点 ID）。值以 JSON 保存，key 为字符串。
+    """
+
+    def __init__(self, path, ttl, name=None, snapshot=False):
+        self.path = path
+        self.ttl = ttl
+        self.name = name
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        _register(self, snapshot)
+
+    def _connection(self):
+        # SQLite 连接不能跨 fork 使用，每个进程单独打开
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get(self, key, default=MISSING):
+        try:
+            with self._lock:
+                row = self._connection().execute(
+                    "SELECT value FROM cache WHERE key = ? AND expires_at > ?", (key, time.time())
+                ).fetchone()
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning("Persistent cache error (%s): %s", self.name or self.path, e)
+            return default
+        if row is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        try:
+            with self._lock:
+                conn = self._connection()
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                        (key, json.dumps(value), expires_at)
+                    )
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning("Persistent cache error (%s): %s", self.name or self.path, e)
+
+    def export(self):
+        """未过期的条目 [(key, 过期时间, value)]，按过期时间排序"""
+        try:
+            with self._lock:
+                rows = self._connection().execute(
+                    "SELECT key, expires_at, value FROM cache WHERE expires_at > ? ORDER BY expires_at", (time.time(),)
+                ).fetchall()
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning("Persistent cache error (%s): %s", self.name or self.path, e)
+            return []
+        return [(key, expires_at, json.loads(value)) for key, expires_at, value in rows]
+
+    def load(self, entries):
+        """恢复 export 的条目（数据库文件丢失时），已有的 key 保留当前值"""
+        rows = [(key, json.dumps(value), expires_at) for key, expires_at, value in entries if expires_at > time.time()]
+        try:
+            with self._lock:
+                conn = self._connection()
+                with conn:
+                    before = conn.total_changes
+                    conn.executemany("INSERT OR IGNORE INTO cache (key, value, expires_at) VALUES (?, ?, ?)", rows)
+                    return conn.total_changes - before
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning("Persistent cache error (%s): %s", self.name or self.path, e)
+            return 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "errors": self.errors}
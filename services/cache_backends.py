@@ -0,0 +1,448 @@
+import hashlib
+import hmac
+import logging
+import marshal
+import os
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import unquote, urlsplit
+
+from services.cache import CACHE_DIR, MISSING, TTLCache
+
+logger = logging.getLogger(__name__)
+
+# 缓存后端：
+# - memory：每个 worker 进程内的 LRU（TTLCache），默认
+# - sqlite：同一台机器上所有 worker 共用一个 SQLite 文件（WAL 模式）
+# - redis：所有机器共用一个 Redis（或兼容 RESP 协议的服务）
+# memory 之外的后端里每个条目只保存一份，N 个 worker 不再各自缓存、各自调用上游
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory').strip().lower()
+CACHE_BACKENDS = ('memory', 'sqlite', 'redis')
+
+SHARED_CACHE_PATH = os.getenv('SHARED_CACHE_PATH', os.path.join(CACHE_DIR, 'shared_cache.sqlite3'))
+
+REDIS_URL = os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/0')
+REDIS_KEY_PREFIX = os.getenv('REDIS_KEY_PREFIX', 'travel:')
+REDIS_TIMEOUT = float(os.getenv('REDIS_TIMEOUT', 0.5))
+# 连不上 Redis 之后这么多秒内直接当作未命中，不让每个请求都等连接超时
+REDIS_RETRY_INTERVAL = float(os.getenv('REDIS_RETRY_INTERVAL', 5))
+
+# 值的二进制格式：1 字节格式版本 + 1 字节签名标记（+ 32 字节 HMAC-SHA256）+ marshal。
+# marshal 只支持内置类型（dict、list、tuple、str、数字、None……），上游的 JSON 结果都满足，读取比 JSON 快。
+# marshal 不防恶意或损坏的数据：构造的输入可以让解释器崩溃。能写入 Redis 或 SQLite 文件的人
+# 就能控制所有 worker 解析的内容，所以共享后端必须是可信的；设置 CACHE_SIGNING_KEY 后每个值都带签名，
+# 签名不对（或没有签名）的值在 marshal.loads 之前就被丢弃，按未命中处理
+CACHE_SIGNING_KEY = os.getenv('CACHE_SIGNING_KEY', '').encode()
+_FORMAT = bytes([marshal.version])
+_UNSIGNED, _SIGNED = b'\x00', b'\x01'
+_MAC_SIZE = hashlib.sha256().digest_size
+
+
+def _mac(payload):
+    return hmac.new(CACHE_SIGNING_KEY, payload, hashlib.sha256).digest()
+
+
+def dumps(value):
+    """序列化缓存值；不支持的类型抛出 ValueError"""
+    payload = marshal.dumps(value)
+    if CACHE_SIGNING_KEY:
+        return _FORMAT + _SIGNED + _mac(payload) + payload
+    return _FORMAT + _UNSIGNED + payload
+
+
+def loads(data):
+    """
+    反序列化 dumps 的结果；格式不对（例如其他 Python 版本写入的）、
+    配置了 CACHE_SIGNING_KEY 而签名不对或没有签名时抛出 ValueError
+    """
+    if data[:1] != _FORMAT:
+        raise ValueError("Unknown cache value format")
+    if CACHE_SIGNING_KEY:
+        mac, payload = data[2:2 + _MAC_SIZE], data[2 + _MAC_SIZE:]
+        if data[1:2] != _SIGNED or not hmac.compare_digest(mac, _mac(payload)):
+            raise ValueError("Cache value signature mismatch")
+    elif data[1:2] == _UNSIGNED:
+        payload = data[2:]
+    else:
+        raise ValueError("Signed cache value but CACHE_SIGNING_KEY is not set")
+    try:
+        return marshal.loads(payload)
+    except (EOFError, TypeError) as e:
+        raise ValueError(f"Corrupted cache value: {e}") from e
+
+
+def _key(key):
+    # 缓存键可以是元组（例如 (出发站, 到达站, 日期)），共享存储里统一转成字符串
+    return key if isinstance(key, str) else repr(key)
+
+
+class SharedCache:
+    """共享缓存的公共部分：序列化、命中统计、出错时按未命中处理"""
+
+    backend = None
+
+    def __init__(self, name, maxsize, ttl):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.evictions = 0
+        self.unserializable = 0
+        # 计数器会被 enrich 线程池里的多个线程同时更新
+        self._stats_lock = threading.Lock()
+
+    def _count(self, counter, n=1):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def get(self, key, default=MISSING):
+        try:
+            data = self._get(_key(key))
+        except Exception as e:
+            self._error(e)
+            data = None
+        if data is not None:
+            try:
+                value = loads(data)
+            except ValueError:
+                data = None
+        if data is None:
+            self._count('misses')
+            return default
+        self._count('hits')
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        try:
+            data = dumps(value)
+        except ValueError:
+            # 不能放进共享存储的值（例如自定义对象）：不缓存，由调用方重新加载
+            self._count('unserializable')
+            return
+        try:
+            self._set(_key(key), data, ttl)
+        except Exception as e:
+            self._error(e)
+
+    def delete(self, key):
+        try:
+            self._delete(_key(key))
+        except Exception as e:
+            self._error(e)
+
+    def _error(self, e):
+        self._count('errors')
+        if isinstance(e, BackendUnavailable):
+            return  # 第一次连接失败时已经记录过
+        logger.warning("Shared cache error (%s, %s): %s", self.backend, self.name, e)
+
+    def stats(self):
+        return {
+            "backend": self.backend,
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "evictions": self.evictions,
+            "unserializable": self.unserializable,
+        }
+
+
+_sqlite_local = threading.local()
+
+
+def _sqlite_connection(path):
+    """每个线程一个连接（WAL 模式下读可以并行），fork 之后重新打开"""
+    connections = getattr(_sqlite_local, 'connections', None)
+    if connections is None or _sqlite_local.pid != os.getpid():
+        connections = _sqlite_local.connections = {}
+        _sqlite_local.pid = os.getpid()
+    conn = connections.get(path)
+    if conn is None:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL 模式下 NORMAL 只在检查点时 fsync；缓存丢掉最后几次写入没有关系
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries (namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL,"
+            " expires_at REAL NOT NULL, PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_expiry ON entries (namespace, expires_at)")
+        connections[path] = conn
+    return conn
+
+
+class SQLiteCache(SharedCache):
+    """
+    同一台机器上所有 worker 共用的缓存，所有缓存放在一个 SQLite 文件里，按名称分开。
+    超过 maxsize 条时先删除过期的条目，再删除最早过期的（近似 LRU，读取时不写库）。
+    """
+
+    backend = 'sqlite'
+    # 每写入这么多次检查一次条目数
+    EVICT_CHECK_EVERY = 64
+
+    def __init__(self, name, maxsize, ttl, path=SHARED_CACHE_PATH):
+        super().__init__(name, maxsize, ttl)
+        self.path = path
+        self._writes = 0
+
+    def _get(self, key):
+        row = _sqlite_connection(self.path).execute(
+            "SELECT value FROM entries WHERE namespace = ? AND key = ? AND expires_at > ?",
+            (self.name, key, time.time())
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def _set(self, key, data, ttl):
+        conn = _sqlite_connection(self.path)
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (self.name, key, data, time.time() + ttl)
+        )
+        with self._stats_lock:
+            self._writes += 1
+            check = self._writes % self.EVICT_CHECK_EVERY == 0
+        if check:
+            self._evict(conn)
+
+    def _evict(self, conn):
+        now = time.time()
+        conn.execute("DELETE FROM entries WHERE namespace = ? AND expires_at <= ?", (self.name, now))
+        size = conn.execute("SELECT COUNT(*) FROM entries WHERE namespace = ?", (self.name,)).fetchone()[0]
+        excess = size - self.maxsize
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM entries WHERE namespace = ? AND key IN"
+                " (SELECT key FROM entries WHERE namespace = ? ORDER BY expires_at LIMIT ?)",
+                (self.name, self.name, excess)
+            )
+            self._count('evictions', excess)
+
+    def _delete(self, key):
+        _sqlite_connection(self.path).execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (self.name, key))
+
+    def clear(self):
+        try:
+            _sqlite_connection(self.path).execute("DELETE FROM entries WHERE namespace = ?", (self.name,))
+        except sqlite3.Error as e:
+            self._error(e)
+
+    def __len__(self):
+        try:
+            return _sqlite_connection(self.path).execute(
+                "SELECT COUNT(*) FROM entries WHERE namespace = ? AND expires_at > ?", (self.name, time.time())
+            ).fetchone()[0]
+        except sqlite3.Error as e:
+            self._error(e)
+            return 0
+
+    def stats(self):
+        return {**super().stats(), "size": len(self)}
+
+
+class RedisError(Exception):
+    """Redis 返回的错误回复（-ERR ...）"""
+
+
+class BackendUnavailable(ConnectionError):
+    """连接失败后的重试间隔内，不再尝试连接"""
+
+
+class RespClient:
+    """
+    最小的 Redis 客户端（RESP2 协议），只实现缓存用到的命令。
+    每个进程一个连接池，一个命令占用一个连接、一问一答；fork 之后重新建立连接。
+    """
+
+    def __init__(self, url=REDIS_URL, timeout=REDIS_TIMEOUT, retry_interval=REDIS_RETRY_INTERVAL, max_idle=16):
+        parts = urlsplit(url)
+        if parts.scheme != 'redis':
+            raise ValueError(f"Unsupported Redis URL: {url}")
+        self.host = parts.hostname or '127.0.0.1'
+        self.port = parts.port or 6379
+        self.password = unquote(parts.password) if parts.password else None
+        self.db = int(parts.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.max_idle = max_idle
+        self._idle = []
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._down_until = 0.0
+
+    @staticmethod
+    def _encode(args):
+        out = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            out.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(out)
+
+    @classmethod
+    def _read(cls, reader):
+        line = reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError("Connection closed by Redis")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload
+        if kind == b'-':
+            raise RedisError(payload.decode(errors='replace'))
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            size = int(payload)
+            if size < 0:
+                return None
+            data = reader.read(size + 2)
+            if len(data) != size + 2:
+                raise ConnectionError("Connection closed by Redis")
+            return data[:-2]
+        if kind == b'*':
+            size = int(payload)
+            return None if size < 0 else [cls._read(reader) for _ in range(size)]
+        raise ConnectionError(f"Unexpected Redis reply: {line[:32]!r}")
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = (sock, sock.makefile('rb'))
+        try:
+            if self.password:
+                self._call(connection, ('AUTH', self.password))
+            if self.db:
+                self._call(connection, ('SELECT', self.db))
+        except Exception:
+            self._close(connection)
+            raise
+        return connection
+
+    def _call(self, connection, args):
+        sock, reader = connection
+        sock.sendall(self._encode(args))
+        return self._read(reader)
+
+    @staticmethod
+    def _close(connection):
+        sock, reader = connection
+        reader.close()
+        sock.close()
+
+    def _acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # 父进程的连接不能在子进程里用，直接丢掉（不关闭，父进程还在用）
+                self._idle, self._pid = [], os.getpid()
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def _release(self, connection):
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self.max_idle:
+                self._idle.append(connection)
+                return
+        self._close(connection)
+
+    def execute(self, *args):
+        """执行一个命令并返回回复；连不上时抛出 OSError，之后 retry_interval 秒内直接抛出 BackendUnavailable"""
+        if time.monotonic() < self._down_until:
+            raise BackendUnavailable(f"Redis {self.host}:{self.port} unavailable, retrying later")
+        try:
+            connection = self._acquire()
+        except OSError:
+            self._down_until = time.monotonic() + self.retry_interval
+            raise
+        try:
+            reply = self._call(connection, args)
+        except RedisError:
+            self._release(connection)
+            raise
+        except Exception:
+            # 连接状态未知（超时、断开），不放回连接池
+            self._close(connection)
+            raise
+        self._release(connection)
+        return reply
+
+
+_redis_clients = {}
+_redis_lock = threading.Lock()
+
+
+def redis_client(url=REDIS_URL):
+    """同一个 URL 的缓存共用一个客户端（连接池）"""
+    with _redis_lock:
+        client = _redis_clients.get(url)
+        if client is None:
+            client = _redis_clients[url] = RespClient(url)
+        return client
+
+
+class RedisCache(SharedCache):
+    """
+    所有机器共用的缓存，键为 "<REDIS_KEY_PREFIX><缓存名>:<key>"，用 PX 设置过期时间。
+    条目数上限由 Redis 的 maxmemory 和 maxmemory-policy（建议 volatile-lru）控制，
+    maxsize 只在 stats 里报告。Redis 不可用时所有读取都按未命中处理
+    """
+
+    backend = 'redis'
+
+    def __init__(self, name, maxsize, ttl, client=None, prefix=REDIS_KEY_PREFIX):
+        super().__init__(name, maxsize, ttl)
+        self.client = client or redis_client()
+        self.prefix = f"{prefix}{name}:"
+
+    def _get(self, key):
+        return self.client.execute('GET', self.prefix + key)
+
+    def _set(self, key, data, ttl):
+        self.client.execute('SET', self.prefix + key, data, 'PX', max(1, int(ttl * 1000)))
+
+    def _delete(self, key):
+        self.client.execute('DEL', self.prefix + key)
+
+    def clear(self):
+        try:
+            cursor = b'0'
+            while True:
+                cursor, keys = self.client.execute('SCAN', cursor, 'MATCH', self.prefix + '*', 'COUNT', 500)
+                if keys:
+                    self.client.execute('DEL', *keys)
+                if cursor == b'0':
+                    break
+        except Exception as e:
+            self._error(e)
+
+
+def shared_cache(name, maxsize, ttl, backend=None):
+    """CACHE_BACKEND 为 sqlite 或 redis 时返回对应的共享缓存，memory 时返回 None"""
+    backend = backend or CACHE_BACKEND
+    if backend == 'sqlite':
+        return SQLiteCache(name, maxsize, ttl)
+    if backend == 'redis':
+        return RedisCache(name, maxsize, ttl)
+    if backend != 'memory':
+        raise ValueError(f"Unknown CACHE_BACKEND {backend!r}, expected one of {', '.join(CACHE_BACKENDS)}")
+    return None
+
+
+def make_cache(name, maxsize, ttl, snapshot=False, backend=None):
+    """
+    按 CACHE_BACKEND 创建缓存，接口相同（get / set / delete / clear / stats）。
+    snapshot 只对进程内缓存有效：共享缓存本身在 worker 重启后仍然存在
+    """
+    cache = shared_cache(name, maxsize, ttl, backend)
+    if cache is None:
+        cache = TTLCache(maxsize=maxsize, ttl=ttl, name=name, snapshot=snapshot)
+    return cache
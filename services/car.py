@@ -1,51 +1,90 @@
+import logging
 import os
 import requests
 from flask import Blueprint, request, jsonify
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
+from services.geocoding import geocode, normalize_city
+from services import upstream, enrich, ratelimit
+from services.cache import MISSING
+from services.cache_backends import make_cache
+from services.params import city_list
 
-# 加载 .env 文件中的环境变量
-load_dotenv()
+logger = logging.getLogger(__name__)
 
 # 创建 car 蓝图
 car_blueprint = Blueprint('car', __name__)
 
 # 从环境变量中获取 OpenRouteService API Key
 ORS_API_KEY = os.getenv("ORS_API_KEY")
+DIRECTIONS_URL = "https://api.openrouteservice.org/v2/directions/driving-car"
+MATRIX_URL = "https://api.openrouteservice.org/v2/matrix/driving-car"
+
+# 两城市之间的驾车距离和时间，A→B 与 B→A 共用一个条目
+CAR_ROUTE_CACHE_TTL = int(os.getenv('CAR_ROUTE_CACHE_TTL', 24 * 3600))
+_route_cache = make_cache('car_routes', int(os.getenv('CAR_ROUTE_CACHE_SIZE', 4096)), CAR_ROUTE_CACHE_TTL)
+
+# 矩阵接口一次最多计算的城市对数
+CAR_MATRIX_MAX_PAIRS = int(os.getenv('CAR_MATRIX_MAX_PAIRS', 100))
 
 def fetch_city_coordinates(city):
-    """通过 OpenRouteService API 获取城市的经纬度"""
-    try:
-        geocode_url = f"https://api.openrouteservice.org/geocode/search?api_key={ORS_API_KEY}&text={city}, France"
-        response = requests.get(geocode_url)
-        response.raise_for_status()  # 确保返回状态为 200
-        data = response.json()
-        return data['features'][0]['geometry']['coordinates'] if 'features' in data and data['features'] else None
-    except Exception as e:
-        print(f"Error fetching coordinates for {city}: {str(e)}")
-        return None
+    """获取城市坐标，按 OpenRouteService 的顺序返回 [lon, lat]"""
+    lat, lon = geocode(city)
+    return [lon, lat] if lat is not None else None
+
+def _pair_key(origin, destination):
+    return tuple(sorted((normalize_city(origin), normalize_city(destination))))
+
+def _ors_headers():
+    return {
+        'Authorization': ORS_API_KEY,
+        'Content-Type': 'application/json'
+    }
+
+def format_car_route(origin, destination, date, distance_km, duration_seconds):
+    """按统一格式返回驾车结果"""
+    # 计算出发和到达时间
+    departure_time = datetime.strptime(date, "%Y-%m-%d") + timedelta(hours=9)  # 假设早上 9 点出发
+    arrival_time = departure_time + timedelta(seconds=duration_seconds)
+
+    # 转换时间格式
+    duration_str = f"{int(duration_seconds // 3600)}h {int((duration_seconds % 3600) // 60)}m"
+
+    # 计算成本
+    cost = distance_km * 0.2
+
+    return {
+        "from": origin,
+        "to": destination,
+        "date": date,
+        "time": f"{departure_time.strftime('%H:%M')}-{arrival_time.strftime('%H:%M')}",
+        "duration": duration_str,
+        "type": "car",
+        "price": f"{cost:.0f}",
+        "distance": f"{distance_km:.1f}km",
+    }
 
 def get_car_route(origin, destination, date):
     """
     使用 OpenRouteService API 获取两个城市之间的驾车距离和时间，并返回带时间和日期的结果。
     """
     try:
-        headers = {
-            'Authorization': ORS_API_KEY,
-            'Content-Type': 'application/json'
-        }
+        key = _pair_key(origin, destination)
+        cached = _route_cache.get(key)
+        if cached is not MISSING:
+            return format_car_route(origin, destination, date, *cached)
 
-        # 获取城市坐标
-        origin_coords = fetch_city_coordinates(origin)
-        dest_coords = fetch_city_coordinates(destination)
+        # 并发获取两个城市的坐标
+        origin_coords, dest_coords = enrich.run_ordered(
+            [lambda: fetch_city_coordinates(origin), lambda: fetch_city_coordinates(destination)],
+            upstream='geocode'
+        )
 
         if not origin_coords or not dest_coords:
             return {"error": f"Could not fetch coordinates for '{origin}' or '{destination}'"}
 
         # 构建路线请求
-        directions_url = "https://api.openrouteservice.org/v2/directions/driving-car"
         body = {"coordinates": [origin_coords, dest_coords], "format": "json"}
-        response = requests.post(directions_url, json=body, headers=headers)
+        response = upstream.post(DIRECTIONS_URL, json=body, headers=_ors_headers())
         response.raise_for_status()  # 确保返回状态为 200
 
         route_data = response.json()
@@ -53,34 +92,75 @@ def get_car_route(origin, destination, date):
         # 提取距离和时间
         distance_km = route_data['routes'][0]['summary']['distance'] / 1000  # 转换为公里
         duration_seconds = route_data['routes'][0]['summary']['duration']  # 总秒数
+        _route_cache.set(key, (distance_km, duration_seconds))
 
-        # 计算出发和到达时间
-        departure_time = datetime.strptime(date, "%Y-%m-%d") + timedelta(hours=9)  # 假设早上 9 点出发
-        arrival_time = departure_time + timedelta(seconds=duration_seconds)
-
-        # 转换时间格式
-        duration_str = f"{int(duration_seconds // 3600)}h {int((duration_seconds % 3600) // 60)}m"
-
-        # 计算成本
-        cost = distance_km * 0.2
-
-        return {
-            "from": origin,
-            "to": destination,
-            "date": date,
-            "time": f"{departure_time.strftime('%H:%M')}-{arrival_time.strftime('%H:%M')}",
-            "duration": duration_str,
-            "type": "car",
-            "price": f"{cost:.0f}",
-            "distance": f"{distance_km:.1f}km",
-        }
+        return format_car_route(origin, destination, date, distance_km, duration_seconds)
     except requests.exceptions.RequestException as e:
-        print(f"API Request error: {str(e)}")
+        logger.warning("API Request error: %s", e)
         return {"error": "Failed to fetch route data"}
+    except ratelimit.RateLimited:
+        raise  # 由 app 统一返回 503
     except Exception as e:
-        print(f"Unexpected error: {str(e)}")
+        logger.exception("Unexpected error: %s", e)
         return {"error": "An unexpected error occurred"}
 
+def _matrix_tables(data, rows, columns):
+    """检查 ORS 矩阵响应的形状，返回 (distances, durations)；格式不对时抛出 ValueError"""
+    tables = []
+    for name in ('distances', 'durations'):
+        table = data.get(name) if isinstance(data, dict) else None
+        if (not isinstance(table, list) or len(table) != rows
+                or any(not isinstance(row, list) or len(row) != columns for row in table)):
+            raise ValueError(f"Malformed ORS matrix response: bad {name}")
+        if any(v is not None and not isinstance(v, (int, float)) for row in table for v in row):
+            raise ValueError(f"Malformed ORS matrix response: non-numeric {name}")
+        tables.append(table)
+    return tables
+
+def get_car_matrix(origins, destinations, date):
+    """
+    计算多个出发城市到多个目的城市的驾车距离、时间和成本。
+    缓存中没有的城市对通过一次 ORS 矩阵请求获得，坐标并发查询。
+    返回按 origins × destinations 顺序排列的结果列表。
+    """
+    missing = [(o, d) for o in origins for d in destinations if _route_cache.get(_pair_key(o, d)) is MISSING]
+    if missing:
+        sources = list(dict.fromkeys(o for o, _ in missing))
+        targets = list(dict.fromkeys(d for _, d in missing))
+        cities = list(dict.fromkeys(sources + targets))
+        coords = dict(zip(cities, enrich.run_ordered(
+            [lambda city=city: fetch_city_coordinates(city) for city in cities], upstream='geocode'
+        )))
+
+        sources = [c for c in sources if coords[c]]
+        targets = [c for c in targets if coords[c]]
+        if sources and targets:
+            located = list(dict.fromkeys(sources + targets))
+            body = {
+                "locations": [coords[c] for c in located],
+                "sources": [located.index(c) for c in sources],
+                "destinations": [located.index(c) for c in targets],
+                "metrics": ["distance", "duration"],
+            }
+            response = upstream.post(MATRIX_URL, json=body, headers=_ors_headers())
+            response.raise_for_status()
+            distances, durations = _matrix_tables(response.json(), len(sources), len(targets))
+            for i, o in enumerate(sources):
+                for j, d in enumerate(targets):
+                    distance, duration = distances[i][j], durations[i][j]
+                    if distance is not None and duration is not None:
+                        _route_cache.set(_pair_key(o, d), (distance / 1000, duration))
+
+    results = []
+    for o in origins:
+        for d in destinations:
+            cached = _route_cache.get(_pair_key(o, d))
+            if cached is MISSING:
+                results.append({"from": o, "to": d, "type": "car", "error": "No car route found"})
+            else:
+                results.append(format_car_route(o, d, date, *cached))
+    return results
+
 @car_blueprint.route('/get_route', methods=['GET'])
 def get_route():
     """
@@ -113,3 +193,43 @@ def get_route():
         # 明确返回 404，表示找不到路线，而不是 500
         return jsonify({"error": "No car route found for the given origin and destination."}), 404
 
+
+def cache_stats():
+    return _route_cache.stats()
+
+@car_blueprint.route('/matrix', methods=['GET', 'POST'])
+def get_route_matrix():
+    """
+    API 端点：多个出发城市 × 多个目的城市的驾车距离、时间和成本
+    参数（查询参数逗号分隔，或 POST JSON 数组）：
+    - origins: 出发城市列表
+    - destinations: 目的城市列表
+    - date: 出发日期（格式：YYYY-MM-DD）
+    """
+    try:
+        origins = city_list('origins')
+        destinations = city_list('destinations')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    body = request.get_json(silent=True) if request.method == 'POST' else None
+    date = body.get('date') if isinstance(body, dict) else request.args.get('date')
+
+    if not origins or not destinations:
+        return jsonify({"error": "Origins and destinations are required"}), 400
+    if len(origins) * len(destinations) > CAR_MATRIX_MAX_PAIRS:
+        return jsonify({"error": f"At most {CAR_MATRIX_MAX_PAIRS} origin/destination pairs per request"}), 400
+
+    # 验证日期格式
+    try:
+        datetime.strptime(date, "%Y-%m-%d")
+    except (ValueError, TypeError):
+        return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
+
+    try:
+        return jsonify(get_car_matrix(origins, destinations, date)), 200
+    except (requests.exceptions.RequestException, ValueError) as e:
+        # ValueError：响应不是 JSON 或者矩阵的形状不对
+        logger.warning("API Request error: %s", e)
+        return jsonify({"error": "Failed to fetch route data"}), 502
+
+# http://127.0.0.1:5000/car/matrix?origins=Paris,Lyon&destinations=Nice,Marseille&date=2024-12-08
@@ -0,0 +1,33 @@
+import os
+from flask import Blueprint, request, jsonify
+from services import gazetteer
+
+cities_blueprint = Blueprint('cities', __name__)
+
+# 补全结果最多返回的城市数
+CITIES_AUTOCOMPLETE_MAX = int(os.getenv('CITIES_AUTOCOMPLETE_MAX', 50))
+
+
+@cities_blueprint.route('/autocomplete', methods=['GET'])
+def autocomplete():
+    """
+    城市名补全：完全在本地完成，不调用任何外部服务
+    参数：
+    - q: 用户已输入的前缀（不区分大小写和重音）
+    - limit: 返回数量（默认 10）
+    """
+    prefix = request.args.get('q', '')
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+
+    if not prefix.strip():
+        return jsonify({"error": "Please provide a prefix with q"}), 400
+    if not 0 < limit <= CITIES_AUTOCOMPLETE_MAX:
+        return jsonify({"error": f"limit must be between 1 and {CITIES_AUTOCOMPLETE_MAX}"}), 400
+    if not len(gazetteer.get_table()):
+        return jsonify({"error": "City gazetteer is not available"}), 503
+
+    return jsonify(gazetteer.autocomplete(prefix, limit))
+#http://127.0.0.1:5000/cities/autocomplete?q=sao&limit=5
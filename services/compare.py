@@ -0,0 +1,133 @@
+import logging
+import os
+import re
+from datetime import datetime, timedelta
+from flask import Blueprint, request, jsonify
+from services import enrich, train, car, flight
+from services.geocoding import geocode
+
+logger = logging.getLogger(__name__)
+
+compare_blueprint = Blueprint('compare', __name__)
+
+# 三种交通方式共用的截止时间（秒），超时的方式不出现在结果里
+COMPARE_DEADLINE = float(os.getenv('COMPARE_DEADLINE', 10))
+
+SORT_KEYS = ('price', 'duration')
+
+_DURATION_RE = re.compile(r'(\d+)h\s*(\d+)m')
+
+
+def _price(option):
+    try:
+        return float(option.get("price"))
+    except (TypeError, ValueError):
+        return float('inf')  # "Unknown" 排在最后
+
+
+def _duration(option):
+    # 火车/飞机为 "1h30min"，汽车为 "1h 30m"
+    match = _DURATION_RE.search(option.get("duration") or "")
+    return int(match.group(1)) * 60 + int(match.group(2)) if match else float('inf')
+
+
+def _iso_date(value, requested):
+    """
+    把各方式的日期统一成 YYYY-MM-DD：汽车本来就是，火车和飞机是没有年份的 "08 Dec"，
+    年份取离查询日期最近的那一年（12 月底查询、结果在 1 月时是下一年）
+    """
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+        return value
+    except (TypeError, ValueError):
+        pass
+    try:
+        day = datetime.strptime(f"{value} {requested.year}", "%d %b %Y")
+    except (TypeError, ValueError):
+        return value
+    candidates = [day.replace(year=day.year + delta) for delta in (-1, 0, 1)]
+    return min(candidates, key=lambda d: abs(d - requested)).strftime("%Y-%m-%d")
+
+
+def _train(origin, destination, date):
+    result, _ = train.search_trains(origin, destination, date)
+    return result
+
+
+def _car(origin, destination, date):
+    result = car.get_car_route(origin, destination, date)
+    return [result] if "error" not in result else result
+
+
+def _flight(origin, destination, date):
+    result = flight.generate_fake_flight(origin, destination, date)
+    return [result] if "error" not in result else result
+
+
+MODES = (('train', _train), ('car', _car), ('plane', _flight))
+
+
+def _run_mode(fn, origin, destination, date):
+    """单个方式出错不影响其他方式"""
+    try:
+        return fn(origin, destination, date)
+    except Exception as e:
+        logger.exception("Compare error in %s: %s", fn.__name__, e)
+        return {"error": "An unexpected error occurred"}
+
+
+def compare_routes(origin, destination, date, sort='price'):
+    """
+    同时查询火车、汽车和飞机，返回 (合并后的列表, 各方式的错误)。
+    列表中的日期统一为 YYYY-MM-DD。
+    两个城市先各地理编码一次，三条流程之后都命中同一份缓存。
+    """
+    enrich.run_ordered([lambda: geocode(origin), lambda: geocode(destination)], upstream='geocode')
+
+    # 每条流程内部还会并发请求上游，所以放在单独的线程池里
+    results = enrich.run_ordered(
+        [lambda fn=fn: _run_mode(fn, origin, destination, date) for _, fn in MODES],
+        upstream='compare', deadline=COMPARE_DEADLINE, default={"error": "Timed out"}, pool='compare'
+    )
+
+    requested = datetime.strptime(date, "%Y-%m-%d")
+    options, errors = [], {}
+    for (mode, _), result in zip(MODES, results):
+        if isinstance(result, list):
+            options.extend({**option, "date": _iso_date(option.get("date"), requested)} for option in result)
+        else:
+            errors[mode] = result.get("error", "No route found")
+
+    options.sort(key=_duration if sort == 'duration' else _price)
+    return options, errors
+
+
+@compare_blueprint.route('/', methods=['GET'])
+def compare():
+    """
+    API 端点：比较两个城市之间的火车、汽车和飞机
+    参数：
+    - origin: 出发城市
+    - destination: 到达城市
+    - date: 出发日期（格式：YYYY-MM-DD）
+    - sort: price（默认）或 duration
+    """
+    origin = request.args.get('origin')
+    destination = request.args.get('destination')
+    date = request.args.get('date')
+    sort = request.args.get('sort', 'price')
+
+    if not origin or not destination:
+        return jsonify({"error": "Origin and destination are required"}), 400
+    try:
+        datetime.strptime(date, "%Y-%m-%d")
+    except (ValueError, TypeError):
+        return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
+    if sort not in SORT_KEYS:
+        return jsonify({"error": f"sort must be one of: {', '.join(SORT_KEYS)}"}), 400
+
+    options, errors = compare_routes(origin, destination, date, sort)
+    if not options:
+        return jsonify({"error": "No route found", "details": errors}), 404
+    return jsonify(options)
+#http://127.0.0.1:5000/compare?origin=Paris&destination=Nice&date=2024-12-08&sort=duration
@@ -0,0 +1,161 @@
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FuturesTimeout
+
+from services import profiler
+
+# 补全（照片、详情等）请求的并发配置
+ENRICH_MAX_WORKERS = int(os.getenv('ENRICH_MAX_WORKERS', 32))
+ENRICH_MAX_IN_FLIGHT = int(os.getenv('ENRICH_MAX_IN_FLIGHT', 16))
+ENRICH_DEADLINE = float(os.getenv('ENRICH_DEADLINE', 8))
+
+_executors = {}
+_executor_pid = None
+_semaphores = {}
+_lock = threading.Lock()
+
+
+def _get_executor(pool='enrich'):
+    """
+    线程池按进程、按名称懒加载，gunicorn fork 之后在子进程中重新创建。
+    自身会再调用 run_ordered 的任务（如整条查询流程）应使用单独的池，
+    否则外层任务占满线程后内层请求无线程可用。
+    池大小可用 ENRICH_MAX_WORKERS_<POOL> 单独配置。
+    """
+    global _executor_pid
+    with _lock:
+        if _executor_pid != os.getpid():
+            _executors.clear()
+            _semaphores.clear()
+            _executor_pid = os.getpid()
+        executor = _executors.get(pool)
+        if executor is None:
+            workers = int(os.getenv(f'ENRICH_MAX_WORKERS_{pool.upper()}', ENRICH_MAX_WORKERS))
+            executor = _executors[pool] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=pool)
+        return executor
+
+
+def _semaphore(upstream):
+    """每个上游的最大并发数，可用 ENRICH_MAX_IN_FLIGHT_<UPSTREAM> 单独配置"""
+    with _lock:
+        sem = _semaphores.get(upstream)
+        if sem is None:
+            limit = int(os.getenv(f'ENRICH_MAX_IN_FLIGHT_{upstream.upper()}', ENRICH_MAX_IN_FLIGHT))
+            sem = _semaphores[upstream] = threading.BoundedSemaphore(limit)
+        return sem
+
+
+def _run_attached(call):
+    with profiler.attach():
+        return call()
+
+
+def _submit(executor, call):
+    # 线程池里的调用在提交者的上下文副本中执行，沿用它的上游优先级（用户请求 / 后台刷新）、
+    # 请求 ID、耗时统计和性能采集
+    return executor.submit(contextvars.copy_context().run, _run_attached, call)
+
+
+def _fallback(default, index):
+    return default(index) if callable(default) else default
+
+
+def run_ordered(calls, upstream='default', deadline=None, default=None, pool='enrich'):
+    """
+    并发执行一组无参函数，按原顺序返回结果。
+    - 同一上游同时最多 ENRICH_MAX_IN_FLIGHT 个请求；upstream 也可以是与 calls 等长的列表，
+      一次并发调用不同的上游时各自占用自己的配额
+    - 超过 deadline（秒）仍未完成的调用返回 default（可以是 default(index) 函数）
+    - 调用抛出的异常按顺序重新抛出
+    - pool 指定使用哪个线程池
+    """
+    calls = list(calls)
+    if not calls:
+        return []
+    executor = _get_executor(pool)
+    upstreams = [upstream] * len(calls) if isinstance(upstream, str) else list(upstream)
+    if len(upstreams) != len(calls):
+        raise ValueError("upstream list must have one entry per call")
+    expires_at = time.monotonic() + (ENRICH_DEADLINE if deadline is None else deadline)
+
+    futures = [None] * len(calls)
+    for i, call in enumerate(calls):
+        sem = _semaphore(upstreams[i])
+        # 在提交端限流，避免占用线程池里的线程去等待信号量
+        if not sem.acquire(timeout=max(0.0, expires_at - time.monotonic())):
+            break
+        future = _submit(executor, call)
+        future.add_done_callback(lambda _f, sem=sem: sem.release())
+        futures[i] = future
+
+    pending = {f for f in futures if f is not None}
+    while pending:
+        remaining = expires_at - time.monotonic()
+        if remaining <= 0:
+            break
+        _, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+
+    results = []
+    for i, future in enumerate(futures):
+        if future is None or not future.done():
+            if future is not None:
+                future.cancel()
+            results.append(_fallback(default, i))
+        else:
+            results.append(future.result())
+    return results
+
+
+def iter_ordered(calls, upstream='default', deadline=None, default=None, pool='enrich'):
+    """
+    与 run_ordered 相同，但以生成器形式按原顺序逐个返回结果：
+    第 i 个结果一完成就返回，不必等后面的调用。
+    只在有空闲并发额度时提交新的调用，生成器提前关闭时未提交的调用不会执行。
+    """
+    calls = list(calls)
+    executor = _get_executor(pool)
+    sem = _semaphore(upstream)
+    expires_at = time.monotonic() + (ENRICH_DEADLINE if deadline is None else deadline)
+    futures = [None] * len(calls)
+    submitted = 0
+
+    def submit(block):
+        nonlocal submitted
+        while submitted < len(calls):
+            if block:
+                acquired = sem.acquire(timeout=max(0.0, expires_at - time.monotonic()))
+            else:
+                acquired = sem.acquire(blocking=False)
+            if not acquired:
+                return
+            future = _submit(executor, calls[submitted])
+            future.add_done_callback(lambda _f: sem.release())
+            futures[submitted] = future
+            submitted += 1
+            block = False
+
+    for i in range(len(calls)):
+        # 第 i 个调用还没提交时必须等到并发额度，否则只提交当前有额度的部分
+        submit(block=submitted <= i)
+        future = futures[i]
+        if future is None:
+            yield _fallback(default, i)
+            continue
+        try:
+            result = future.result(timeout=max(0.0, expires_at - time.monotonic()))
+        except FuturesTimeout:
+            future.cancel()
+            yield _fallback(default, i)
+            continue
+        yield result
+
+
+def map_ordered(fn, items, upstream='default', deadline=None, default=None, pool='enrich'):
+    """对每个元素并发调用 fn(item)，按原顺序返回结果"""
+    items = list(items)
+    wrapped = default
+    if callable(default):
+        wrapped = lambda i: default(items[i])  # noqa: E731
+    return run_ordered([lambda item=item: fn(item) for item in items], upstream, deadline, wrapped, pool)
@@ -1,50 +1,15 @@
-import requests
 import math
+import os
 from datetime import datetime, timedelta
-from flask import Flask, Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify
+from services.airports import get_airport_info, NO_AIRPORT
+from services import geo, enrich
+from services.params import city_list
 
-app = Flask(__name__)
 flight_blueprint = Blueprint('flight', __name__)
 
-# 开源机场数据库（OpenFlights 托管的 airports.dat 数据）
-OPENFLIGHTS_AIRPORTS_URL = "https://raw.githubusercontent.com/jpatokal/openflights/master/data/airports.dat"
-
-# Haversine 公式计算两地之间的直线距离
-def haversine(lat1, lon1, lat2, lon2):
-    """
-    计算两点之间的直线距离（单位：公里）
-    """
-    if None in [lat1, lon1, lat2, lon2]:  # 如果有一个空值，则无法计算
-        return None
-
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = math.sin(dlat / 2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2)**2
-    c = 2 * math.asin(math.sqrt(a))
-    r = 6371  # 地球半径（单位：公里）
-    return round(c * r, 1)  # 取整到最近的 0.1 公里
-
-# 获取机场名称和经纬度
-def get_airport_info(city):
-    """
-    通过城市名称查询机场名称和经纬度（使用 OpenFlights 的数据）
-    """
-    try:
-        response = requests.get(OPENFLIGHTS_AIRPORTS_URL)
-        if response.status_code == 200:
-            airports = response.text.split("\n")
-            for airport in airports:
-                fields = airport.split(",")
-                if len(fields) > 6:
-                    airport_name = fields[1].replace('"', '')  # 机场名称
-                    city_name = fields[2].replace('"', '')  # 城市名称
-                    lat, lon = fields[6], fields[7]  # 经纬度
-                    if city.lower() == city_name.lower():
-                        return airport_name, float(lat), float(lon)
-        return "No Airport Found", None, None
-    except Exception:
-        return "No Airport Found", None, None
+# 矩阵接口一次最多生成的城市对数
+FLIGHT_MATRIX_MAX_PAIRS = int(os.getenv('FLIGHT_MATRIX_MAX_PAIRS', 400))
 
 # 生成固定值的航班时间 & 价格
 def generate_flight_time_and_price(distance):
@@ -70,23 +35,45 @@ def generate_flight_time_and_price(distance):
 
     return departure_time, arrival_time, duration_str, round(price, 2)
 
+def build_flight(departure_airport, arrival_airport, distance, flight_date):
+    """按统一格式生成一条航班"""
+    # 生成固定出发时间、到达时间、飞行时长和价格
+    departure_time, arrival_time, duration_str, price = generate_flight_time_and_price(distance)
+
+    return {
+        "from": departure_airport,
+        "to": arrival_airport,
+        "date": flight_date.strftime("%d %b"),  # 格式化日期，例如 "08 Dec"
+        "time": f"{departure_time.strftime('%H:%M')}-{arrival_time.strftime('%H:%M')}",
+        "duration": duration_str,
+        "type": "plane",
+        "price": f"{price}",
+        "distance": str(distance) if distance else "Unknown"  # 计算出的真实距离
+    }
+
+def no_airport_error(departure_city, arrival_city, departure_airport, arrival_airport):
+    return {
+        "error": "One or both cities do not have an airport",
+        "departure_city": departure_city,
+        "arrival_city": arrival_city,
+        "departure_airport": departure_airport,
+        "arrival_airport": arrival_airport
+    }
+
 # 生成假航班数据
 def generate_fake_flight(departure_city, arrival_city, date):
     departure_airport, departure_lat, departure_lon = get_airport_info(departure_city)
     arrival_airport, arrival_lat, arrival_lon = get_airport_info(arrival_city)
 
     # 如果任何一个城市没有机场，返回标识
-    if departure_airport == "No Airport Found" or arrival_airport == "No Airport Found":
-        return {
-            "error": "One or both cities do not have an airport",
-            "departure_city": departure_city,
-            "arrival_city": arrival_city,
-            "departure_airport": departure_airport,
-            "arrival_airport": arrival_airport
-        }
-
-    # 计算真实的飞行距离
-    distance = haversine(departure_lat, departure_lon, arrival_lat, arrival_lon)
+    if departure_airport == NO_AIRPORT or arrival_airport == NO_AIRPORT:
+        return no_airport_error(departure_city, arrival_city, departure_airport, arrival_airport)
+
+    # 计算真实的飞行距离（取整到最近的 0.1 公里）；有坐标缺失时无法计算
+    if None in (departure_lat, departure_lon, arrival_lat, arrival_lon):
+        distance = None
+    else:
+        distance = round(geo.haversine_km(departure_lat, departure_lon, arrival_lat, arrival_lon), 1)
 
     # 解析用户输入的日期（格式：YYYY-MM-DD）
     try:
@@ -94,19 +81,33 @@ def generate_fake_flight(departure_city, arrival_city, date):
     except ValueError:
         return {"error": "Invalid date format. Use YYYY-MM-DD"}
 
-    # 生成固定出发时间、到达时间、飞行时长和价格
-    departure_time, arrival_time, duration_str, price = generate_flight_time_and_price(distance)
+    return build_flight(departure_airport, arrival_airport, distance, flight_date)
 
-    return {
-        "from": departure_airport,
-        "to": arrival_airport,
-        "date": flight_date.strftime("%d %b"),  # 格式化日期，例如 "08 Dec"
-        "time": f"{departure_time.strftime('%H:%M')}-{arrival_time.strftime('%H:%M')}",
-        "duration": duration_str,
-        "type": "plane",
-        "price": f"{price}",
-        "distance": str(distance) if distance else "Unknown"  # 计算出的真实距离
-    }
+def generate_flight_matrix(departure_cities, arrival_cities, flight_date):
+    """
+    为每个（出发城市, 到达城市）生成假航班：
+    每个城市只解析一次机场，所有距离用一次向量化计算得到
+    """
+    cities = list(dict.fromkeys(departure_cities + arrival_cities))
+    airports = dict(zip(cities, enrich.map_ordered(get_airport_info, cities, upstream='geocode')))
+
+    distances = geo.haversine_matrix(
+        [airports[c][1] if airports[c][1] is not None else math.nan for c in departure_cities],
+        [airports[c][2] if airports[c][2] is not None else math.nan for c in departure_cities],
+        [airports[c][1] if airports[c][1] is not None else math.nan for c in arrival_cities],
+        [airports[c][2] if airports[c][2] is not None else math.nan for c in arrival_cities],
+    ).round(1)
+
+    flights = []
+    for i, departure_city in enumerate(departure_cities):
+        departure_airport = airports[departure_city][0]
+        for j, arrival_city in enumerate(arrival_cities):
+            arrival_airport = airports[arrival_city][0]
+            if departure_airport == NO_AIRPORT or arrival_airport == NO_AIRPORT:
+                flights.append(no_airport_error(departure_city, arrival_city, departure_airport, arrival_airport))
+            else:
+                flights.append(build_flight(departure_airport, arrival_airport, float(distances[i, j]), flight_date))
+    return flights
 
 @flight_blueprint.route('/search', methods=['GET'])
 def search_flights():
@@ -124,7 +125,28 @@ def search_flights():
 
     return jsonify(fake_flights)
 
-app.register_blueprint(flight_blueprint, url_prefix='/flights')
+@flight_blueprint.route('/matrix', methods=['GET', 'POST'])
+def flight_matrix():
+    """
+    批量获取模拟航班数据：departure_cities × arrival_cities 的每一对
+    """
+    try:
+        departure_cities = city_list('departure_cities')
+        arrival_cities = city_list('arrival_cities')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    body = request.get_json(silent=True) if request.method == 'POST' else None
+    date = body.get('date') if isinstance(body, dict) else request.args.get('date')
+
+    if not departure_cities or not arrival_cities or not date:
+        return jsonify({"error": "Please provide departure_cities, arrival_cities, and date"}), 400
+    if len(departure_cities) * len(arrival_cities) > FLIGHT_MATRIX_MAX_PAIRS:
+        return jsonify({"error": f"At most {FLIGHT_MATRIX_MAX_PAIRS} city pairs per request"}), 400
+
+    try:
+        flight_date = datetime.strptime(date, "%Y-%m-%d")
+    except (ValueError, TypeError):
+        return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
+
+    return jsonify(generate_flight_matrix(departure_cities, arrival_cities, flight_date))
 
-if __name__ == "__main__":
-    app.run(debug=True)
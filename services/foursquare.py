@@ -0,0 +1,198 @@
+import logging
+import os
+import json
+import requests
+from services import upstream, enrich, place_store, ratelimit
+from services.cache import SWRCache, MISSING
+from services.cache_backends import make_cache, shared_cache
+
+logger = logging.getLogger(__name__)
+
+# 配置信息
+FOURSQUARE_API_KEY = os.getenv('FOURSQUARE_API_KEY')  # 从环境变量读取 API Key
+if not FOURSQUARE_API_KEY:
+    raise EnvironmentError("FOURSQUARE_API_KEY is not set. Please set it in the environment variables.")
+
+SEARCH_URL = 'https://api.foursquare.com/v3/places/search'
+DETAIL_URL = 'https://api.foursquare.com/v3/places'
+PHOTO_URL = 'https://api.foursquare.com/v3/places/{fsq_id}/photos'
+
+NO_PHOTO = ["No photo available"]
+
+# 列表接口的照片模式：none 不获取照片，first 只返回第一张，all 返回全部
+PHOTO_MODES = ('none', 'first', 'all')
+
+# 照片按 fsq_id 缓存，酒店、景点和餐厅共用；照片很少变化，缓存一天
+PHOTO_CACHE_TTL = int(os.getenv('PHOTO_CACHE_TTL', 24 * 3600))
+PHOTO_CACHE_SIZE = int(os.getenv('PHOTO_CACHE_SIZE', 8192))
+_photo_cache = make_cache('photos', PHOTO_CACHE_SIZE, PHOTO_CACHE_TTL, snapshot=True)
+
+
+def auth_headers():
+    return {'Authorization': FOURSQUARE_API_KEY}
+
+
+def search_places(params, fields=None):
+    """
+    搜索地点，返回 results 列表；fields 指定只返回需要的字段，
+    这样一次搜索就能拿到原本需要详情接口才有的信息
+    """
+    params = dict(params)
+    if fields:
+        params['fields'] = ','.join(fields)
+    response = upstream.get(SEARCH_URL, headers=auth_headers(), params=params)
+    response.raise_for_status()
+    return response.json().get("results", [])
+
+
+def fetch_place_details(fsq_id, fields=None):
+    """获取单个地点的详细信息，失败时抛出异常"""
+    params = {'fields': ','.join(fields)} if fields else None
+    response = upstream.get(f"{DETAIL_URL}/{fsq_id}", headers=auth_headers(), params=params)
+    response.raise_for_status()
+    return response.json()
+
+
+def fill_missing_fields(places, fields, optional=()):
+    """
+    搜索结果里缺少的字段才调用详情接口补全（只请求缺少的那些字段）。
+    optional 中的字段缺失表示地点本身没有该信息（如电话、网站），不补全。
+    """
+    todo = []
+    for place in places:
+        missing = [f for f in fields if f not in place and f not in optional and f != 'fsq_id']
+        if missing and place.get("fsq_id"):
+            todo.append((place, missing))
+    if not todo:
+        return places
+
+    details = enrich.run_ordered(
+        [lambda fsq_id=place["fsq_id"], missing=missing: fetch_place_details(fsq_id, missing)
+         for place, missing in todo],
+        upstream='foursquare', default={}
+    )
+    for (place, missing), detail in zip(todo, details):
+        place.update({f: detail[f] for f in missing if f in detail})
+    return places
+
+
+# 获取照片信息（先查缓存，上游出错的结果不缓存）
+def fetch_photos(fsq_id):
+    cached = _photo_cache.get(fsq_id)
+    if cached is not MISSING:
+        return cached
+    try:
+        response = upstream.get(PHOTO_URL.format(fsq_id=fsq_id), headers=auth_headers())
+        response.raise_for_status()
+        photos = response.json()
+        # 返回所有照片的完整 URL
+        urls = [
+            f"{photo['prefix']}original{photo['suffix']}" for photo in photos
+        ] if photos else NO_PHOTO
+        _photo_cache.set(fsq_id, urls)
+        return urls
+    except (requests.exceptions.RequestException, ratelimit.RateLimited) as e:
+        logger.warning("Photo API Error: %s", e)
+        return NO_PHOTO
+
+
+def _photo_calls(fsq_ids, mode):
+    if mode == 'first':
+        return [lambda fsq_id=fsq_id: fetch_photos(fsq_id)[:1] for fsq_id in fsq_ids]
+    return [lambda fsq_id=fsq_id: fetch_photos(fsq_id) for fsq_id in fsq_ids]
+
+
+def fetch_all_photos(fsq_ids, mode='all'):
+    """并发获取多个地点的照片，结果保持原顺序；mode 为 none 时不调用上游"""
+    fsq_ids = list(fsq_ids)
+    if mode == 'none':
+        return [[] for _ in fsq_ids]
+    return enrich.run_ordered(_photo_calls(fsq_ids, mode), upstream='foursquare', default=NO_PHOTO)
+
+
+def iter_photos(fsq_ids, mode='all'):
+    """与 fetch_all_photos 相同，但每个地点的照片一到就按顺序返回"""
+    fsq_ids = list(fsq_ids)
+    if mode == 'none':
+        return iter([[] for _ in fsq_ids])
+    return enrich.iter_ordered(_photo_calls(fsq_ids, mode), upstream='foursquare', default=NO_PHOTO)
+
+
+def build_listing(places, format_place, photos='all'):
+    """按照片模式获取照片，返回 format_place(place, photos) 组成的列表"""
+    all_photos = fetch_all_photos([place.get("fsq_id") for place in places], photos)
+    return [format_place(place, place_photos) for place, place_photos in zip(places, all_photos)]
+
+
+def iter_listing(places, format_place, photos='all'):
+    """流式版本的 build_listing：每个地点的照片一到就生成该地点"""
+    all_photos = iter_photos([place.get("fsq_id") for place in places], photos)
+    for place, place_photos in zip(places, all_photos):
+        yield format_place(place, place_photos)
+
+
+# 地点列表缓存：中心坐标按网格量化、半径按步长取整，
+# 使相近的查询（包括 "Nice"、"nice " 和 "NICE"）共用一个条目
+PLACE_CACHE_GRID = float(os.getenv('PLACE_CACHE_GRID', 0.005))  # 度，约 500 米
+PLACE_CACHE_RADIUS_STEP = int(os.getenv('PLACE_CACHE_RADIUS_STEP', 100))  # 米
+PLACE_CACHE_TTL = int(os.getenv('PLACE_CACHE_TTL', 3600))
+PLACE_CACHE_STALE_TTL = int(os.getenv('PLACE_CACHE_STALE_TTL', 24 * 3600))
+PLACE_CACHE_MAX_BYTES = int(os.getenv('PLACE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+# CACHE_BACKEND 为 sqlite / redis 时，共享缓存里最多保存的搜索结果数
+PLACE_CACHE_SHARED_SIZE = int(os.getenv('PLACE_CACHE_SHARED_SIZE', 16384))
+
+_listing_cache = SWRCache(
+    max_bytes=PLACE_CACHE_MAX_BYTES, ttl=PLACE_CACHE_TTL, stale_ttl=PLACE_CACHE_STALE_TTL,
+    sizeof=lambda value: len(json.dumps(value)), name='places', background=ratelimit.background,
+    snapshot=True, shared=shared_cache('places', PLACE_CACHE_SHARED_SIZE, PLACE_CACHE_TTL + PLACE_CACHE_STALE_TTL)
+)
+
+
+def _quantize(value, step):
+    return round(round(value / step) * step, 6)
+
+
+def listing_params(location, radius, categories, limit, query=None):
+    """
+    把请求参数规整为搜索参数（同时也是缓存键）。
+    location 是 "lat,lon" 字符串；radius 或 limit 不是整数时抛出 ValueError。
+    """
+    lat, lon = (float(x) for x in location.split(','))
+    step = PLACE_CACHE_RADIUS_STEP
+    params = {
+        'll': f"{_quantize(lat, PLACE_CACHE_GRID)},{_quantize(lon, PLACE_CACHE_GRID)}",
+        'radius': max(step, round(int(radius) / step) * step),
+        'categories': ','.join(sorted(c.strip() for c in categories.split(',') if c.strip())),
+        'limit': int(limit),
+    }
+    if query and query.strip():
+        params['query'] = " ".join(query.split()).casefold()
+    return params
+
+
+def cached_search(kind, params, search):
+    """
+    返回 search(params) 的搜索结果（不含照片），按 kind + 规整后的参数缓存。
+    过期条目立即返回并在后台刷新；search 抛出的异常不会被缓存。
+    照片另外按 fsq_id 缓存，同一份搜索结果可以用任意照片模式返回。
+    """
+    key = (kind,) + tuple(sorted(params.items()))
+    return _listing_cache.get_or_load(key, lambda: _search_or_local(params, search))
+
+
+def _search_or_local(params, search):
+    """落在已完整搜索过的区域内时用本地地点回答，否则搜索并记录结果"""
+    places = place_store.query(params)
+    if places is not None:
+        return places
+    places = search(params)
+    place_store.record(params, places)
+    return places
+
+
+def cache_stats():
+    return _listing_cache.stats()
+
+
+def photo_cache_stats():
+    return _photo_cache.stats()
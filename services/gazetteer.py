@@ -0,0 +1,263 @@
+import logging
+import os
+import csv
+import io
+import sys
+import threading
+import unicodedata
+import zipfile
+from array import array
+
+from services import upstream
+
+logger = logging.getLogger(__name__)
+
+# GeoNames 城市数据（人口 15000 以上，约 2.6 万个城市），CC BY 4.0
+GEONAMES_CITIES_URL = "https://download.geonames.org/export/dump/cities15000.zip"
+
+# 本地快照：只保留需要的列（名称、ASCII 名称、国家、经纬度、人口）的 TSV
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+GAZETTEER_DATA_PATH = os.getenv('GAZETTEER_DATA_PATH', os.path.join(DATA_DIR, 'cities.tsv'))
+
+# 每个前缀预先保存人口最多的前几个城市；前缀树只建到这个深度，更长的前缀在叶子上过滤
+GAZETTEER_TOP_K = int(os.getenv('GAZETTEER_TOP_K', 10))
+GAZETTEER_TRIE_DEPTH = int(os.getenv('GAZETTEER_TRIE_DEPTH', 6))
+
+
+def fold(name):
+    """
+    匹配用的规整写法：去掉重音、统一大小写和空白，
+    使 "São Paulo"、"sao paulo" 和 "SAO  PAULO" 相同
+    """
+    if not name:
+        return ""
+    if name.isascii():
+        return " ".join(name.split()).casefold()
+    decomposed = unicodedata.normalize('NFKD', name)
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(stripped.split()).casefold()
+
+
+class _Node:
+    __slots__ = ('children', 'top', 'rows')
+
+    def __init__(self):
+        self.children = {}
+        self.top = []  # 该前缀下人口最多的前 TOP_K 个城市（行号）
+        self.rows = None  # 只在最大深度的节点上：[(key, row), ...]
+
+
+class CityTable:
+    """
+    按列存储的城市表：名称、ASCII 名称、国家代码各占一个列表，
+    经纬度和人口用 array 紧凑存储；另有精确名称索引和前缀树。
+    """
+    __slots__ = ('names', 'ascii', 'countries', 'lat', 'lon', 'population', '_by_name', '_trie')
+
+    def __init__(self):
+        self.names = []
+        self.ascii = []
+        self.countries = []
+        self.lat = array('d')
+        self.lon = array('d')
+        self.population = array('q')
+        self._by_name = {}
+        self._trie = None
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """rows 为 (name, ascii_name, country, lat, lon, population) 的可迭代对象"""
+        table = cls()
+        keys = [table._append(*row) for row in rows]
+        table._build_trie(keys)
+        return table
+
+    @classmethod
+    def from_text(cls, text):
+        """解析本地快照（TSV，见 write_snapshot）"""
+        def rows():
+            for fields in csv.reader(io.StringIO(text), delimiter='\t', quoting=csv.QUOTE_NONE):
+                if len(fields) < 6:
+                    continue
+                try:
+                    yield fields[0], fields[1], fields[2], float(fields[3]), float(fields[4]), int(fields[5] or 0)
+                except ValueError:
+                    continue
+        return cls.from_rows(rows())
+
+    def _append(self, name, ascii_name, country, lat, lon, population):
+        row = len(self.names)
+        self.names.append(name)
+        self.ascii.append(ascii_name)
+        self.countries.append(country)
+        self.lat.append(lat)
+        self.lon.append(lon)
+        self.population.append(population)
+        keys = {key for key in (fold(name), fold(ascii_name)) if key}
+        # 同名城市取人口最多的一个（"Paris" 是法国巴黎而不是德州的 Paris）
+        for key in keys:
+            best = self._by_name.get(key)
+            if best is None or population > self.population[best]:
+                self._by_name[key] = row
+        return keys
+
+    def _build_trie(self, keys):
+        """keys[row] 为该行的匹配键集合；按人口从多到少插入，每个节点的 top 列表自然有序"""
+        root = _Node()
+        order = sorted(range(len(self.names)), key=lambda row: -self.population[row])
+        for row in order:
+            for key in keys[row]:
+                node = root
+                self._add_top(node, row)
+                for char in key[:GAZETTEER_TRIE_DEPTH]:
+                    node = node.children.get(char) or node.children.setdefault(char, _Node())
+                    self._add_top(node, row)
+                # 完整的键挂在路径的最后一个节点上，用于更长前缀的过滤
+                if node.rows is None:
+                    node.rows = []
+                node.rows.append((key, row))
+        self._trie = root
+
+    @staticmethod
+    def _add_top(node, row):
+        if len(node.top) < GAZETTEER_TOP_K and row not in node.top:
+            node.top.append(row)
+
+    def lookup(self, name):
+        """精确匹配城市名，返回行号或 None"""
+        return self._by_name.get(fold(name))
+
+    def complete(self, prefix, limit=10):
+        """按前缀补全，返回人口从多到少的行号列表"""
+        prefix = fold(prefix)
+        if not prefix or self._trie is None:
+            return []
+        node = self._trie
+        for char in prefix[:GAZETTEER_TRIE_DEPTH]:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        if len(prefix) <= GAZETTEER_TRIE_DEPTH and limit <= GAZETTEER_TOP_K:
+            return node.top[:limit]
+
+        # 更长的前缀（或超过 TOP_K 的 limit）：在子树的完整键中过滤
+        candidates = set()
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            candidates.update(row for key, row in node.rows or () if key.startswith(prefix))
+            stack.extend(node.children.values())
+        return sorted(candidates, key=lambda row: -self.population[row])[:limit]
+
+    def info(self, row):
+        return {
+            "name": self.names[row],
+            "country": self.countries[row],
+            "lat": self.lat[row],
+            "lon": self.lon[row],
+            "population": self.population[row],
+        }
+
+
+_table = None
+_table_lock = threading.Lock()
+
+
+def parse_geonames(text, min_population=0):
+    """解析 GeoNames 的 citiesXXXX.txt，生成 (name, ascii_name, country, lat, lon, population)"""
+    for line in text.splitlines():
+        fields = line.split('\t')
+        if len(fields) < 15:
+            continue
+        try:
+            lat, lon, population = float(fields[4]), float(fields[5]), int(fields[14] or 0)
+        except ValueError:
+            continue
+        if population >= min_population:
+            yield fields[1], fields[2], fields[8], lat, lon, population
+
+
+def write_snapshot(rows, path=GAZETTEER_DATA_PATH):
+    """把城市写成紧凑的 TSV 并原子地替换本地快照"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+        for name, ascii_name, country, lat, lon, population in rows:
+            f.write(f"{name}\t{ascii_name}\t{country}\t{lat}\t{lon}\t{population}\n")
+    os.replace(tmp_path, path)
+
+
+def download_snapshot(path=GAZETTEER_DATA_PATH, url=GEONAMES_CITIES_URL, timeout=60):
+    """下载 GeoNames 城市数据并写入本地快照，返回写入的城市数"""
+    response = upstream.get(url, timeout=timeout)
+    response.raise_for_status()
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        member = next(n for n in archive.namelist() if n.endswith('.txt'))
+        text = archive.read(member).decode('utf-8')
+    rows = list(parse_geonames(text))
+    write_snapshot(rows, path)
+    return len(rows)
+
+
+def load_table(path=GAZETTEER_DATA_PATH):
+    """
+    读取本地快照构建城市表。没有快照时返回空表（不在请求路径上下载），
+    此时地理编码直接使用网络服务；用 python -m services.gazetteer refresh 生成快照
+    """
+    if not os.path.exists(path):
+        logger.warning("City gazetteer not found at %s; run `python -m services.gazetteer refresh`", path)
+        return CityTable.from_rows(())
+    with open(path, encoding='utf-8') as f:
+        return CityTable.from_text(f.read())
+
+
+def get_table():
+    """每个进程只加载一次城市表"""
+    global _table
+    if _table is None:
+        with _table_lock:
+            if _table is None:
+                _table = load_table()
+    return _table
+
+
+def set_table(table):
+    """替换当前进程的城市表（刷新快照后使用）"""
+    global _table
+    with _table_lock:
+        _table = table
+
+
+def geocode(city_name):
+    """本地地理编码：精确匹配城市名，返回 (lat, lon) 或 None"""
+    table = get_table()
+    row = table.lookup(city_name)
+    if row is None:
+        return None
+    return table.lat[row], table.lon[row]
+
+
+def autocomplete(prefix, limit=10):
+    """按前缀补全城市名，人口多的城市排在前面"""
+    table = get_table()
+    return [table.info(row) for row in table.complete(prefix, limit)]
+
+
+def refresh(path=GAZETTEER_DATA_PATH):
+    """重新下载快照并重建当前进程的城市表"""
+    download_snapshot(path)
+    table = load_table(path)
+    set_table(table)
+    return table
+
+
+if __name__ == "__main__":
+    # python -m services.gazetteer refresh
+    if sys.argv[1:] != ['refresh']:
+        print("Usage: python -m services.gazetteer refresh")
+        sys.exit(2)
+    table = refresh()
+    print(f"Wrote {len(table)} cities to {GAZETTEER_DATA_PATH}")
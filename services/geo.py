@@ -0,0 +1,45 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371  # 地球半径（单位：公里）
+
+
+def haversine_matrix(lat1, lon1, lat2, lon2):
+    """
+    向量化的 Haversine 公式：N 个起点 × M 个终点的直线距离矩阵（单位：公里）
+    """
+    lat1, lon1 = np.radians(np.asarray(lat1, dtype=float))[:, None], np.radians(np.asarray(lon1, dtype=float))[:, None]
+    lat2, lon2 = np.radians(np.asarray(lat2, dtype=float))[None, :], np.radians(np.asarray(lon2, dtype=float))[None, :]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """两点之间的直线距离（单位：公里），单个点对时比 haversine_matrix 快得多"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, max(0.0, a))))
+
+
+def haversine_to_all(lat, lon, lats, lons):
+    """一个点到一组点的直线距离（单位：公里）"""
+    return haversine_matrix([lat], [lon], lats, lons)[0]
+
+
+def k_nearest(lat, lon, lats, lons, k=1, mask=None):
+    """
+    在 (lats, lons) 中找离 (lat, lon) 最近的 k 个点。
+    mask 为布尔数组时只在为 True 的点中查找。
+    返回 (下标数组, 距离数组)，按距离从近到远排序。
+    """
+    distances = haversine_to_all(lat, lon, lats, lons)
+    if mask is not None:
+        distances = np.where(mask, distances, np.inf)
+    k = min(k, len(distances))
+    if k <= 0:
+        return np.empty(0, dtype=int), np.empty(0)
+    nearest = np.argpartition(distances, k - 1)[:k]
+    nearest = nearest[np.argsort(distances[nearest])]
+    nearest = nearest[np.isfinite(distances[nearest])]
+    return nearest, distances[nearest]
@@ -0,0 +1,162 @@
+import logging
+import os
+import threading
+import requests
+
+from services.cache import MISSING
+from services.cache_backends import make_cache
+from services.singleflight import SingleFlight
+from services import upstream, gazetteer, ratelimit
+
+logger = logging.getLogger(__name__)
+
+NOMINATIM_URL = 'https://nominatim.openstreetmap.org/search'
+OPEN_METEO_URL = 'https://geocoding-api.open-meteo.com/v1/search'
+ORS_GEOCODE_URL = 'https://api.openrouteservice.org/geocode/search'
+
+# 按顺序尝试的地理编码服务，前一个找不到时才调用下一个；
+# gazetteer 是本地城市表，命中时不发出任何网络请求
+GEOCODER_PROVIDERS = [
+    p.strip() for p in os.getenv('GEOCODER_PROVIDERS', 'gazetteer,nominatim,open_meteo,ors').split(',') if p.strip()
+]
+LOCAL_PROVIDERS = {'gazetteer'}
+# Nominatim 配额用完时最多等待这么多秒，之后改用下一个服务
+GEOCODE_RATE_WAIT = float(os.getenv('GEOCODE_RATE_WAIT', 0.5))
+
+# 缓存配置：成功结果缓存较久，失败结果只缓存较短时间
+GEOCODE_CACHE_SIZE = int(os.getenv('GEOCODE_CACHE_SIZE', 2048))
+GEOCODE_TTL = int(os.getenv('GEOCODE_TTL', 7 * 24 * 3600))
+GEOCODE_NEGATIVE_TTL = int(os.getenv('GEOCODE_NEGATIVE_TTL', 300))
+
+_cache = make_cache('geocode', GEOCODE_CACHE_SIZE, GEOCODE_TTL, snapshot=True)
+_flight = SingleFlight()
+# 计数器会被 enrich 线程池里的多个线程同时更新
+_counters_lock = threading.Lock()
+_upstream_calls = 0
+_local_hits = 0
+
+
+def normalize_city(city_name):
+    """
+    统一城市名写法，使 "Nice"、"nice " 和 "NICE" 共用一个缓存条目
+    """
+    return " ".join(city_name.split()).casefold() if city_name else ""
+
+
+def _nominatim(city_name):
+    params = {
+        'q': city_name,
+        'format': 'json',
+        'addressdetails': 1,
+        'limit': 1
+    }
+    headers = {'User-Agent': 'MyTravelApp/1.0 (myemail@example.com)'}
+    response = upstream.get(NOMINATIM_URL, params=params, headers=headers, rate_wait=GEOCODE_RATE_WAIT)
+    response.raise_for_status()
+    data = response.json()
+    if data:
+        return float(data[0]['lat']), float(data[0]['lon'])
+    return None
+
+
+def _open_meteo(city_name):
+    response = upstream.get(OPEN_METEO_URL, params={'name': city_name, 'count': 1})
+    response.raise_for_status()
+    data = response.json()
+    if data.get("results"):
+        city_info = data["results"][0]
+        return city_info["latitude"], city_info["longitude"]
+    return None
+
+
+def _ors(city_name):
+    api_key = os.getenv("ORS_API_KEY")
+    if not api_key:
+        return None
+    response = upstream.get(ORS_GEOCODE_URL, params={'api_key': api_key, 'text': city_name}, rate_wait=GEOCODE_RATE_WAIT)
+    response.raise_for_status()
+    data = response.json()
+    if data.get('features'):
+        lon, lat = data['features'][0]['geometry']['coordinates'][:2]
+        return lat, lon
+    return None
+
+
+PROVIDERS = {
+    'gazetteer': gazetteer.geocode,
+    'nominatim': _nominatim,
+    'open_meteo': _open_meteo,
+    'ors': _ors,
+}
+
+
+def _lookup(city_name):
+    """
+    依次调用各个地理编码服务，返回 (lat, lon) 或 None。
+    配额用完的服务直接跳过；所有服务都没有结果且有服务被限流时抛出 RateLimited（不缓存）
+    """
+    global _upstream_calls, _local_hits
+    limited = None
+    for name in GEOCODER_PROVIDERS:
+        provider = PROVIDERS.get(name)
+        if provider is None:
+            continue
+        if name not in LOCAL_PROVIDERS:
+            with _counters_lock:
+                _upstream_calls += 1
+        try:
+            coords = provider(city_name)
+        except ratelimit.RateLimited as e:
+            limited = e
+            continue
+        except (requests.exceptions.RequestException, ValueError, KeyError, IndexError, OSError) as e:
+            logger.warning("Geocoding error (%s) for %s: %s", name, city_name, e)
+            continue
+        if coords:
+            if name in LOCAL_PROVIDERS:
+                with _counters_lock:
+                    _local_hits += 1
+            return coords
+    if limited is not None:
+        raise limited
+    return None
+
+
+def _load(key, city_name):
+    coords = _lookup(city_name.strip())
+    _cache.set(key, coords, ttl=GEOCODE_TTL if coords else GEOCODE_NEGATIVE_TTL)
+    return coords
+
+
+def geocode(city_name):
+    """
+    城市名转经纬度，返回 (lat, lon)；查询失败返回 (None, None)
+    """
+    key = normalize_city(city_name)
+    if not key:
+        return None, None
+    coords = _cache.get(key)
+    if coords is MISSING:
+        # 同一城市的并发查询只调用一次上游
+        coords = _flight.do(key, lambda: _load(key, city_name))
+    return coords if coords else (None, None)
+
+
+def convert_city_to_lat_lng(city_name):
+    """
+    城市名转 Foursquare 使用的 "lat,lon" 字符串，失败返回 None
+    """
+    lat, lon = geocode(city_name)
+    if lat is None:
+        return None
+    return f"{lat},{lon}"
+
+
+def stats():
+    """缓存命中情况，本地城市表命中数，以及实际发出的上游请求数"""
+    return {
+        **_cache.stats(),
+        "local_hits": _local_hits,
+        "upstream_calls": _upstream_calls,
+        "coalesced": _flight.coalesced,
+    }
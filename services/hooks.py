@@ -0,0 +1,80 @@
+import logging
+import math
+import time
+
+from flask import request, jsonify
+from services import lifecycle, logs, metrics, profiler, ratelimit
+
+access_logger = logging.getLogger('access')
+
+
+def install(app):
+    """
+    给 Flask 应用装上每个请求共用的处理：请求 ID、上游耗时统计（Server-Timing 头）、请求指标、
+    一行结构化日志、按需的性能采集，以及上游配额用完时的 503。
+    主应用和按需加载的蓝图子应用（services.blueprints）都要调用，行为完全一致。
+    状态放在 request.environ 而不是 g：/batch 的子请求共用父请求的应用上下文（也就共用 g）
+    """
+
+    @app.before_request
+    def start_request():
+        lifecycle.ensure_snapshot_thread()
+        request_id = logs.new_request_id(request.headers.get(logs.REQUEST_ID_HEADER))
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        timing, timing_token = metrics.start_request(endpoint)
+        capture, capture_token = None, None
+        if request.blueprint != 'admin':  # 管理接口本身不采集，免得挤掉环形缓冲里的数据
+            capture, capture_token = profiler.start(endpoint, request.full_path.rstrip('?'), request_id)
+        request.environ['travel.request'] = {
+            "request_id": request_id, "request_id_token": logs.set_request_id(request_id),
+            "timing": timing, "timing_token": timing_token,
+            "capture": capture, "capture_token": capture_token,
+        }
+
+    @app.after_request
+    def finish_request(response):
+        state = request.environ.get('travel.request')
+        if state is None:
+            return response
+        request_id, timing, capture = state["request_id"], state["timing"], state["capture"]
+        response.headers[logs.REQUEST_ID_HEADER] = request_id
+        response.headers['Server-Timing'] = timing.server_timing()
+        method, path, status = request.method, request.full_path.rstrip('?'), response.status_code
+
+        def log_request():
+            elapsed = time.perf_counter() - timing.start
+            metrics.observe_request(timing.endpoint, method, status, elapsed)
+            calls, upstream_ms, errors = timing.totals()
+            access_logger.info("request", extra={
+                "request_id": request_id, "method": method, "path": path, "endpoint": timing.endpoint,
+                "status": status, "duration_ms": round(elapsed * 1000, 1),
+                "upstream_calls": calls, "upstream_ms": upstream_ms, "upstream_errors": errors,
+            })
+            if capture is not None:
+                profiler.finish(capture, status)
+
+        # 流式响应在响应体发送完之后才记录，耗时（和性能采集）包含整个响应体
+        if response.is_streamed:
+            response.call_on_close(log_request)
+        else:
+            log_request()
+        return response
+
+    @app.teardown_request
+    def end_request(exc):
+        state = request.environ.pop('travel.request', None)
+        if state is not None:
+            if state["capture_token"] is not None:
+                profiler.end(state["capture_token"])
+            metrics.end_request(state["timing_token"])
+            logs.reset_request_id(state["request_id_token"])
+
+    # 上游配额用完：立即返回 503 和 Retry-After，而不是排队到超时
+    @app.errorhandler(ratelimit.RateLimited)
+    def rate_limited(e):
+        response = jsonify({"error": "Upstream service is busy, please retry later", "upstream": e.host})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(max(1, math.ceil(e.retry_after)))
+        return response
+
+    return app
@@ -0,0 +1,216 @@
+import atexit
+import importlib
+import logging
+import os
+import pickle
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows：没有 fcntl 时不加锁，最后写入的 worker 覆盖快照
+    fcntl = None
+
+from services.cache import CACHE_DIR, snapshot_caches
+
+logger = logging.getLogger(__name__)
+
+# 热点缓存（地理编码、站点 ID、地点列表、照片）的本地快照：
+# worker 每 SNAPSHOT_INTERVAL 秒把自己的缓存合并进去，启动时（gunicorn master fork 之前）恢复
+SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', os.path.join(CACHE_DIR, 'warm_start.snapshot'))
+SNAPSHOT_INTERVAL = float(os.getenv('SNAPSHOT_INTERVAL', 300))
+SNAPSHOT_ENABLED = os.getenv('SNAPSHOT_ENABLED', '1') != '0'
+# 每个缓存最多保存的条目数（保留最晚过期的）
+SNAPSHOT_MAX_ENTRIES = int(os.getenv('SNAPSHOT_MAX_ENTRIES', 20000))
+
+SNAPSHOT_VERSION = 1
+
+# 启动时预加载的本地数据表：(模块, 本地快照路径的配置名)
+PRELOAD_TABLES = (('airports', 'AIRPORTS_DATA_PATH'), ('gazetteer', 'GAZETTEER_DATA_PATH'))
+
+_state = {
+    "ready": False,
+    "warm_start_ms": None,
+    "restored": {},
+    "snapshot_age_s": None,
+    "snapshots_written": 0,
+    "last_snapshot_error": None,
+}
+_writer_pid = None
+_writer_lock = threading.Lock()
+_restored = set()
+_restore_lock = threading.Lock()
+
+
+def read_snapshot(path=SNAPSHOT_PATH):
+    """读取快照，返回 {"created", "caches": {名称: [(key, 过期时间, value), ...]}}；没有或损坏时返回 None"""
+    try:
+        with open(path, 'rb') as f:
+            snapshot = pickle.loads(zlib.decompress(f.read()))
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # 快照只是加速手段，损坏时直接冷启动
+        logger.warning("Ignoring unreadable cache snapshot %s: %s", path, e)
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+    return snapshot
+
+
+def _merge(old, new, limit):
+    """同一个 key 保留过期时间较晚的条目，去掉已过期的，最多保留 limit 条"""
+    now = time.time()
+    merged = {}
+    for entries in (old, new):
+        for key, expires_at, value in entries:
+            if expires_at <= now:
+                continue
+            current = merged.get(key)
+            if current is None or expires_at >= current[0]:
+                merged[key] = (expires_at, value)
+    entries = sorted(((key, expires_at, value) for key, (expires_at, value) in merged.items()), key=lambda e: e[1])
+    return entries[-limit:] if limit else []
+
+
+@contextmanager
+def _locked(path):
+    """多个 worker 同时合并快照时串行执行（读-合并-写）"""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(f"{path}.lock", 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def write_snapshot(path=SNAPSHOT_PATH):
+    """把当前进程的缓存合并进快照文件（先写临时文件再改名），返回快照中各缓存的条目数"""
+    caches = snapshot_caches()
+    with _locked(path):
+        previous = read_snapshot(path) or {"caches": {}}
+        # 本进程没有的缓存（例如按需加载蓝图时还没导入的模块）保留其他 worker 写入的条目，只去掉已过期的
+        merged = {name: _merge(entries, [], SNAPSHOT_MAX_ENTRIES) for name, entries in previous["caches"].items()}
+        for name, cache in caches.items():
+            limit = min(getattr(cache, 'maxsize', SNAPSHOT_MAX_ENTRIES), SNAPSHOT_MAX_ENTRIES)
+            merged[name] = _merge(previous["caches"].get(name, []), cache.export(), limit)
+        data = zlib.compress(pickle.dumps(
+            {"version": SNAPSHOT_VERSION, "created": time.time(), "caches": merged},
+            protocol=pickle.HIGHEST_PROTOCOL
+        ), 6)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    _state["snapshots_written"] += 1
+    return {name: len(entries) for name, entries in merged.items()}
+
+
+def restore_snapshot(path=SNAPSHOT_PATH):
+    """
+    把快照里仍然有效的条目放回还没恢复过的缓存，返回 {缓存名: 恢复的条目数}。
+    按需加载蓝图时，每导入一个模块调用一次，恢复它新登记的缓存
+    """
+    if not SNAPSHOT_ENABLED:
+        return {}
+    with _restore_lock:
+        pending = {name: cache for name, cache in snapshot_caches().items() if name not in _restored}
+        if not pending:
+            return {}
+        snapshot = read_snapshot(path)
+        _restored.update(pending)
+        if snapshot is None:
+            return {}
+        if _state["snapshot_age_s"] is None:
+            _state["snapshot_age_s"] = round(time.time() - snapshot["created"], 1)
+        restored = {}
+        for name, cache in pending.items():
+            entries = snapshot["caches"].get(name)
+            if entries:
+                restored[name] = cache.load(entries)
+        _state["restored"].update(restored)
+        return restored
+
+
+def warm_start(preload_tables=True):
+    """
+    启动时调用一次：恢复缓存快照，preload_tables 为 True 时再加载本地已有快照的机场表和城市表。
+    使用 gunicorn.conf.py（preload_app）时在 master fork 之前执行，所有 worker 写时复制共享这些数据；
+    否则每个 worker 导入 app 时各自执行。
+    """
+    if _state["ready"]:
+        return _state
+    start = time.perf_counter()
+    restore_snapshot()
+    for name, path_setting in PRELOAD_TABLES if preload_tables else ():
+        try:
+            module = importlib.import_module(f'services.{name}')
+            if not os.path.exists(getattr(module, path_setting)):
+                # 没有本地快照时不在启动时下载（gunicorn master 会卡在网络上），
+                # 交给 python -m services.<name> refresh 或第一次使用
+                logger.info("Skipping %s preload: no local snapshot at %s", name, getattr(module, path_setting))
+                continue
+            table = module.get_table()
+            if hasattr(table, 'arrays'):
+                table.arrays()  # 距离计算用的数组也在 fork 之前建好
+        except Exception as e:
+            # 加载失败时第一次使用还会再试
+            logger.warning("Could not preload %s: %s", name, e)
+    _state["warm_start_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    _state["ready"] = True
+    logger.info("Warm start finished in %.0f ms, restored %s", _state["warm_start_ms"], _state["restored"])
+    return _state
+
+
+def _snapshot_loop():
+    while True:
+        time.sleep(SNAPSHOT_INTERVAL)
+        _snapshot_quietly()
+
+
+def _snapshot_quietly():
+    try:
+        write_snapshot()
+        _state["last_snapshot_error"] = None
+    except Exception as e:
+        _state["last_snapshot_error"] = str(e)
+        logger.warning("Could not write cache snapshot %s: %s", SNAPSHOT_PATH, e)
+
+
+def ensure_snapshot_thread():
+    """在处理请求的进程里启动定期保存快照的线程（gunicorn fork 之后每个 worker 各一个）"""
+    global _writer_pid
+    if not SNAPSHOT_ENABLED or _writer_pid == os.getpid():
+        return
+    with _writer_lock:
+        if _writer_pid == os.getpid():
+            return
+        _writer_pid = os.getpid()
+        threading.Thread(target=_snapshot_loop, name='cache-snapshot', daemon=True).start()
+
+
+@atexit.register
+def _snapshot_on_exit():
+    # worker 正常退出（重启、重新部署）时保存最后一次，master 不写
+    if _writer_pid == os.getpid():
+        _snapshot_quietly()
+
+
+def is_ready():
+    return _state["ready"]
+
+
+def stats():
+    return {
+        **_state,
+        "snapshot_path": SNAPSHOT_PATH,
+        "cache_sizes": {name: len(cache) if hasattr(cache, '__len__') else None
+                        for name, cache in snapshot_caches().items()},
+    }
@@ -0,0 +1,84 @@
+import json
+import logging
+import os
+import re
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+
+# LOG_FORMAT=json 每行一个 JSON 对象（默认，便于日志平台检索），text 为便于阅读的单行文本
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+# 只沿用看起来正常的请求 ID，避免把任意内容写进日志
+_VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+
+_request_id = ContextVar('request_id', default='-')
+
+_TEXT_FORMAT = '%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s'
+# LogRecord 自带的属性，其余的 extra 字段都原样输出
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id'}
+
+
+def current_request_id():
+    return _request_id.get()
+
+
+def new_request_id(incoming=None):
+    """沿用客户端（或反向代理）传来的请求 ID，没有或不合法时生成一个"""
+    if incoming and _VALID_REQUEST_ID.match(incoming):
+        return incoming
+    return uuid.uuid4().hex
+
+
+def set_request_id(request_id):
+    """设置当前上下文的请求 ID，返回用于 reset_request_id 的 token"""
+    return _request_id.set(request_id)
+
+
+def reset_request_id(token):
+    _request_id.reset(token)
+
+
+class RequestIdFilter(logging.Filter):
+    """给每条日志加上 request_id 字段（线程池中的调用沿用提交者的请求 ID）"""
+
+    def filter(self, record):
+        # extra 里显式给出的 request_id 优先（例如流式响应结束后才记录的请求日志）
+        if not hasattr(record, 'request_id'):
+            record.request_id = _request_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志一行 JSON，logger.info(msg, extra={...}) 的字段直接作为键输出"""
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, 'request_id', '-'),
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging():
+    """配置根 logger：输出到 stderr（gunicorn 会收集），可重复调用"""
+    root = logging.getLogger()
+    if any(getattr(handler, '_travel_app', False) for handler in root.handlers):
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler._travel_app = True
+    handler.addFilter(RequestIdFilter())
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(_TEXT_FORMAT))
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
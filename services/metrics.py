@@ -0,0 +1,291 @@
+import atexit
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+from services.cache import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+# 每个 worker 把自己的计数写到 METRICS_DIR/<pid>-<启动时间>.json，/metrics 汇总目录下所有文件，
+# 所以无论请求落到哪个 gunicorn worker，看到的都是全部 worker 的总和。
+# 文件名带上启动时间：max_requests 回收 worker 后 PID 可能被新 worker 复用，
+# 只用 PID 的话新 worker 会覆盖已退出的 worker 的文件，汇总的计数器就会变小
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(CACHE_DIR, 'metrics'))
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+
+# 延迟直方图的桶上限（秒）
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_HELP = {
+    'travel_http_requests_total': ('counter', "HTTP requests handled, by endpoint, method and status."),
+    'travel_http_request_duration_seconds': ('histogram', "HTTP request latency, including streamed bodies."),
+    'travel_upstream_requests_total': ('counter', "Upstream HTTP calls (each retry counts), by upstream host and endpoint."),
+    'travel_upstream_errors_total': ('counter', "Upstream calls that failed with a network error or a 4xx/5xx status."),
+    'travel_upstream_response_bytes_total': ('counter', "Bytes received from upstream response bodies."),
+    'travel_upstream_request_duration_seconds': ('histogram', "Upstream call latency, including the response body."),
+}
+
+# 不在任何请求里发出的上游调用（缓存后台刷新、预热等）
+BACKGROUND_ENDPOINT = 'background'
+
+_current = ContextVar('request_timing', default=None)
+
+
+class RequestTiming:
+    """
+    一个请求内上游调用的耗时汇总，用于 Server-Timing 和请求日志。
+    补全线程池里的调用也记到提交它的请求上；/batch 的子请求同时记到父请求上。
+    """
+
+    def __init__(self, endpoint, parent=None):
+        self.endpoint = endpoint
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.upstreams = {}  # 主机 -> [次数, 总耗时(秒), 错误数]
+        self._lock = threading.Lock()
+
+    def add(self, host, seconds, error):
+        timing = self
+        while timing is not None:
+            with timing._lock:
+                entry = timing.upstreams.setdefault(host, [0, 0.0, 0])
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] += error
+            timing = timing.parent
+
+    def totals(self):
+        """(上游调用次数, 上游总耗时毫秒, 错误数)"""
+        with self._lock:
+            entries = list(self.upstreams.values())
+        return (sum(e[0] for e in entries), round(sum(e[1] for e in entries) * 1000, 1), sum(e[2] for e in entries))
+
+    def server_timing(self):
+        """
+        Server-Timing 头：每个上游一项（dur 为该上游所有调用耗时之和，并发调用会重叠），
+        app 为到生成响应头为止的总耗时
+        """
+        with self._lock:
+            entries = sorted(self.upstreams.items())
+        parts = [
+            f'{_token(host)};dur={seconds * 1000:.1f};desc="{count} call{"s" if count != 1 else ""}'
+            f'{f", {errors} failed" if errors else ""}"'
+            for host, (count, seconds, errors) in entries
+        ]
+        parts.append(f"app;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+def _token(host):
+    # Server-Timing 的名称必须是 token：api.foursquare.com -> api-foursquare-com
+    return re.sub(r'[^A-Za-z0-9_-]', '-', host)
+
+
+def start_request(endpoint):
+    """请求开始：返回 (RequestTiming, token)，请求结束时用 token 调用 end_request"""
+    timing = RequestTiming(endpoint, parent=_current.get())
+    return timing, _current.set(timing)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+class _Registry:
+    """当前进程的计数器和直方图，定期写到 METRICS_DIR 供其他 worker 汇总"""
+
+    def __init__(self):
+        self.counters = {}    # (名称, 标签) -> 值
+        self.histograms = {}  # (名称, 标签) -> [各桶计数..., +Inf 桶计数, 总和]
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.pid = None
+        self.path = None
+        self.flusher = None
+
+    def inc(self, name, labels, value=1):
+        self._ensure_flusher()
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+            self.dirty = True
+
+    def observe(self, name, labels, seconds):
+        self._ensure_flusher()
+        key = (name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+            index = next((i for i, bound in enumerate(BUCKETS) if seconds <= bound), len(BUCKETS))
+            histogram[index] += 1
+            histogram[-1] += seconds
+            self.dirty = True
+
+    def _ensure_flusher(self):
+        # 每个 worker 进程一个写文件的后台线程；gunicorn fork 之后在子进程中重新启动，
+        # 父进程（--preload 时）的计数不带进子进程
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            if self.pid is not None:
+                self.counters.clear()
+                self.histograms.clear()
+            self.pid = os.getpid()
+            self.path = os.path.join(METRICS_DIR, f"{self.pid}-{time.time_ns()}.json")
+            self.flusher = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+            self.flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            if self.dirty:
+                self.flush()
+
+    def snapshot(self):
+        with self.lock:
+            self.dirty = False
+            return {
+                "counters": [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                "histograms": [[name, list(labels), list(values)] for (name, labels), values in self.histograms.items()],
+            }
+
+    def flush(self):
+        """原子地写入本进程的快照（先写临时文件再改名）；本进程还没有记录过时不写"""
+        path = self.path
+        if self.pid != os.getpid():
+            return
+        try:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            tmp = f"{path}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning("Could not write metrics snapshot %s: %s", path, e)
+
+
+_registry = _Registry()
+if hasattr(os, 'register_at_fork'):
+    # fork 时其他线程可能正持有锁，子进程里换一把新锁
+    os.register_at_fork(after_in_child=lambda: setattr(_registry, 'lock', threading.Lock()))
+
+
+def remove_files():
+    """删除所有 worker 的快照（gunicorn master 启动时调用，上一次运行的计数不再计入）"""
+    try:
+        names = os.listdir(METRICS_DIR)
+    except OSError:
+        return
+    for name in names:
+        if name.endswith(('.json', '.tmp')):
+            try:
+                os.remove(os.path.join(METRICS_DIR, name))
+            except OSError:
+                pass
+
+
+@atexit.register
+def _flush_on_exit():
+    # worker 正常退出时写入最后一次快照（fork 出来但没有记录过的进程不写）
+    if _registry.pid == os.getpid() and _registry.dirty:
+        _registry.flush()
+
+
+def observe_upstream(host, seconds, error, nbytes):
+    """upstream.request 每次实际发出 HTTP 调用后调用一次"""
+    timing = _current.get()
+    endpoint = timing.endpoint if timing is not None else BACKGROUND_ENDPOINT
+    labels = (('upstream', host), ('endpoint', endpoint))
+    _registry.inc('travel_upstream_requests_total', labels)
+    if error:
+        _registry.inc('travel_upstream_errors_total', labels)
+    if nbytes:
+        _registry.inc('travel_upstream_response_bytes_total', labels, nbytes)
+    _registry.observe('travel_upstream_request_duration_seconds', labels, seconds)
+    if timing is not None:
+        timing.add(host, seconds, error)
+
+
+def observe_request(endpoint, method, status, seconds):
+    _registry.inc('travel_http_requests_total', (('endpoint', endpoint), ('method', method), ('status', str(status))))
+    _registry.observe('travel_http_request_duration_seconds', (('endpoint', endpoint),), seconds)
+
+
+def _collect():
+    """读取所有 worker 的快照并求和；已退出的 worker 的文件也计入，保证计数器单调"""
+    _registry.flush()
+    counters, histograms = {}, {}
+    try:
+        names = [name for name in os.listdir(METRICS_DIR) if name.endswith('.json')]
+    except OSError:
+        names = []
+    for name in names:
+        try:
+            with open(os.path.join(METRICS_DIR, name), encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue  # 正在被替换或已损坏，跳过这一次
+        for metric, labels, value in snapshot.get("counters", []):
+            key = (metric, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for metric, labels, values in snapshot.get("histograms", []):
+            key = (metric, tuple(map(tuple, labels)))
+            total = histograms.get(key)
+            if total is None or len(total) != len(values):
+                histograms[key] = list(values)
+            else:
+                histograms[key] = [a + b for a, b in zip(total, values)]
+    return counters, histograms
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """Prometheus 文本格式，汇总所有 worker"""
+    counters, histograms = _collect()
+    lines = []
+    for name, (kind, help_text) in _HELP.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+            continue
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS, values):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {cumulative}")
+            cumulative += values[len(BUCKETS)]
+            lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(values[-1])}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
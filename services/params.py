@@ -0,0 +1,19 @@
+from flask import request
+
+
+def city_list(name, keep_empty=False):
+    """
+    从 POST JSON 或查询参数中读取城市列表：JSON 数组，或逗号分隔的字符串（"Paris,Nice"）。
+    JSON 值既不是数组也不是字符串，或数组里有不是字符串的元素时抛出 ValueError。
+    keep_empty 为 True 时保留空项（null 也算空项），用于需要按位置对应的列表（例如每个城市的日期）
+    """
+    body = request.get_json(silent=True) if request.method == 'POST' else None
+    values = body.get(name) if isinstance(body, dict) else request.args.get(name, '')
+    if values is None:
+        return []
+    if isinstance(values, str):
+        values = values.split(',')
+    elif not isinstance(values, list) or not all(v is None or isinstance(v, str) for v in values):
+        raise ValueError(f"{name} must be a list of strings or a comma-separated string")
+    values = [(v or '').strip() for v in values]
+    return values if keep_empty else [v for v in values if v]
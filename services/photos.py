@@ -0,0 +1,36 @@
+import os
+from flask import Blueprint, request, jsonify
+from services import foursquare
+
+photos_blueprint = Blueprint('photos', __name__)
+
+# 一次最多查询的地点数
+PHOTOS_BATCH_MAX = int(os.getenv('PHOTOS_BATCH_MAX', 50))
+
+
+def _fsq_ids():
+    """从 POST JSON {"fsq_ids": [...]} 或查询参数 fsq_ids=a,b,c 中读取地点 ID"""
+    body = request.get_json(silent=True) if request.method == 'POST' else None
+    values = body.get('fsq_ids') if isinstance(body, dict) else request.args.get('fsq_ids', '').split(',')
+    return list(dict.fromkeys(str(v).strip() for v in values or [] if str(v).strip()))
+
+
+@photos_blueprint.route('/', methods=['GET', 'POST'])
+def get_photos():
+    """
+    批量获取地点照片，配合列表接口的 photos=none 使用：
+    只为屏幕上显示的卡片获取照片。返回 {fsq_id: [照片 URL, ...]}
+    """
+    fsq_ids = _fsq_ids()
+    body = request.get_json(silent=True) if request.method == 'POST' else None
+    mode = (body.get('photos') if isinstance(body, dict) else None) or request.args.get('photos', 'all')
+
+    if not fsq_ids:
+        return jsonify({"error": "Please provide a list of fsq_ids"}), 400
+    if len(fsq_ids) > PHOTOS_BATCH_MAX:
+        return jsonify({"error": f"At most {PHOTOS_BATCH_MAX} fsq_ids per request"}), 400
+    if mode not in ('first', 'all'):
+        return jsonify({"error": "photos must be one of: first, all"}), 400
+
+    return jsonify(dict(zip(fsq_ids, foursquare.fetch_all_photos(fsq_ids, mode))))
+#http://127.0.0.1:5000/photos/?fsq_ids=4b5d2a6cf964a520e15a29e3,4adcdb0df964a520a35e21e3
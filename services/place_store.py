@@ -0,0 +1,258 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from services import geo
+
+# 已经见过的 Foursquare 地点，以及哪些（中心, 半径, 分类）区域已被完整搜索过。
+# 新的查询落在一个仍然有效的已覆盖区域内时，直接在本地按半径过滤、按距离排序，不再调用 Foursquare。
+PLACE_STORE_TTL = int(os.getenv('PLACE_STORE_TTL', 24 * 3600))
+PLACE_STORE_MAX_PLACES = int(os.getenv('PLACE_STORE_MAX_PLACES', 50000))
+PLACE_STORE_MAX_REGIONS = int(os.getenv('PLACE_STORE_MAX_REGIONS', 4096))
+# geohash 精度 6 的格子约 1.2km × 0.6km
+PLACE_STORE_GEOHASH_PRECISION = int(os.getenv('PLACE_STORE_GEOHASH_PRECISION', 6))
+# 覆盖区域索引用的粗格子：精度 4 约 39km × 19.5km，100km 半径的区域也只落在几十个格子里
+REGION_GEOHASH_PRECISION = 4
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+METERS_PER_DEGREE = 111320.0
+
+
+def geohash(lat, lon, precision=PLACE_STORE_GEOHASH_PRECISION):
+    """标准 geohash 编码"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(chars)
+
+
+def _cell_size(precision):
+    """geohash 格子的（纬度跨度, 经度跨度），单位：度"""
+    lon_bits = (precision * 5 + 1) // 2
+    lat_bits = precision * 5 // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def _steps(low, high, step):
+    values, value = [], low
+    while value < high:
+        values.append(value)
+        value += step
+    values.append(high)
+    return values
+
+
+def covering_cells(lat, lon, radius_m, precision=PLACE_STORE_GEOHASH_PRECISION):
+    """与以 (lat, lon) 为中心、radius_m 为半径的圆的外接矩形相交的所有格子"""
+    dlat = radius_m / METERS_PER_DEGREE
+    dlon = radius_m / (METERS_PER_DEGREE * max(0.01, math.cos(math.radians(lat))))
+    cell_lat, cell_lon = _cell_size(precision)
+    return {
+        geohash(max(-90.0, min(90.0, a)), ((o + 180.0) % 360.0) - 180.0, precision)
+        for a in _steps(lat - dlat, lat + dlat, cell_lat)
+        for o in _steps(lon - dlon, lon + dlon, cell_lon)
+    }
+
+
+def _coordinates(place):
+    main = (place.get("geocodes") or {}).get("main") or {}
+    lat, lon = main.get("latitude"), main.get("longitude")
+    return (lat, lon) if lat is not None and lon is not None else None
+
+
+def _parse(params):
+    """搜索参数 -> (lat, lon, radius_m, categories, limit)；带关键字的搜索不适用"""
+    if params.get('query') or 'll' not in params:
+        return None
+    lat, lon = (float(x) for x in params['ll'].split(','))
+    return lat, lon, int(params['radius']), params.get('categories', ''), int(params['limit'])
+
+
+class PlaceStore:
+    """
+    按 fsq_id 保存地点，用 geohash 网格做空间索引。
+    地点按写入时间排序，超出 max_places 时淘汰最旧的地点，
+    同时丢弃可能包含它的覆盖区域（不早于它的写入时间的区域都不受影响）。
+    """
+
+    def __init__(self, ttl=PLACE_STORE_TTL, max_places=PLACE_STORE_MAX_PLACES,
+                 max_regions=PLACE_STORE_MAX_REGIONS, precision=PLACE_STORE_GEOHASH_PRECISION):
+        self.ttl = ttl
+        self.max_places = max_places
+        self.max_regions = max_regions
+        self.precision = precision
+        self._places = OrderedDict()  # fsq_id -> (stored_at, lat, lon, cell, categories 集合, place)
+        self._cells = {}  # geohash -> fsq_id 集合
+        self._regions = OrderedDict()  # (lat, lon, radius, categories) -> stored_at
+        self._region_cells = {}  # (categories, 粗 geohash) -> 与该格子相交的区域集合
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.misses = 0
+
+    def record(self, params, places):
+        """保存搜索结果；结果数少于 limit 时说明区域内的地点都已返回，记为已覆盖"""
+        parsed = _parse(params)
+        categories = params.get('categories', '')
+        now = time.monotonic()
+        complete = True
+        with self._lock:
+            for place in places:
+                coords = _coordinates(place)
+                fsq_id = place.get("fsq_id")
+                if coords is None or not fsq_id:
+                    complete = False
+                    continue
+                self._put(fsq_id, coords, categories, place, now)
+            if parsed and complete and len(places) < parsed[4]:
+                self._forget_missing(parsed[:4], {place["fsq_id"] for place in places})
+                self._add_region(parsed[:4], now)
+                while len(self._regions) > self.max_regions:
+                    self._drop_region(next(iter(self._regions)))
+            while len(self._places) > self.max_places:
+                self._evict_oldest()
+
+    def _put(self, fsq_id, coords, categories, place, now):
+        old = self._places.pop(fsq_id, None)
+        tags = {categories}
+        if old is not None:
+            self._cells.get(old[3], set()).discard(fsq_id)
+            tags |= old[4]
+            place = {**old[5], **place}
+        cell = geohash(coords[0], coords[1], self.precision)
+        self._places[fsq_id] = (now, coords[0], coords[1], cell, tags, place)
+        self._cells.setdefault(cell, set()).add(fsq_id)
+
+    def _forget_missing(self, region, returned):
+        """
+        完整的搜索结果就是区域内该分类的全部地点：之前存下、这次没有返回的地点（已关闭或已删除）
+        去掉这个分类的标记，没有任何标记的地点直接删除
+        """
+        lat, lon, radius, categories = region
+        for cell in covering_cells(lat, lon, radius, self.precision):
+            for fsq_id in list(self._cells.get(cell, ())):
+                _, p_lat, p_lon, _, tags, _ = self._places[fsq_id]
+                if (fsq_id in returned or categories not in tags
+                        or geo.haversine_km(lat, lon, p_lat, p_lon) * 1000 > radius):
+                    continue
+                tags.discard(categories)
+                if not tags:
+                    self._remove_place(fsq_id)
+
+    def _remove_place(self, fsq_id):
+        _, _, _, cell, _, _ = self._places.pop(fsq_id)
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(fsq_id)
+            if not members:
+                del self._cells[cell]
+
+    def _evict_oldest(self):
+        fsq_id = next(iter(self._places))
+        stored_at = self._places[fsq_id][0]
+        self._remove_place(fsq_id)
+        # 区域按写入时间排序，最旧的在前面
+        while self._regions and next(iter(self._regions.values())) <= stored_at:
+            self._drop_region(next(iter(self._regions)))
+
+    def _region_index_keys(self, region):
+        r_lat, r_lon, r_radius, categories = region
+        return [(categories, cell) for cell in covering_cells(r_lat, r_lon, r_radius, REGION_GEOHASH_PRECISION)]
+
+    def _add_region(self, region, now):
+        if region in self._regions:
+            self._regions.move_to_end(region)
+        else:
+            for key in self._region_index_keys(region):
+                self._region_cells.setdefault(key, set()).add(region)
+        self._regions[region] = now
+
+    def _drop_region(self, region):
+        del self._regions[region]
+        for key in self._region_index_keys(region):
+            members = self._region_cells.get(key)
+            if members is not None:
+                members.discard(region)
+                if not members:
+                    del self._region_cells[key]
+
+    def _covered(self, lat, lon, radius, categories, now):
+        """只检查与查询中心同一个粗格子的区域：包含查询圆的区域一定也包含它的中心"""
+        key = (categories, geohash(lat, lon, REGION_GEOHASH_PRECISION))
+        for region in list(self._region_cells.get(key, ())):
+            if now - self._regions[region] >= self.ttl:
+                self._drop_region(region)
+                continue
+            r_lat, r_lon, r_radius, _ = region
+            if geo.haversine_km(lat, lon, r_lat, r_lon) * 1000 + radius <= r_radius:
+                return True
+        return False
+
+    def query(self, params):
+        """
+        查询落在已覆盖区域内时返回按距离排序的前 limit 个地点（distance 为到中心的米数），
+        否则返回 None
+        """
+        parsed = _parse(params)
+        if parsed is None:
+            return None
+        lat, lon, radius, categories, limit = parsed
+        now = time.monotonic()
+        with self._lock:
+            if not self._covered(lat, lon, radius, categories, now):
+                self.misses += 1
+                return None
+            candidates = []
+            for cell in covering_cells(lat, lon, radius, self.precision):
+                for fsq_id in self._cells.get(cell, ()):
+                    _, p_lat, p_lon, _, tags, place = self._places[fsq_id]
+                    if categories in tags:
+                        candidates.append((p_lat, p_lon, place))
+            self.local_hits += 1
+
+        if not candidates:
+            return []
+        distances = geo.haversine_to_all(
+            lat, lon, [c[0] for c in candidates], [c[1] for c in candidates]
+        ) * 1000
+        nearby = sorted(
+            (int(round(d)), i) for i, d in enumerate(distances) if d <= radius
+        )[:limit]
+        return [{**candidates[i][2], "distance": d} for d, i in nearby]
+
+    def stats(self):
+        return {
+            "places": len(self._places),
+            "regions": len(self._regions),
+            "local_hits": self.local_hits,
+            "misses": self.misses,
+        }
+
+
+_store = PlaceStore()
+
+
+def record(params, places):
+    _store.record(params, places)
+
+
+def query(params):
+    return _store.query(params)
+
+
+def stats():
+    return _store.stats()
@@ -0,0 +1,403 @@
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from services.cache import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+# 采集到的性能数据（环形缓冲，最多 PROFILE_MAX_CAPTURES 份，所有 worker 共用）
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(CACHE_DIR, 'profiles'))
+PROFILE_MAX_CAPTURES = int(os.getenv('PROFILE_MAX_CAPTURES', 50))
+# 栈采样间隔（秒）
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.005))
+# 开关状态保存在这个文件里，管理接口修改后各 worker 最多 PROFILE_SETTINGS_REFRESH 秒内生效
+SETTINGS_PATH = os.path.join(PROFILE_DIR, 'settings.json')
+PROFILE_SETTINGS_REFRESH = 1.0
+
+# 没有设置文件时的默认值：sample_rate 为对多少比例的请求运行 cProfile，
+# slow_ms 大于 0 时对所有请求做栈采样，耗时超过 slow_ms 的保留下来
+DEFAULT_SETTINGS = {
+    "sample_rate": float(os.getenv('PROFILE_SAMPLE_RATE', 0)),
+    "slow_ms": float(os.getenv('PROFILE_SLOW_MS', 0)),
+}
+
+# Python 3.12 起 cProfile 基于 sys.monitoring，一个 Profile 记录整个解释器的所有线程，
+# 并且同一时间只能有一个在运行。这时每次只有一个请求运行 cProfile（结果包含进程里所有线程，
+# 不只是这个请求），同时被抽中的其他请求只做栈采样，并在元数据里注明
+PROCESS_WIDE_CPROFILE = sys.version_info >= (3, 12)
+_process_profile_lock = threading.Lock()
+
+_CAPTURE_ID = re.compile(r'^[0-9]+-[0-9a-f]{8}$')
+
+_current = ContextVar('profile_capture', default=None)
+
+_settings = dict(DEFAULT_SETTINGS)
+_settings_checked = 0.0
+_settings_mtime = None
+_settings_lock = threading.Lock()
+
+
+def _read_settings():
+    try:
+        with open(SETTINGS_PATH, encoding='utf-8') as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        return dict(DEFAULT_SETTINGS)
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update({k: float(stored[k]) for k in DEFAULT_SETTINGS if isinstance(stored.get(k), (int, float))})
+    return settings
+
+
+def settings():
+    """当前开关状态；每秒最多检查一次设置文件的修改时间"""
+    global _settings, _settings_checked, _settings_mtime
+    now = time.monotonic()
+    if now - _settings_checked < PROFILE_SETTINGS_REFRESH:
+        return _settings
+    with _settings_lock:
+        if now - _settings_checked >= PROFILE_SETTINGS_REFRESH:
+            try:
+                mtime = os.stat(SETTINGS_PATH).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime != _settings_mtime:
+                _settings, _settings_mtime = _read_settings(), mtime
+            _settings_checked = now
+    return _settings
+
+
+def update_settings(sample_rate=None, slow_ms=None):
+    """修改开关状态（所有 worker 生效），返回新的状态"""
+    global _settings_checked
+    new = dict(_read_settings())
+    if sample_rate is not None:
+        new["sample_rate"] = float(sample_rate)
+    if slow_ms is not None:
+        new["slow_ms"] = float(slow_ms)
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    tmp = f"{SETTINGS_PATH}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(new, f)
+    os.replace(tmp, SETTINGS_PATH)
+    _settings_checked = 0.0  # 本进程立即生效
+    return new
+
+
+class Capture:
+    """一个请求的性能数据：请求线程及替它工作的线程池线程的栈采样，以及可选的 cProfile"""
+
+    def __init__(self, endpoint, path, request_id, cprofile):
+        self.endpoint = endpoint
+        self.path = path
+        self.request_id = request_id
+        self.sampled = cprofile
+        self.cprofile = cprofile
+        # cProfile 覆盖的范围："threads"（只有替这个请求工作的线程）或 "process"（整个 worker）
+        self.cprofile_scope = None
+        self.cprofile_note = None  # cProfile 没有运行或不完整的原因
+        self.process_profile = None
+        self.start = time.perf_counter()
+        self.created = time.time()
+        self.stacks = Counter()
+        self.samples = 0
+        self.threads = {}   # 线程 ident -> [正在替这个请求工作的层数, 这个线程的 cProfile]
+        self.profiles = []  # 已停止的 cProfile.Profile
+        self.lock = threading.Lock()
+        self.leave = None
+
+    def enter_thread(self):
+        """当前线程开始替这个请求工作；返回的函数在结束时调用"""
+        ident = threading.get_ident()
+        with self.lock:
+            entry = self.threads.get(ident)
+            if entry is not None:
+                # 同一线程里嵌套进入（例如 /batch 子请求）：沿用外层的 cProfile
+                entry[0] += 1
+            else:
+                entry = self.threads[ident] = [1, None]
+        if entry[0] == 1 and self.cprofile and not PROCESS_WIDE_CPROFILE:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                entry[1] = profile
+            except ValueError:  # 这个线程已经有别的 profiler 在运行
+                with self.lock:
+                    self.cprofile_note = "some threads were not profiled: another profiler was active in them"
+
+        def leave():
+            with self.lock:
+                entry[0] -= 1
+                if entry[0] > 0:
+                    return
+                del self.threads[ident]
+            if entry[1] is not None:
+                entry[1].disable()
+                with self.lock:
+                    self.profiles.append(entry[1])
+
+        return leave
+
+
+class _StackSampler:
+    """
+    每个进程一个采样线程：有正在采集的请求时，每 PROFILE_SAMPLE_INTERVAL 秒读取一次
+    这些请求所在线程的调用栈，累计为 collapsed stack（火焰图格式）
+    """
+
+    def __init__(self):
+        self.captures = set()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pid = None
+        self._labels = {}
+
+    def add(self, capture):
+        with self.lock:
+            self.captures.add(capture)
+            if self.pid != os.getpid():
+                # gunicorn fork 之后在子进程中重新启动采样线程
+                self.pid = os.getpid()
+                threading.Thread(target=self._run, name='profile-sampler', daemon=True).start()
+        self.wakeup.set()
+
+    def remove(self, capture):
+        with self.lock:
+            self.captures.discard(capture)
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _stack(self, frame):
+        labels = []
+        while frame is not None:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        return ";".join(reversed(labels))
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            with self.lock:
+                captures = list(self.captures)
+                if not captures:
+                    self.wakeup.clear()
+            if not captures:
+                self.wakeup.wait()
+                continue
+            frames = sys._current_frames()
+            for capture in captures:
+                with capture.lock:
+                    threads = list(capture.threads)
+                stacks = [self._stack(frames[ident]) for ident in threads if ident in frames and ident != own]
+                with capture.lock:
+                    capture.samples += 1
+                    capture.stacks.update(stacks)
+            del frames
+            time.sleep(PROFILE_SAMPLE_INTERVAL)
+
+
+_sampler = _StackSampler()
+
+
+def start(endpoint, path, request_id):
+    """
+    请求开始时调用。按当前开关决定是否采集，返回 (Capture 或 None, token)；
+    请求结束时调用 finish，teardown 时用 token 调用 end。
+    已经在采集中的请求（例如 /batch 的子请求）不再单独采集
+    """
+    if _current.get() is not None:
+        return None, None
+    current = settings()
+    cprofile = current["sample_rate"] > 0 and random.random() < current["sample_rate"]
+    if not cprofile and current["slow_ms"] <= 0:
+        return None, None
+    capture = Capture(endpoint, path, request_id, cprofile)
+    if cprofile and PROCESS_WIDE_CPROFILE:
+        _start_process_profile(capture)
+    elif cprofile:
+        capture.cprofile_scope = "threads"
+    capture.leave = capture.enter_thread()
+    _sampler.add(capture)
+    return capture, _current.set(capture)
+
+
+def _start_process_profile(capture):
+    """整个进程只有一个 cProfile：拿不到时这个请求不运行 cProfile"""
+    capture.cprofile = False
+    if not _process_profile_lock.acquire(blocking=False):
+        capture.cprofile_note = "cProfile skipped: another request was already profiling this process"
+        return
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:  # 进程里已经有别的 profiler 在运行
+        _process_profile_lock.release()
+        capture.cprofile_note = "cProfile skipped: another profiler was already active in this process"
+        return
+    capture.process_profile = profile
+    capture.cprofile_scope = "process"
+    capture.cprofile_note = "cProfile covers every thread in this worker, including other concurrent requests"
+
+
+def _stop_process_profile(capture):
+    profile, capture.process_profile = capture.process_profile, None
+    try:
+        profile.disable()
+    finally:
+        _process_profile_lock.release()
+    with capture.lock:
+        capture.profiles.append(profile)
+
+
+def end(token):
+    _current.reset(token)
+
+
+@contextmanager
+def attach():
+    """线程池中的调用：如果提交它的请求正在被采集，把当前线程也算进去"""
+    capture = _current.get()
+    if capture is None:
+        yield
+        return
+    leave = capture.enter_thread()
+    try:
+        yield
+    finally:
+        leave()
+
+
+def finish(capture, status):
+    """请求结束（流式响应为响应体发送完）时调用：抽中的请求和慢请求写入磁盘"""
+    capture.leave()
+    if capture.process_profile is not None:
+        _stop_process_profile(capture)
+    _sampler.remove(capture)
+    elapsed_ms = (time.perf_counter() - capture.start) * 1000
+    slow_ms = settings()["slow_ms"]
+    reasons = []
+    if capture.sampled:
+        reasons.append("sampled")
+    if slow_ms > 0 and elapsed_ms >= slow_ms:
+        reasons.append("slow")
+    if not reasons:
+        return None
+    try:
+        return _write(capture, elapsed_ms, status, reasons)
+    except OSError as e:
+        logger.warning("Could not write profile for %s: %s", capture.path, e)
+        return None
+
+
+def _write(capture, elapsed_ms, status, reasons):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    capture_id = f"{int(capture.created * 1000)}-{os.urandom(4).hex()}"
+    base = os.path.join(PROFILE_DIR, capture_id)
+    files = []
+    with capture.lock:
+        stacks = capture.stacks.most_common()
+        profiles = list(capture.profiles)
+    if stacks:
+        with open(f"{base}.collapsed", 'w', encoding='utf-8') as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in stacks)
+        files.append('collapsed')
+    if profiles:
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(f"{base}.pstats")
+        files.append('pstats')
+    meta = {
+        "id": capture_id,
+        "created": round(capture.created, 3),
+        "pid": os.getpid(),
+        "request_id": capture.request_id,
+        "endpoint": capture.endpoint,
+        "path": capture.path,
+        "status": status,
+        "duration_ms": round(elapsed_ms, 1),
+        "reasons": reasons,
+        "samples": capture.samples,
+        "sample_interval_ms": PROFILE_SAMPLE_INTERVAL * 1000,
+        "files": files,
+        "cprofile_scope": capture.cprofile_scope,
+        "cprofile_note": capture.cprofile_note,
+    }
+    # 元数据最后写入：列表里出现的采集，数据文件一定已经写完
+    with open(f"{base}.json.tmp", 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(f"{base}.json.tmp", f"{base}.json")
+    _prune()
+    logger.info("Captured profile %s for %s (%s)", capture_id, capture.path, ", ".join(reasons))
+    return meta
+
+
+def _capture_ids():
+    try:
+        names = os.listdir(PROFILE_DIR)
+    except OSError:
+        return []
+    return sorted(name[:-5] for name in names if name.endswith('.json') and _CAPTURE_ID.match(name[:-5]))
+
+
+def _prune():
+    """只保留最新的 PROFILE_MAX_CAPTURES 份"""
+    ids = _capture_ids()
+    for capture_id in ids[:max(0, len(ids) - PROFILE_MAX_CAPTURES)]:
+        delete(capture_id)
+
+
+def list_captures():
+    """最新的在前"""
+    captures = []
+    for capture_id in reversed(_capture_ids()):
+        meta = get(capture_id)
+        if meta is not None:
+            captures.append(meta)
+    return captures
+
+
+def get(capture_id):
+    if not _CAPTURE_ID.match(capture_id):
+        return None
+    try:
+        with open(os.path.join(PROFILE_DIR, f"{capture_id}.json"), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def file_path(capture_id, kind):
+    """采集的数据文件路径（kind 为 pstats 或 collapsed），不存在时返回 None"""
+    if not _CAPTURE_ID.match(capture_id) or kind not in ('pstats', 'collapsed'):
+        return None
+    path = os.path.join(PROFILE_DIR, f"{capture_id}.{kind}")
+    return path if os.path.exists(path) else None
+
+
+def delete(capture_id):
+    # 先删元数据，列表里就不会出现只剩一半文件的采集
+    for suffix in ('json', 'pstats', 'collapsed'):
+        try:
+            os.remove(os.path.join(PROFILE_DIR, f"{capture_id}.{suffix}"))
+        except FileNotFoundError:
+            pass
+
+
+def clear():
+    for capture_id in _capture_ids():
+        delete(capture_id)
@@ -0,0 +1,237 @@
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+try:
+    import fcntl
+except ImportError:  # Windows：没有 fcntl 时退化为每个进程单独限流
+    fcntl = None
+
+from services.cache import CACHE_DIR
+
+# 各上游的配额，格式为 "主机=次数/时间单位[@突发量]"，用逗号分隔，例如
+#   nominatim.openstreetmap.org=1/s,api.openrouteservice.org=40/min@5
+# 没有配置的主机不限流。默认值按各服务免费账号的限制取得偏保守：
+# Foursquare 按分钟计的配额（照片补全会一次发出多个请求，突发量放宽），SNCF 按秒节流
+RATE_LIMITS = os.getenv(
+    'RATE_LIMITS',
+    'nominatim.openstreetmap.org=1/s,api.openrouteservice.org=40/min@5,'
+    'api.foursquare.com=500/min@50,api.sncf.com=5/s@10'
+)
+# 令牌桶状态文件所在目录，同一台机器上的所有 gunicorn worker 共用
+RATE_LIMIT_DIR = os.getenv('RATE_LIMIT_DIR', os.path.join(CACHE_DIR, 'ratelimit'))
+# 预计需要等待超过这么多秒时立即拒绝，而不是排队到超时
+RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', 3))
+RATE_LIMIT_BACKGROUND_MAX_WAIT = float(os.getenv('RATE_LIMIT_BACKGROUND_MAX_WAIT', 30))
+# 后台请求只能使用超过这个比例的令牌，桶里剩下的部分留给用户请求
+RATE_LIMIT_BACKGROUND_RESERVE = float(os.getenv('RATE_LIMIT_BACKGROUND_RESERVE', 0.5))
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+_UNITS = {'s': 1, 'sec': 1, 'second': 1, 'm': 60, 'min': 60, 'minute': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+_STATE = struct.Struct('<dd')  # (令牌数, 更新时间)
+
+_priority = ContextVar('upstream_priority', default=INTERACTIVE)
+
+
+class RateLimited(Exception):
+    """上游配额已用完，且预计等待时间超过调用者可以接受的范围"""
+
+    def __init__(self, host, retry_after):
+        super().__init__(f"Rate limit for {host} exceeded, retry after {retry_after:.1f}s")
+        self.host = host
+        self.retry_after = retry_after
+
+
+def parse_limits(spec):
+    """解析 RATE_LIMITS，返回 {主机: (每秒令牌数, 突发量)}"""
+    limits = {}
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        host, _, quota = entry.partition('=')
+        quota, _, burst = quota.partition('@')
+        count, _, unit = quota.partition('/')
+        rate = float(count) / _UNITS[unit.strip() or 's']
+        limits[host.strip()] = (rate, float(burst) if burst else max(1.0, float(count)))
+    return limits
+
+
+def current_priority():
+    return _priority.get()
+
+
+@contextmanager
+def background():
+    """在这个上下文中发出的上游请求都作为后台请求（例如缓存的后台刷新）"""
+    token = _priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """
+    令牌桶，状态保存在一个 16 字节的文件里，用 flock 保证多进程原子地读改写。
+    没有 fcntl 时状态只保存在当前进程。
+    """
+
+    def __init__(self, host, rate, burst, directory=RATE_LIMIT_DIR):
+        self.host = host
+        self.rate = rate
+        self.burst = burst
+        self.path = os.path.join(directory, f"{host}.bucket")
+        self._fd = None
+        self._pid = None
+        self._state = (burst, time.time())
+        self._lock = threading.Lock()
+
+    def _file(self):
+        # flock 锁属于打开的文件描述，fork 之后必须在子进程中重新打开
+        if self._fd is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+    def _update(self, fn):
+        """在锁内读取状态 (tokens, updated_at)，fn 返回 (新状态, 结果)"""
+        with self._lock:
+            if fcntl is None:
+                self._state, result = fn(*self._state)
+                return result
+            fd = self._file()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                data = os.pread(fd, _STATE.size, 0)
+                state = _STATE.unpack(data) if len(data) == _STATE.size else (self.burst, time.time())
+                new_state, result = fn(*state)
+                os.pwrite(fd, _STATE.pack(*new_state), 0)
+                return result
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _refill(self, tokens, updated_at, now):
+        return min(self.burst, tokens + max(0.0, now - updated_at) * self.rate)
+
+    def try_take(self, priority=INTERACTIVE):
+        """取一个令牌：成功返回 0，否则返回预计需要等待的秒数"""
+        # 后台请求必须在桶里留下一部分令牌（突发量为 1 时无法预留）
+        need = 1.0
+        if priority == BACKGROUND:
+            need = max(1.0, min(self.burst, 1.0 + self.burst * RATE_LIMIT_BACKGROUND_RESERVE))
+
+        def take(tokens, updated_at):
+            now = time.time()
+            tokens = self._refill(tokens, updated_at, now)
+            if tokens >= need:
+                return (tokens - 1.0, now), 0.0
+            return (tokens, now), (need - tokens) / self.rate
+
+        return self._update(take)
+
+    def penalize(self, seconds):
+        """上游返回 429 时清空令牌，seconds 秒内所有 worker 都不再发出请求"""
+        def drain(tokens, updated_at):
+            now = time.time()
+            return (min(self._refill(tokens, updated_at, now), 0.0) - seconds * self.rate, now), None
+
+        self._update(drain)
+
+
+class _HostGovernor:
+    """
+    一个上游的限流器：跨进程共享令牌桶，进程内等待者按（优先级, 到达顺序）排队，
+    只有队首的线程去取令牌
+    """
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = 0
+        self.acquired = 0
+        self.rejected = 0
+        self.penalties = 0
+        self.wait_ms = 0.0
+
+    def acquire(self, priority, max_wait):
+        start = time.monotonic()
+        deadline = start + max_wait
+        with self._cond:
+            self._seq += 1
+            ticket = (priority, self._seq)
+            self._queue.append(ticket)
+            try:
+                while True:
+                    if min(self._queue) == ticket:
+                        wait = self.bucket.try_take(priority)
+                        if wait == 0:
+                            self.acquired += 1
+                            self.wait_ms += (time.monotonic() - start) * 1000
+                            return
+                        if time.monotonic() + wait > deadline:
+                            self.rejected += 1
+                            raise RateLimited(self.bucket.host, wait)
+                    else:
+                        wait = max(0.0, deadline - time.monotonic())
+                        if wait == 0:
+                            self.rejected += 1
+                            raise RateLimited(self.bucket.host, 1 / self.bucket.rate)
+                    self._cond.wait(wait)
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+    def stats(self):
+        return {
+            "rate_per_s": round(self.bucket.rate, 4),
+            "burst": self.bucket.burst,
+            "acquired": self.acquired,
+            "rejected": self.rejected,
+            "penalties": self.penalties,
+            "avg_wait_ms": round(self.wait_ms / self.acquired, 1) if self.acquired else None,
+        }
+
+
+_governors = {
+    host: _HostGovernor(TokenBucket(host, rate, burst)) for host, (rate, burst) in parse_limits(RATE_LIMITS).items()
+}
+
+
+def governs(host):
+    return host in _governors
+
+
+def acquire(host, max_wait=None):
+    """
+    发出请求前取一个令牌。没有配置配额的主机直接返回。
+    预计等待时间超过 max_wait（默认按优先级取 RATE_LIMIT_MAX_WAIT 或
+    RATE_LIMIT_BACKGROUND_MAX_WAIT）时立即抛出 RateLimited。
+    """
+    governor = _governors.get(host)
+    if governor is None:
+        return
+    priority = _priority.get()
+    if max_wait is None:
+        max_wait = RATE_LIMIT_BACKGROUND_MAX_WAIT if priority == BACKGROUND else RATE_LIMIT_MAX_WAIT
+    governor.acquire(priority, max_wait)
+
+
+def penalize(host, seconds=None):
+    """上游返回 429：暂停该主机 seconds 秒（默认一个令牌的间隔）"""
+    governor = _governors.get(host)
+    if governor is None:
+        return
+    governor.penalties += 1
+    governor.bucket.penalize(seconds if seconds is not None else 1 / governor.bucket.rate)
+
+
+def stats():
+    return {host: governor.stats() for host, governor in _governors.items()}
@@ -1,20 +1,17 @@
-import os
-from flask import Flask, Blueprint, request, jsonify
+import logging
+from flask import Blueprint, request, jsonify
 import requests
 import hashlib
-from dotenv import load_dotenv  # 从 python-dotenv 导入加载函数
+from services.geocoding import convert_city_to_lat_lng
+from services import foursquare
+from services.streaming import wants_stream, ndjson_response
 
-# 创建 Flask 应用
-app = Flask(__name__)
+logger = logging.getLogger(__name__)
 
-# 配置信息
-FOURSQUARE_API_KEY = os.getenv('FOURSQUARE_API_KEY')  # 从环境变量读取 API Key
-if not FOURSQUARE_API_KEY:
-    raise EnvironmentError("FOURSQUARE_API_KEY is not set. Please set it in the environment variables.")
-SEARCH_URL = 'https://api.foursquare.com/v3/places/search'
-DETAIL_URL = 'https://api.foursquare.com/v3/places'
-PHOTO_URL = 'https://api.foursquare.com/v3/places/{fsq_id}/photos'
-NOMINATIM_URL = 'https://nominatim.openstreetmap.org/search'
+# 一次搜索请求就返回详情接口原本提供的字段，避免每家餐厅再调用一次详情接口
+RESTAURANT_FIELDS = ('fsq_id', 'name', 'categories', 'location', 'tel', 'website', 'geocodes')
+# 这些字段缺失说明餐厅本身没有该信息，不需要再查详情
+OPTIONAL_FIELDS = ('tel', 'website', 'geocodes')
 
 # 创建蓝图
 restaurant_blueprint = Blueprint('restaurant', __name__)
@@ -35,28 +32,33 @@ def generate_rating_and_price(fsq_id):
     return round(rating, 1), price
 
 
-# 城市名转经纬度函数
-def convert_city_to_lat_lng(city_name):
+def search_restaurants(params):
     """
-    使用 Nominatim API 将城市名称转换为经纬度
+    搜索餐厅，只在字段缺失时才补查详情
     """
-    params = {
-        'q': city_name,
-        'format': 'json',
-        'addressdetails': 1,
-        'limit': 1
+    places = foursquare.search_places(params, fields=RESTAURANT_FIELDS)
+    return foursquare.fill_missing_fields(places, RESTAURANT_FIELDS, optional=OPTIONAL_FIELDS)
+
+
+def format_restaurant(place, photos):
+    fsq_id = place.get("fsq_id")
+
+    # 使用 fsq_id 生成评分和价格
+    generated_rating, generated_price = generate_rating_and_price(fsq_id)
+
+    # 整合数据
+    return {
+        "fsq_id": fsq_id,
+        "name": place.get("name", "No name available"),
+        "categories": [cat["name"] for cat in place.get("categories", [])],
+        "rating": generated_rating,
+        "price": f"{generated_price}€",
+        "location": place.get("location", {}).get("formatted_address", "No address available"),
+        "phone": place.get("tel", "No phone available"),
+        "website": place.get("website", "No website available"),
+        "photos": photos
     }
-    headers = {'User-Agent': 'MyTravelApp/1.0 (myemail@example.com)'}
-    try:
-        response = requests.get(NOMINATIM_URL, params=params, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        if data:
-            return f"{data[0]['lat']},{data[0]['lon']}"
-        return None
-    except requests.exceptions.RequestException as e:
-        print("Nominatim API Error:", e)
-        return None
+
 
 @restaurant_blueprint.route('/', methods=['GET'])
 def get_restaurants_with_details():
@@ -66,6 +68,7 @@ def get_restaurants_with_details():
     city_name = request.args.get('city')
     radius = request.args.get('radius', 1000)
     limit = request.args.get('limit', 5)
+    photos = request.args.get('photos', 'all')  # none | first | all
 
     if not city_name:
         return jsonify({"error": "Please provide a city name"}), 400
@@ -75,63 +78,21 @@ def get_restaurants_with_details():
     if not location:
         return jsonify({"error": f"Failed to retrieve location for city: {city_name}"}), 500
 
-    headers = {'Authorization': FOURSQUARE_API_KEY}
-    params = {
-        'll': location,
-        'radius': radius,
-        'categories': '13065',
-        'limit': limit
-    }
+    try:
+        params = foursquare.listing_params(location, radius, '13065', limit)
+    except ValueError:
+        return jsonify({"error": "radius and limit must be integers"}), 400
+    if photos not in foursquare.PHOTO_MODES:
+        return jsonify({"error": f"photos must be one of: {', '.join(foursquare.PHOTO_MODES)}"}), 400
 
     try:
-        # 搜索餐厅
-        search_response = requests.get(SEARCH_URL, headers=headers, params=params)
-        search_response.raise_for_status()
-        search_data = search_response.json()
-
-        restaurants = []
-        for place in search_data.get("results", []):
-            fsq_id = place.get("fsq_id")
-
-            # 获取详细信息
-            detail_response = requests.get(f"{DETAIL_URL}/{fsq_id}", headers=headers)
-            detail_response.raise_for_status()
-            detail_data = detail_response.json()
-
-            # 获取图片信息
-            photo_response = requests.get(PHOTO_URL.replace("{fsq_id}", fsq_id), headers=headers)
-            photo_response.raise_for_status()
-            photos = photo_response.json()
-
-            # 整合数据
-            # 使用 fsq_id 生成评分和价格
-            generated_rating, generated_price = generate_rating_and_price(fsq_id)
-
-            # 整合数据
-            restaurant_details = {
-                "name": detail_data.get("name", "No name available"),
-                "categories": [cat["name"] for cat in detail_data.get("categories", [])],
-                "rating": generated_rating,
-                "price": f"{generated_price}€",
-                "location": detail_data.get("location", {}).get("formatted_address", "No address available"),
-                "phone": detail_data.get("tel", "No phone available"),
-                "website": detail_data.get("website", "No website available"),
-                "photos": [
-                    f"{photo['prefix']}original{photo['suffix']}" for photo in photos
-                ] if photos else ["No photo available"]
-            }
-
-            restaurants.append(restaurant_details)
-
-        return jsonify(restaurants)
+        places = foursquare.cached_search('restaurant', params, search_restaurants)
+        if wants_stream():
+            return ndjson_response(foursquare.iter_listing(places, format_restaurant, photos))
+        return jsonify(foursquare.build_listing(places, format_restaurant, photos))
 
     except requests.exceptions.RequestException as e:
-        print("FourSquare API Error:", e)
+        logger.warning("FourSquare API Error: %s", e)
         return jsonify({"error": str(e)}), 500
 
-# 注册蓝图
-app.register_blueprint(restaurant_blueprint, url_prefix='/restaurants')
-
-if __name__ == '__main__':
-    app.run(debug=True)
 #http://127.0.0.1:5000/restaurants/?city=New%20York&radius=1000&limit=3
\ No newline at end of file
@@ -0,0 +1,62 @@
+import threading
+
+
+class SingleFlightTimeout(TimeoutError):
+    """等待其他调用者的结果超时"""
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    合并同一个 key 的并发调用：第一个调用者执行函数，
+    其余调用者等待并共享同一个结果（或异常）。
+    等待者可以设置 timeout，超时抛出 SingleFlightTimeout，执行中的调用不受影响。
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def do(self, key, fn, timeout=None):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            if not call.event.wait(timeout):
+                self.timeouts += 1
+                raise SingleFlightTimeout(f"Timed out waiting for in-flight call {key!r}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def stats(self):
+        return {"executed": self.executed, "coalesced": self.coalesced, "timeouts": self.timeouts}
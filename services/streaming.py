@@ -0,0 +1,39 @@
+import contextvars
+import json
+from flask import Response, request, stream_with_context
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def wants_stream():
+    """客户端通过 ?stream=1 或 Accept: application/x-ndjson 选择流式返回"""
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    # 只认明确写出的 application/x-ndjson，*/* 仍然返回普通 JSON
+    return any(mimetype == NDJSON_MIMETYPE and quality > 0 for mimetype, quality in request.accept_mimetypes)
+
+
+def ndjson_response(items):
+    """
+    每个元素一行 JSON，生成一个就发送一个，整个列表不会留在内存里
+    """
+    def generate():
+        for item in items:
+            yield json.dumps(item, ensure_ascii=False) + '\n'
+
+    # 响应体在视图函数返回之后才生成：在请求上下文变量的快照里执行，
+    # 这时发出的上游调用仍然带着这个请求的 ID，并计入它的上游耗时统计
+    context = contextvars.copy_context()
+    lines = generate()
+
+    def in_request_context():
+        while True:
+            try:
+                yield context.run(next, lines)
+            except StopIteration:
+                return
+
+    response = Response(stream_with_context(in_request_context()), mimetype=NDJSON_MIMETYPE)
+    response.headers['X-Accel-Buffering'] = 'no'  # 避免反向代理缓冲整个响应
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
@@ -1,12 +1,15 @@
+import logging
 import os
-import requests
 import math
 from flask import Blueprint, jsonify, request
 from datetime import datetime,timedelta
-from dotenv import load_dotenv
+from services.geocoding import geocode, normalize_city
+from services import upstream, enrich
+from services.streaming import wants_stream, ndjson_response
+from services.cache import PersistentCache, CACHE_DIR, MISSING
+from services.cache_backends import make_cache, shared_cache
 
-# 加载 .env 文件中的环境变量
-load_dotenv()
+logger = logging.getLogger(__name__)
 
 train_blueprint = Blueprint('train', __name__)
 
@@ -14,22 +17,19 @@ train_blueprint = Blueprint('train', __name__)
 SNCF_API_KEY = os.getenv("SNCF_API_KEY")
 SNCF_BASE_URL = "https://api.sncf.com/v1/coverage/sncf"
 
-# Open-Meteo API (用于获取城市经纬度)
-OPEN_METEO_URL = "https://geocoding-api.open-meteo.com/v1/search"
+# 城市对应的站点 ID 几乎不变，持久化缓存（CACHE_BACKEND 为 sqlite / redis 时放进共享缓存）；
+# 找不到站点的城市只缓存一天
+STATION_CACHE_PATH = os.getenv('STATION_CACHE_PATH', os.path.join(CACHE_DIR, 'stations.sqlite3'))
+STATION_CACHE_TTL = int(os.getenv('STATION_CACHE_TTL', 30 * 24 * 3600))
+STATION_NEGATIVE_TTL = int(os.getenv('STATION_NEGATIVE_TTL', 24 * 3600))
+STATION_CACHE_SIZE = int(os.getenv('STATION_CACHE_SIZE', 20000))
+_station_cache = shared_cache('stations', STATION_CACHE_SIZE, STATION_CACHE_TTL)
+if _station_cache is None:
+    _station_cache = PersistentCache(STATION_CACHE_PATH, ttl=STATION_CACHE_TTL, name='stations', snapshot=True)
 
-# 获取城市的经纬度
-def get_city_coordinates(city_name):
-    url = f"{OPEN_METEO_URL}?name={city_name}&count=1"
-    try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            data = response.json()
-            if "results" in data and len(data["results"]) > 0:
-                city_info = data["results"][0]
-                return city_info["latitude"], city_info["longitude"]
-    except Exception as e:
-        print(f"Error fetching city coordinates: {e}")
-    return None, None  # 查询失败返回空值
+# 列车时刻按（出发站, 到达站, 时间窗口）缓存
+JOURNEY_CACHE_TTL = int(os.getenv('JOURNEY_CACHE_TTL', 300))
+_journey_cache = make_cache('journeys', int(os.getenv('JOURNEY_CACHE_SIZE', 1024)), JOURNEY_CACHE_TTL)
 
 # Haversine 公式计算两地之间的直线距离
 def haversine(lat1, lon1, lat2, lon2):
@@ -47,14 +47,22 @@ def haversine(lat1, lon1, lat2, lon2):
 def get_station_id(city_name):
     if not SNCF_API_KEY:
         return None  # 如果 API Key 为空，返回 None
+    key = normalize_city(city_name)
+    station_id = _station_cache.get(key)
+    if station_id is not MISSING:
+        return station_id
+
     url = f"{SNCF_BASE_URL}/places?q={city_name}"
-    response = requests.get(url, auth=(SNCF_API_KEY, ""))
-    if response.status_code == 200:
-        data = response.json()
-        for place in data.get("places", []):
-            if place.get("embedded_type") == "stop_area":
-                return place["id"]
-    return None
+    response = upstream.get(url, auth=(SNCF_API_KEY, ""))
+    if response.status_code != 200:
+        return None  # 上游出错时不缓存
+    station_id = None
+    for place in response.json().get("places", []):
+        if place.get("embedded_type") == "stop_area":
+            station_id = place["id"]
+            break
+    _station_cache.set(key, station_id, ttl=STATION_CACHE_TTL if station_id else STATION_NEGATIVE_TTL)
+    return station_id
 
 def calculate_train_price(distance):
     """
@@ -79,59 +87,57 @@ def calculate_train_price(distance):
     return round(price,0)  # 保留 2 位小数
 
 def fetch_train_data(origin_id, destination_id, date):
-    """调用 SNCF API 获取列车数据"""
-    api_url = f"{SNCF_BASE_URL}/journeys?from={origin_id}&to={destination_id}&datetime={date}&count=40"
-    print(f"API URL: {api_url}")
-    response = requests.get(api_url, auth=(SNCF_API_KEY, ""))
-    return response
-
-@train_blueprint.route('/', methods=['GET'])
-def get_train_schedule():
-    print("Train schedule endpoint hit")
+    """调用 SNCF API 获取列车数据，返回 journeys 列表；请求失败返回 None"""
+    key = (origin_id, destination_id, date)
+    journeys = _journey_cache.get(key)
+    if journeys is not MISSING:
+        return journeys
 
-    # 获取用户输入的参数
-    origin = request.args.get('origin')
-    destination = request.args.get('destination')
-    date = request.args.get('date')
-
-    if not origin or not destination:
-        return jsonify({"error": "Origin and destination are required"}), 400
-
-    # 获取城市的经纬度
-    origin_lat, origin_lon = get_city_coordinates(origin)
-    destination_lat, destination_lon = get_city_coordinates(destination)
+    api_url = f"{SNCF_BASE_URL}/journeys?from={origin_id}&to={destination_id}&datetime={date}&count=40"
+    logger.debug("API URL: %s", api_url)
+    response = upstream.get(api_url, auth=(SNCF_API_KEY, ""))
+    if response.status_code != 200:
+        return None
+    logger.debug("SNCF API request successful")
+    journeys = response.json().get("journeys", [])
+    _journey_cache.set(key, journeys)
+    return journeys
+
+def cache_stats():
+    return {"stations": _station_cache.stats(), "journeys": _journey_cache.stats()}
+
+def prepare_train_search(origin, destination, date=None):
+    """
+    查询前的准备：坐标、站点 ID 和要查询的时间窗口。
+    返回 (查询参数, 200) 或 ({"error": ...}, 404)
+    """
+    # 两个城市的经纬度和 SNCF 站点 ID 互不依赖，四个请求并发发出；
+    # 地理编码占用 geocode 的并发配额，只有站点查询占用 sncf 的
+    (origin_lat, origin_lon), (destination_lat, destination_lon), origin_id, destination_id = enrich.run_ordered([
+        lambda: geocode(origin),
+        lambda: geocode(destination),
+        lambda: get_station_id(origin),
+        lambda: get_station_id(destination),
+    ], upstream=['geocode', 'geocode', 'sncf', 'sncf'], default=lambda i: (None, None) if i < 2 else None)
 
     if origin_lat is None or destination_lat is None:
-        return jsonify({"error": f"Could not find coordinates for '{origin}' or '{destination}'"}), 404
+        return {"error": f"Could not find coordinates for '{origin}' or '{destination}'"}, 404
 
     # 计算两地之间的直线距离
     distance = haversine(origin_lat, origin_lon, destination_lat, destination_lon)
 
-    # 获取 SNCF 站点 ID
-    origin_id = get_station_id(origin)
-    destination_id = get_station_id(destination)
-
-    print(f"Origin ID: {origin_id}, Destination ID: {destination_id}")
+    logger.debug("Origin ID: %s, Destination ID: %s", origin_id, destination_id)
 
     if not origin_id or not destination_id:
-        return jsonify({"error": f"Invalid origin or destination: '{origin}' or '{destination}'"}), 404
+        return {"error": f"Invalid origin or destination: '{origin}' or '{destination}'"}, 404
 
     # 处理 `date` 为空的情况，默认查询当天 06:00 和 14:00 两个时间段
     if not date:
         today = datetime.now().strftime("%Y-%m-%d")
-        morning_date = f"{today} 06:00"
-        afternoon_date = f"{today} 14:00"
-
-        morning_response = fetch_train_data(
-            origin_id, destination_id,
-            datetime.strptime(morning_date, "%Y-%m-%d %H:%M").strftime("%Y%m%dT%H%M%S")
-        )
-        afternoon_response = fetch_train_data(
-            origin_id, destination_id,
-            datetime.strptime(afternoon_date, "%Y-%m-%d %H:%M").strftime("%Y%m%dT%H%M%S")
-        )
-
-        responses = [morning_response, afternoon_response]
+        windows = [
+            datetime.strptime(f"{today} {hour}", "%Y-%m-%d %H:%M").strftime("%Y%m%dT%H%M%S")
+            for hour in ("06:00", "14:00")
+        ]
     else:
         try:
             # 如果日期带有时间
@@ -140,18 +146,26 @@ def get_train_schedule():
             # 如果日期只有年月日，补全时间为早上 06:00
             dt_object = datetime.strptime(date, "%Y-%m-%d") + timedelta(hours=6)
 
-        formatted_date = dt_object.strftime("%Y%m%dT%H%M%S")
-        responses = [fetch_train_data(origin_id, destination_id, formatted_date)]
+        windows = [dt_object.strftime("%Y%m%dT%H%M%S")]
 
+    return {"origin_id": origin_id, "destination_id": destination_id, "distance": distance, "windows": windows}, 200
 
-    journeys = []
+def iter_journeys(origin, destination, search):
+    """
+    按时间段顺序逐个生成统一格式的列车；各时间段的查询并发发出，
+    某个时间段一返回就开始生成，不必等其他时间段
+    """
+    distance = search["distance"]
+    results = enrich.iter_ordered(
+        [lambda window=window: fetch_train_data(search["origin_id"], search["destination_id"], window)
+         for window in search["windows"]],
+        upstream='sncf'
+    )
 
     # 解析 API 返回的列车信息
-    for response in responses:
-        if response.status_code == 200:
-            print("SNCF API request successful")
-            data = response.json()
-            for journey in data.get("journeys", []):
+    for result in results:
+        if result is not None:
+            for journey in result:
                 # 获取出发时间、到达时间和时长
                 departure_time = journey["departure_date_time"]
                 arrival_time = journey["arrival_date_time"]
@@ -166,7 +180,7 @@ def get_train_schedule():
                 price_range = f"{calculate_train_price(distance)}"
 
                 # 统一返回格式
-                journeys.append({
+                yield {
                     "from": origin,  # 返回城市名
                     "to": destination,  # 返回城市名
                     "date": departure_dt.strftime("%d %b"),  # 格式化日期
@@ -175,9 +189,49 @@ def get_train_schedule():
                     "type": "train",
                     "price": price_range,
                     "distance": str(distance)
-                })
+                }
 
+def search_trains(origin, destination, date=None):
+    """
+    查询两个城市之间的列车，返回 (结果, HTTP 状态码)：
+    成功时结果是统一格式的列车列表，失败时是 {"error": ...}
+    """
+    search, status = prepare_train_search(origin, destination, date)
+    if status != 200:
+        return search, status
+
+    journeys = list(iter_journeys(origin, destination, search))
     if not journeys:
-        return jsonify({"error": "No trains available"}), 404
+        return {"error": "No trains available"}, 404
+
+    return journeys, 200
+
+def _stream_journeys(origin, destination, search):
+    found = False
+    for journey in iter_journeys(origin, destination, search):
+        found = True
+        yield journey
+    if not found:
+        # 流已经以 200 开始，没有车次时在最后一行说明
+        yield {"error": "No trains available"}
+
+@train_blueprint.route('/', methods=['GET'])
+def get_train_schedule():
+    logger.debug("Train schedule endpoint hit")
+
+    # 获取用户输入的参数
+    origin = request.args.get('origin')
+    destination = request.args.get('destination')
+    date = request.args.get('date')
+
+    if not origin or not destination:
+        return jsonify({"error": "Origin and destination are required"}), 400
+
+    if wants_stream():
+        search, status = prepare_train_search(origin, destination, date)
+        if status != 200:
+            return jsonify(search), status
+        return ndjson_response(_stream_journeys(origin, destination, search))
 
-    return jsonify(journeys)
+    result, status = search_trains(origin, destination, date)
+    return jsonify(result), status
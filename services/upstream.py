@@ -0,0 +1,241 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from services.singleflight import SingleFlight, SingleFlightTimeout
+from services import ratelimit, metrics
+
+# 连接池与超时配置（秒），可通过环境变量调整
+UPSTREAM_POOL_CONNECTIONS = int(os.getenv('UPSTREAM_POOL_CONNECTIONS', 4))
+UPSTREAM_POOL_MAXSIZE = int(os.getenv('UPSTREAM_POOL_MAXSIZE', 16))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', 3.05))
+UPSTREAM_READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', 10))
+
+# 幂等请求（GET）的重试次数与退避基数
+UPSTREAM_RETRIES = int(os.getenv('UPSTREAM_RETRIES', 2))
+UPSTREAM_BACKOFF = float(os.getenv('UPSTREAM_BACKOFF', 0.2))
+UPSTREAM_MAX_BACKOFF = float(os.getenv('UPSTREAM_MAX_BACKOFF', 2))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+# 相同的并发 GET 只发一次：其余调用者等待并共享同一个响应，最多等待 UPSTREAM_COALESCE_TIMEOUT 秒
+UPSTREAM_COALESCE = os.getenv('UPSTREAM_COALESCE', '1') != '0'
+UPSTREAM_COALESCE_TIMEOUT = float(os.getenv('UPSTREAM_COALESCE_TIMEOUT', 15))
+
+# 把所有上游请求转发到同一个地址（基准测试的本地假上游）：
+# https://api.foursquare.com/v3/places -> {UPSTREAM_BASE_OVERRIDE}/api.foursquare.com/v3/places
+UPSTREAM_BASE_OVERRIDE = os.getenv('UPSTREAM_BASE_OVERRIDE', '').rstrip('/')
+
+# 每个上游保留最近多少次耗时用于计算分位数
+LATENCY_WINDOW = 512
+
+_sessions = {}
+_sessions_pid = os.getpid()
+_lock = threading.Lock()
+_stats = {}
+_flight = SingleFlight()
+
+
+class _HostStats:
+    __slots__ = ('calls', 'errors', 'retries', 'coalesced', 'total_ms', 'max_ms', 'recent')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.coalesced = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.recent = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, elapsed_ms, error):
+        self.calls += 1
+        self.errors += error
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.recent.append(elapsed_ms)
+
+    def summary(self):
+        recent = sorted(self.recent)
+
+        def pct(p):
+            return round(recent[min(len(recent) - 1, int(p * len(recent)))], 1) if recent else None
+
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "coalesced": self.coalesced,
+            "avg_ms": round(self.total_ms / self.calls, 1) if self.calls else None,
+            "p50_ms": pct(0.50),
+            "p95_ms": pct(0.95),
+            "max_ms": round(self.max_ms, 1),
+        }
+
+
+def _host(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _target(url):
+    """应用 UPSTREAM_BASE_OVERRIDE 后实际请求的地址"""
+    if not UPSTREAM_BASE_OVERRIDE:
+        return url
+    parts = urlsplit(url)
+    target = f"{UPSTREAM_BASE_OVERRIDE}/{parts.netloc}{parts.path}"
+    return f"{target}?{parts.query}" if parts.query else target
+
+
+def session_for(url):
+    """
+    每个上游主机一个带连接池的 Session，复用 TCP/TLS 连接
+    """
+    global _sessions_pid
+    host = _host(url)
+    with _lock:
+        # gunicorn fork 之后不能沿用父进程的连接
+        if _sessions_pid != os.getpid():
+            _sessions.clear()
+            _sessions_pid = os.getpid()
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=UPSTREAM_POOL_CONNECTIONS, pool_maxsize=UPSTREAM_POOL_MAXSIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[host] = session
+        return session
+
+
+def _host_stats(host):
+    with _lock:
+        stats = _stats.get(host)
+        if stats is None:
+            stats = _stats[host] = _HostStats()
+        return stats
+
+
+def _retry_after(response):
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    return float(retry_after) if retry_after and retry_after.isdigit() else None
+
+
+def _backoff(attempt, response=None):
+    """带随机抖动的指数退避；上游给出 Retry-After 时以它为准"""
+    retry_after = _retry_after(response)
+    if retry_after is not None:
+        return min(retry_after, UPSTREAM_MAX_BACKOFF)
+    return random.uniform(0, min(UPSTREAM_MAX_BACKOFF, UPSTREAM_BACKOFF * (2 ** attempt)))
+
+
+def request(method, url, **kwargs):
+    """
+    发送上游请求：默认带连接/读取超时，幂等请求在网络错误或 429/5xx 时重试。
+    配置了配额的主机每次发送前先从限流器取令牌，rate_wait 为最多愿意等待的秒数。
+    返回 requests.Response，失败时抛出 requests.exceptions.RequestException；
+    配额不足时立即抛出 ratelimit.RateLimited。
+    """
+    method = method.upper()
+    kwargs.setdefault('timeout', (UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT))
+    rate_wait = kwargs.pop('rate_wait', None)
+    retries = UPSTREAM_RETRIES if method in IDEMPOTENT_METHODS else 0
+    # 统计和限流按原始主机，连接按实际地址
+    target = _target(url)
+    session = session_for(target)
+    stats = _host_stats(_host(url))
+    hostname = urlsplit(url).hostname
+
+    attempt = 0
+    while True:
+        ratelimit.acquire(hostname, rate_wait)
+        start = time.perf_counter()
+        try:
+            response = session.request(method, target, **kwargs)
+            if not kwargs.get('stream'):
+                response.content  # 计时和字节数包含响应体
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            elapsed = time.perf_counter() - start
+            stats.record(elapsed * 1000, True)
+            metrics.observe_upstream(hostname, elapsed, True, 0)
+            if attempt >= retries:
+                raise
+            response = None
+        else:
+            elapsed = time.perf_counter() - start
+            failed = response.status_code in RETRY_STATUSES
+            stats.record(elapsed * 1000, failed)
+            metrics.observe_upstream(
+                hostname, elapsed, response.status_code >= 400,
+                0 if kwargs.get('stream') else len(response.content)
+            )
+            if response.status_code == 429:
+                # 所有 worker 一起暂停，而不是各自重试
+                ratelimit.penalize(hostname, _retry_after(response))
+            if not failed or attempt >= retries:
+                return response
+        if response is None or response.status_code != 429 or not ratelimit.governs(hostname):
+            time.sleep(_backoff(attempt, response))
+        attempt += 1
+        stats.retries += 1
+
+
+def _freeze(value):
+    """把参数、请求头等转换为可哈希的形式，作为合并请求的 key"""
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _load(url, kwargs, leader):
+    leader.append(True)
+    # request 已读完响应体，等待者共享的响应不再依赖连接
+    return request('GET', url, **kwargs)
+
+
+def get(url, coalesce=True, **kwargs):
+    """
+    GET 请求。coalesce 为 True 时，与正在进行中的相同请求（URL、参数、请求头、认证都相同）
+    合并为一次上游调用；等待超时抛出 requests.exceptions.Timeout。
+    """
+    if not (coalesce and UPSTREAM_COALESCE) or kwargs.get('stream'):
+        return request('GET', url, **kwargs)
+    try:
+        key = (url, _freeze({k: v for k, v in kwargs.items() if k not in ('timeout', 'rate_wait')}))
+        hash(key)
+    except TypeError:
+        return request('GET', url, **kwargs)
+
+    leader = []
+    try:
+        response = _flight.do(key, lambda: _load(url, kwargs, leader), timeout=UPSTREAM_COALESCE_TIMEOUT)
+    except SingleFlightTimeout as e:
+        _host_stats(_host(url)).coalesced += 1
+        raise requests.exceptions.Timeout(str(e))
+    if not leader:
+        _host_stats(_host(url)).coalesced += 1
+    return response
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def stats():
+    """按上游主机统计调用次数、错误数、被合并的调用数和耗时分位数"""
+    with _lock:
+        hosts = list(_stats.items())
+    return {host: host_stats.summary() for host, host_stats in hosts}
+
+
+def coalesce_stats():
+    """合并请求的总体统计：实际执行、被合并、等待超时的次数"""
+    return _flight.stats()
@@ -1,50 +1,205 @@
+import logging
 from flask import Blueprint, request, jsonify
-import requests
-from dotenv import load_dotenv
-load_dotenv()
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import os
+import requests
+from services import upstream, enrich, ratelimit
+from services.cache import MISSING
+from services.cache_backends import make_cache
+from services.singleflight import SingleFlight
+from services.geocoding import normalize_city
+from services.params import city_list
+
+logger = logging.getLogger(__name__)
+
 weather_blueprint = Blueprint('weather', __name__)
 
 # OpenWeatherMap API 配置信息
 API_KEY = os.getenv('OPENWEATHERMAP_API_KEY')
 BASE_URL = 'http://api.openweathermap.org/data/2.5/weather'
+FORECAST_URL = 'http://api.openweathermap.org/data/2.5/forecast'
 
-@weather_blueprint.route('/', methods=['GET'])
-def get_weather():
-    city = request.args.get('city')
-    date_str = request.args.get('date')  # 假设日期是通过 'date' 参数传递的，例如 'C'
+# OpenWeatherMap 大约每 10 分钟更新一次数据，缓存时间与之对齐
+WEATHER_CACHE_TTL = int(os.getenv('WEATHER_CACHE_TTL', 600))
+WEATHER_CACHE_SIZE = int(os.getenv('WEATHER_CACHE_SIZE', 1024))
+_current_cache = make_cache('weather', WEATHER_CACHE_SIZE, WEATHER_CACHE_TTL)
+# 5 天 / 3 小时预报：每个城市拉取一次，本地回答窗口内任意日期
+_forecast_cache = make_cache('forecast', WEATHER_CACHE_SIZE, WEATHER_CACHE_TTL)
+# 同一城市的并发查询只调用一次上游
+_flight = SingleFlight()
 
-    if not city:
-        return jsonify({"error": "Please provide a city name"}), 400
+# 批量接口一次最多查询的城市数
+WEATHER_BATCH_MAX = int(os.getenv('WEATHER_BATCH_MAX', 50))
+
+
+def _fetch(url, cache, city):
+    """
+    查询 OpenWeatherMap 并按城市缓存成功的结果。
+    返回 (data, status_code)，失败时 data 为 None。
+    """
+    key = normalize_city(city)
+    data = cache.get(key)
+    if data is not MISSING:
+        return data, 200
+
+    return _flight.do((url, key), lambda: _load(url, cache, key, city))
 
-    # 验证和解析日期
-    if date_str:
-        try:
-            date = datetime.strptime(date_str, '%Y-%m-%d')
-            # 在这里，你可以进一步使用日期进行天气数据的预测，具体取决于 API 的功能
-        except ValueError:
-            return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
 
-    # 使用 OpenWeatherMap API 获取天气信息
+def _load(url, cache, key, city):
     params = {
         'q': city,
         'appid': API_KEY,
         'units': 'metric'
     }
-    response = requests.get(BASE_URL, params=params)
-
-    if response.status_code == 200:
-        data = response.json()
-        weather_description = data['weather'][0]['description']
-        temperature = data['main']['temp']
-        result = {
-            "city": city,
-            "temperature": temperature,
-            "weather": weather_description,
-            "date": date_str if date_str else "current"
-        }
-        return jsonify(result)
-    else:
-        return jsonify({'error': 'Failed to retrieve weather data'}), response.status_code
+    response = upstream.get(url, params=params)
+    if response.status_code != 200:
+        return None, response.status_code
+    data = response.json()
+    cache.set(key, data)
+    return data, 200
+
+
+def fetch_current_weather(city):
+    return _fetch(BASE_URL, _current_cache, city)
+
+
+def fetch_forecast(city):
+    return _fetch(FORECAST_URL, _forecast_cache, city)
+
+
+def forecast_for_date(forecast, date):
+    """
+    从预报中挑出指定日期当地中午最近的一条；日期不在预报窗口内返回 None
+    """
+    offset = timedelta(seconds=forecast.get('city', {}).get('timezone', 0))
+    target = datetime(date.year, date.month, date.day, 12, tzinfo=timezone.utc) - offset
+    best = None
+    for entry in forecast.get('list', []):
+        entry_time = datetime.fromtimestamp(entry['dt'], tz=timezone.utc)
+        if (entry_time + offset).date() != date.date():
+            continue
+        if best is None or abs(entry_time - target) < abs(best[0] - target):
+            best = (entry_time, entry)
+    return best[1] if best else None
+
+
+def cache_stats():
+    return {"current": _current_cache.stats(), "forecast": _forecast_cache.stats()}
+
+
+def get_weather_for(city, date_str=None):
+    """
+    查询一个城市的天气，返回 (result, status_code)。
+    - 没有日期或日期是今天：当前天气
+    - 日期在未来 5 天内：使用缓存的预报
+    - 其他日期：和以前一样返回当前天气
+    """
+    date = None
+    if date_str:
+        try:
+            date = datetime.strptime(date_str, '%Y-%m-%d')
+        except ValueError:
+            return {"error": "Invalid date format. Use YYYY-MM-DD"}, 400
+
+    entry = None
+    if date and date.date() > datetime.now().date():
+        forecast, status = fetch_forecast(city)
+        if forecast is None:
+            return {'error': 'Failed to retrieve weather data'}, status
+        entry = forecast_for_date(forecast, date)
+
+    if entry is None:
+        entry, status = fetch_current_weather(city)
+        if entry is None:
+            return {'error': 'Failed to retrieve weather data'}, status
+
+    return {
+        "city": city,
+        "temperature": entry['main']['temp'],
+        "weather": entry['weather'][0]['description'],
+        "date": date_str if date_str else "current"
+    }, 200
+
+
+@weather_blueprint.route('/', methods=['GET'])
+def get_weather():
+    city = request.args.get('city')
+    date_str = request.args.get('date')  # 假设日期是通过 'date' 参数传递的，例如 'C'
+
+    if not city:
+        return jsonify({"error": "Please provide a city name"}), 400
+
+    result, status = get_weather_for(city, date_str)
+    return jsonify(result), status
 #http://127.0.0.1:5000/weather?city=London&date=2024-12-09
+
+
+def _batch_items():
+    """
+    解析批量请求，返回 [(city, date), ...]：
+    - GET  /weather/batch?cities=Paris,Nice&dates=2024-12-09,
+    - POST {"cities": [...], "dates": [...]} 或 [{"city": ..., "date": ...}, ...]
+    格式不对（城市或日期不是字符串）时抛出 ValueError
+    """
+    body = request.get_json(silent=True) if request.method == 'POST' else None
+    if isinstance(body, list):
+        items = []
+        for item in body:
+            if (not isinstance(item, dict) or not isinstance(item.get('city'), str)
+                    or not isinstance(item.get('date'), (str, type(None)))):
+                raise ValueError('Each item must be {"city": "...", "date": "YYYY-MM-DD"}')
+            items.append((item['city'], item.get('date')))
+        return items
+    # 城市和日期按位置对应，空项也保留（空城市由调用方返回 400）
+    cities, dates = city_list('cities', keep_empty=True), city_list('dates', keep_empty=True)
+    return [(city, dates[i] if i < len(dates) else None) for i, city in enumerate(cities)]
+
+
+def _weather_or_error(city, date_str):
+    """批量查询中单个城市失败不影响其他城市"""
+    try:
+        return get_weather_for(city, date_str)
+    except requests.exceptions.RequestException as e:
+        logger.warning("Weather API Error for %s: %s", city, e)
+        return {'error': 'Failed to retrieve weather data'}, 502
+    except ratelimit.RateLimited as e:
+        return {'error': str(e), 'retry_after': round(e.retry_after, 1)}, 503
+
+
+@weather_blueprint.route('/batch', methods=['GET', 'POST'])
+def get_weather_batch():
+    """
+    一次查询多个城市的天气，结果顺序与请求一致。
+    重复的（城市, 日期）只查询一次，未命中缓存的城市并发请求上游。
+    """
+    try:
+        items = [(city.strip(), (date or '').strip() or None) for city, date in _batch_items()]
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not items or not all(city for city, _ in items):
+        return jsonify({"error": "Please provide a list of city names"}), 400
+    if len(items) > WEATHER_BATCH_MAX:
+        return jsonify({"error": f"At most {WEATHER_BATCH_MAX} cities per batch"}), 400
+
+    # 去重：同一城市不同写法共用一个查询
+    unique = {}
+    for city, date in items:
+        unique.setdefault((normalize_city(city), date), (city, date))
+    keys = list(unique)
+    results = enrich.run_ordered(
+        [lambda city=city, date=date: _weather_or_error(city, date) for city, date in unique.values()],
+        upstream='openweathermap',
+        default=({'error': 'Weather request timed out'}, 504)
+    )
+    by_key = dict(zip(keys, results))
+
+    response = []
+    for city, date in items:
+        result, status = by_key[(normalize_city(city), date)]
+        if status != 200:
+            result = {**result, "city": city, "date": date if date else "current", "status": status}
+        else:
+            result = {**result, "city": city}
+        response.append(result)
+    return jsonify(response)
+#http://127.0.0.1:5000/weather/batch?cities=London,Paris,Nice&dates=2024-12-09,,2024-12-10